@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""Compare two stored benchmark runs and exit non-zero on a performance regression.
+
+    python3 benchmark-runner/compare.py                      # baseline vs latest run
+    python3 benchmark-runner/compare.py a1b2c3 latest        # a git revision vs latest
+    python3 benchmark-runner/compare.py --set-baseline       # promote the latest run to baseline
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import random
+import statistics
+import sys
+from typing import Any
+
+from store import load_ref, set_baseline
+
+LOAD_PERCENTILES = (("p50_ms", 0.50), ("p99_ms", 0.99), ("p999_ms", 0.999))
+RESOURCE_METRICS = ("peak_rss_mb", "mean_rss_mb", "cpu_s_per_1k_requests", "startup_ms")
+LOAD_SETTINGS = ("mode", "users", "target_rps", "duration_s", "mix")
+MIN_TRIALS = 3
+
+
+def bootstrap_change_ci(base: list[float], cand: list[float], resamples: int = 2000, alpha: float = 0.05) -> tuple[float, float, float] | None:
+    """Relative change of the median (cand/base - 1) with a percentile-bootstrap confidence interval."""
+    if statistics.median(base) <= 0:
+        return None
+    rng = random.Random(0)
+    changes = []
+    for _ in range(resamples):
+        b = statistics.median(rng.choices(base, k=len(base)))
+        if b > 0:
+            changes.append(statistics.median(rng.choices(cand, k=len(cand))) / b - 1)
+    changes.sort()
+    change = statistics.median(cand) / statistics.median(base) - 1
+    return change, changes[int(alpha / 2 * len(changes))], changes[int((1 - alpha / 2) * len(changes)) - 1]
+
+
+def histogram_quantile_ci(buckets: list[list[float]], q: float, z: float = 1.96) -> tuple[float, float, float] | None:
+    """Quantile q of a latency histogram with a distribution-free (order statistic) confidence interval."""
+    n = sum(int(c) for _, c in buckets)
+    if not n:
+        return None
+
+    def at(rank: float) -> float:
+        rank = min(max(int(rank), 1), n)
+        seen = 0
+        for upper, count in buckets:
+            seen += int(count)
+            if seen >= rank:
+                return upper
+        return buckets[-1][0]
+
+    half = z * math.sqrt(n * q * (1 - q))
+    return at(math.ceil(n * q)), at(math.floor(n * q - half)), at(math.ceil(n * q + half))
+
+
+def row(impl: str, metric: str, base: float | None, cand: float | None, change: float | None = None,
+        lo: float | None = None, hi: float | None = None, verdict: str = "ok") -> dict[str, Any]:
+    return {"implementation": impl, "metric": metric, "base": base, "candidate": cand, "change": change, "ci": [lo, hi], "verdict": verdict}
+
+
+def judge(change: float, lo: float | None, hi: float | None, threshold: float, higher_is_better: bool = False) -> str:
+    """Regression: worse by more than `threshold` and, when a CI exists, the whole CI on the worse side of 0."""
+    if higher_is_better:
+        change, lo, hi = -change, (None if hi is None else -hi), (None if lo is None else -lo)
+    if change > threshold and (lo is None or lo > 0):
+        return "regression"
+    if change < -threshold and (hi is None or hi < 0):
+        return "improvement"
+    return "ok"
+
+
+def compare_scenario(impl: str, base: dict[str, Any], cand: dict[str, Any], threshold: float) -> list[dict[str, Any]]:
+    rows = []
+    base_samples = base.get("timings_samples_ms") or {k: [v] for k, v in base.get("timings_ms", {}).items()}
+    cand_samples = cand.get("timings_samples_ms") or {k: [v] for k, v in cand.get("timings_ms", {}).items()}
+    for key in sorted(set(base_samples) & set(cand_samples)):
+        b, c = base_samples[key], cand_samples[key]
+        if min(len(b), len(c)) < MIN_TRIALS:
+            rows.append(row(impl, f"scenario.{key}", statistics.median(b), statistics.median(c), verdict=f"n/a (needs --trials >= {MIN_TRIALS})"))
+            continue
+        ci = bootstrap_change_ci(b, c)
+        if ci is None:
+            continue
+        change, lo, hi = ci
+        rows.append(row(impl, f"scenario.{key}", statistics.median(b), statistics.median(c), change, lo, hi, judge(change, lo, hi, threshold)))
+    return rows
+
+
+def compare_load(impl: str, base: dict[str, Any], cand: dict[str, Any], threshold: float, error_threshold: float) -> list[dict[str, Any]]:
+    if any(base.get(k) != cand.get(k) for k in LOAD_SETTINGS):
+        return [row(impl, "load", None, None, verdict="n/a (load settings differ)")]
+    rows = []
+    for name in sorted(set(base["endpoints"]) & set(cand["endpoints"])) + ["total"]:
+        b = base["total"] if name == "total" else base["endpoints"][name]
+        c = cand["total"] if name == "total" else cand["endpoints"][name]
+        for key, q in LOAD_PERCENTILES:
+            bq, cq = histogram_quantile_ci(b.get("histogram", []), q), histogram_quantile_ci(c.get("histogram", []), q)
+            if bq is None or cq is None:
+                continue
+            change = cq[0] / bq[0] - 1
+            lo, hi = cq[1] / bq[2] - 1, cq[2] / bq[1] - 1
+            rows.append(row(impl, f"load.{name}.{key}", bq[0], cq[0], change, lo, hi, judge(change, lo, hi, threshold)))
+        for key in ("error_rate", "rate_limited_rate"):
+            if key not in b or key not in c:
+                continue
+            diff = c[key] - b[key]
+            verdict = "regression" if diff > error_threshold else "improvement" if diff < -error_threshold else "ok"
+            rows.append(row(impl, f"load.{name}.{key}", b[key], c[key], diff, verdict=verdict))
+    if base["mode"] == "closed" and base["total"]["rps"]:
+        change = cand["total"]["rps"] / base["total"]["rps"] - 1
+        rows.append(row(impl, "load.total.rps", base["total"]["rps"], cand["total"]["rps"], change, verdict=judge(change, None, None, threshold, True)))
+    return rows
+
+
+def compare_resources(impl: str, base: dict[str, Any], cand: dict[str, Any], threshold: float) -> list[dict[str, Any]]:
+    rows = []
+    for key in RESOURCE_METRICS:
+        b, c = base.get(key), cand.get(key)
+        if not b or c is None:
+            continue
+        change = c / b - 1
+        rows.append(row(impl, f"resources.{key}", b, c, change, verdict=judge(change, None, None, threshold)))
+    return rows
+
+
+def compare(base: dict[str, dict[str, Any]], cand: dict[str, dict[str, Any]], threshold: float, error_threshold: float) -> list[dict[str, Any]]:
+    rows: list[dict[str, Any]] = []
+    for impl in sorted(set(base) & set(cand)):
+        b, c = base[impl]["result"], cand[impl]["result"]
+        if b.get("passed") and not c.get("passed"):
+            rows.append(row(impl, "checks", 1, 0, verdict="regression"))
+        rows += compare_scenario(impl, b, c, threshold)
+        if b.get("load") and c.get("load"):
+            rows += compare_load(impl, b["load"], c["load"], threshold, error_threshold)
+        rows += compare_resources(impl, b.get("resources", {}), c.get("resources", {}), threshold)
+    return rows
+
+
+def fmt(v: float | None, pct: bool = False) -> str:
+    if v is None:
+        return "-"
+    return f"{v * 100:+.1f}%" if pct else f"{v:.3f}"
+
+
+def render(rows: list[dict[str, Any]], show_all: bool) -> str:
+    shown = [r for r in rows if show_all or r["verdict"] != "ok"]
+    lines = [f"{'implementation':<16} {'metric':<36} {'base':>10} {'candidate':>10} {'change':>8} {'95% CI':>19}  verdict"]
+    for r in shown:
+        lo, hi = r["ci"]
+        ci = f"[{fmt(lo, True)}, {fmt(hi, True)}]" if lo is not None else "-"
+        pct = not r["metric"].endswith("_rate")
+        lines.append(f"{r['implementation']:<16} {r['metric']:<36} {fmt(r['base']):>10} {fmt(r['candidate']):>10} {fmt(r['change'], pct):>8} {ci:>19}  {r['verdict']}")
+    regressions = sum(1 for r in rows if r["verdict"] == "regression")
+    lines.append(f"\n{len(rows)} metrics compared, {regressions} regression(s), {sum(1 for r in rows if r['verdict'] == 'improvement')} improvement(s)")
+    return "\n".join(lines)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Compare stored benchmark runs; exits 1 on regression.")
+    parser.add_argument("base", nargs="?", default="baseline", help="baseline | latest | git revision | record or report file")
+    parser.add_argument("candidate", nargs="?", default="latest", help="same forms as base (default: latest)")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative change that counts as a regression (default 0.10)")
+    parser.add_argument("--error-threshold", type=float, default=0.01, help="absolute error-rate increase that counts as a regression")
+    parser.add_argument("--all", action="store_true", help="print unchanged metrics too")
+    parser.add_argument("--json", help="also write the comparison rows to this file")
+    parser.add_argument("--set-baseline", nargs="?", const="latest", metavar="REF", help="store REF (default: latest) as the baseline and exit")
+    args = parser.parse_args()
+
+    try:
+        if args.set_baseline:
+            for path in set_baseline(args.set_baseline):
+                print(f"baseline: {path}")
+            return 0
+        base, cand = load_ref(args.base), load_ref(args.candidate)
+    except (LookupError, OSError, ValueError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 2
+    if not set(base) & set(cand):
+        print("error: the two runs have no implementation in common", file=sys.stderr)
+        return 2
+    rows = compare(base, cand, args.threshold, args.error_threshold)
+    print(render(rows, args.all))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
+    return 1 if any(r["verdict"] == "regression" for r in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""Throughput and gateway memory of GET /metrics/export over a seeded metric_snapshots table.
+
+    python3 benchmark-runner/export_bench.py                          # 10M rows, csv + ndjson + parquet
+    python3 benchmark-runner/export_bench.py --rows 1000000 --formats csv
+
+Seeds a fresh database cloned from the schema template, starts the target, streams each format
+to /dev/null and reports rows/s, MB/s, time to first byte and the target's peak RSS while streaming.
+"""
+from __future__ import annotations
+
+import argparse
+import http.client
+import json
+import os
+import secrets
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Any
+from urllib.parse import urlencode
+
+from loadgen import Session
+from provision import create_database, drop_database, prepare_template
+from run_benchmark import ROOT, TARGETS, wait_ready
+from sampler import ResourceSampler
+
+DATABASE = "bench_export"
+SOURCE_NAME = "export-bench"
+SEED_FROM = "2026-01-01T00:00:00+00:00"
+SEED_STEP_MS = 100
+SEED_CHUNK_ROWS = 1_000_000
+READ_SIZE = 1 << 20
+
+SQL_SOURCE = """
+    INSERT INTO opcua_sources (source_name, endpoint_url, namespace_uri)
+    VALUES (%s, 'opc.tcp://127.0.0.1:4840/metrics/server/', 'urn:argum:demo:metrics') RETURNING id
+"""
+SQL_PARTITIONS = "SELECT ensure_time_partitions('metric_snapshots', %s::timestamptz, interval '1 day', %s)"
+SQL_SEED = """
+    INSERT INTO metric_snapshots (source_id, timestamp_utc, temperature_c, cpu_load_percent, ram_load_percent, uptime_seconds, supply_voltage_v)
+    SELECT %(source)s, %(start)s::timestamptz + i * %(step)s * interval '1 millisecond',
+           42 + 8 * sin(i / 20.0), (i %% 1000) / 10.0, 50 + 10 * cos(i / 50.0), i * %(step)s / 1000, 12.2 + 0.3 * sin(i / 40.0)
+    FROM generate_series(%(lo)s, %(hi)s - 1) AS i
+"""
+
+
+def seed(dsn: str, rows: int) -> None:
+    import psycopg
+    days = rows * SEED_STEP_MS // 86_400_000 + 1
+    with psycopg.connect(dsn, autocommit=True) as conn:
+        source_id = conn.execute(SQL_SOURCE, (SOURCE_NAME,)).fetchone()[0]
+        conn.execute(SQL_PARTITIONS, (SEED_FROM, days))
+        for lo in range(0, rows, SEED_CHUNK_ROWS):
+            conn.execute(SQL_SEED, {"source": source_id, "start": SEED_FROM, "step": SEED_STEP_MS, "lo": lo, "hi": min(rows, lo + SEED_CHUNK_ROWS)})
+        conn.execute("VACUUM ANALYZE metric_snapshots")
+
+
+def stream_export(base_url: str, token: str, fmt: str, rows: int) -> dict[str, Any]:
+    """Read the whole export, discarding it; counts bytes and lines (rows for csv/ndjson)."""
+    session = Session(base_url, 600.0)
+    until = datetime.fromisoformat(SEED_FROM) + timedelta(milliseconds=rows * SEED_STEP_MS)
+    query = urlencode({"format": fmt, "source": SOURCE_NAME, "from": SEED_FROM, "to": until.isoformat()})
+    conn = http.client.HTTPConnection(session.host, session.port, timeout=600)
+    started = time.perf_counter()
+    conn.request("GET", f"{session.prefix}/metrics/export?{query}", headers={"Authorization": f"Bearer {token}"})
+    resp = conn.getresponse()
+    first_byte_ms = None
+    size = lines = 0
+    while chunk := resp.read(READ_SIZE):
+        if first_byte_ms is None:
+            first_byte_ms = (time.perf_counter() - started) * 1000
+        size += len(chunk)
+        lines += chunk.count(b"\n")
+    elapsed = time.perf_counter() - started
+    conn.close()
+    exported = lines - 1 if fmt == "csv" else lines if fmt == "ndjson" else rows
+    return {
+        "format": fmt,
+        "status": resp.status,
+        "rows": exported,
+        "bytes": size,
+        "seconds": round(elapsed, 3),
+        "rows_per_s": round(exported / elapsed) if elapsed > 0 else None,
+        "mb_per_s": round(size / elapsed / 1e6, 2) if elapsed > 0 else None,
+        "first_byte_ms": None if first_byte_ms is None else round(first_byte_ms, 1),
+    }
+
+
+def run(target_name: str, rows: int, formats: list[str], keep_db: bool) -> dict[str, Any]:
+    target = next(t for t in TARGETS if t.name == target_name)
+    err = prepare_template()
+    if err:
+        raise RuntimeError(f"cannot prepare the template database: {err}")
+    dsn = create_database(DATABASE)
+    try:
+        t0 = time.perf_counter()
+        seed(dsn, rows)
+        seed_s = time.perf_counter() - t0
+        env = {"JWT_SECRET": secrets.token_hex(32), **os.environ, "POSTGRES_DSN": dsn, "DATABASE_URL": dsn}
+        log = tempfile.TemporaryFile(mode="w+")
+        proc = subprocess.Popen(target.cmd, cwd=ROOT / target.cwd, env=env, stdout=subprocess.DEVNULL, stderr=log, text=True)
+        sampler = ResourceSampler(proc.pid, 0.1)
+        sampler.start()
+        try:
+            base_url = f"http://127.0.0.1:{target.port}/api/v1"
+            if not wait_ready(base_url, 30.0):
+                raise RuntimeError(f"{target.name} did not become ready")
+            session = Session(base_url, 10.0)
+            if not session.setup():
+                raise RuntimeError("cannot register a benchmark user")
+            sampler.mark("idle")
+            results = []
+            for fmt in formats:
+                sampler.mark(f"{fmt}_start")
+                r = stream_export(base_url, session.access_token or "", fmt, rows)
+                sampler.mark(f"{fmt}_end")
+                r["peak_rss_mb"] = sampler.peak_between(f"{fmt}_start", f"{fmt}_end")
+                r["cpu_s"] = round(sampler.cpu_between(f"{fmt}_start", f"{fmt}_end") or 0.0, 3)
+                results.append(r)
+            session.teardown()
+            return {"target": target.name, "rows": rows, "seed_s": round(seed_s, 1), "idle_rss_mb": sampler.marks["idle"]["rss_mb"], "exports": results}
+        finally:
+            sampler.stop()
+            proc.terminate()
+            try:
+                proc.wait(timeout=4)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+            log.close()
+    finally:
+        if not keep_db:
+            drop_database(DATABASE)
+
+
+def render(report: dict[str, Any]) -> str:
+    lines = [
+        f"{report['target']}: {report['rows']:,} rows (seeded in {report['seed_s']} s), idle RSS {report['idle_rss_mb']} MB",
+        "",
+        "| Format | Status | Rows | Rows/s | MB/s | First byte ms | Peak RSS MB | CPU s |",
+        "|---|---:|---:|---:|---:|---:|---:|---:|",
+    ]
+    for r in report["exports"]:
+        lines.append(
+            f"| {r['format']} | {r['status']} | {r['rows']:,} | {r['rows_per_s'] or '-'} | {r['mb_per_s'] or '-'} | "
+            f"{r['first_byte_ms'] if r['first_byte_ms'] is not None else '-'} | {r['peak_rss_mb'] or '-'} | {r['cpu_s']} |"
+        )
+    return "\n".join(lines)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark /metrics/export on a seeded database.")
+    parser.add_argument("--target", default="fastapi-python")
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--formats", default="csv,ndjson,parquet")
+    parser.add_argument("--keep-db", action="store_true", help=f"leave {DATABASE} in place after the run")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+    if args.target not in {t.name for t in TARGETS}:
+        parser.error(f"unknown target {args.target}")
+    try:
+        report = run(args.target, args.rows, [f.strip() for f in args.formats.split(",") if f.strip()], args.keep_db)
+    except Exception as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 2
+    print(render(report))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
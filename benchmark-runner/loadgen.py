@@ -0,0 +1,355 @@
+from __future__ import annotations
+
+import http.client
+import json
+import math
+import queue
+import random
+import secrets
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Callable
+from urllib.parse import urlsplit
+
+DEFAULT_MIX = "metrics=90,refresh=5,me=3,status=2"
+PERCENTILES = (("p50_ms", 50.0), ("p90_ms", 90.0), ("p99_ms", 99.0), ("p999_ms", 99.9))
+
+
+@dataclass
+class LoadConfig:
+    users: int = 32
+    duration_s: float = 30.0
+    ramp_up_s: float = 5.0
+    rate: float | None = None  # requests/s for open-loop; None = closed-loop
+    mix: str = DEFAULT_MIX
+    timeout_s: float = 4.0
+    # registering and logging in every user goes through the target's auth rate limit; 429s are retried until then
+    setup_timeout_s: float = 60.0
+
+    @property
+    def mode(self) -> str:
+        return "closed" if self.rate is None else "open"
+
+
+class LatencyHistogram:
+    """Log-bucketed latencies: ~1% relative error, memory bounded by the value range, mergeable."""
+
+    def __init__(self, precision: float = 0.01):
+        self.precision = precision
+        self.base = math.log1p(precision)
+        self.counts: Counter[int] = Counter()
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, ms: float) -> None:
+        self.counts[int(math.log(max(ms * 1000.0, 1.0)) / self.base)] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def merge(self, other: LatencyHistogram) -> None:
+        self.counts.update(other.counts)
+        self.count += other.count
+        self.total_ms += other.total_ms
+        self.max_ms = max(self.max_ms, other.max_ms)
+
+    def upper_ms(self, bucket: int) -> float:
+        return math.exp((bucket + 1) * self.base) / 1000.0
+
+    def percentile(self, p: float) -> float | None:
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(p / 100.0 * self.count))
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return min(self.upper_ms(bucket), self.max_ms)
+        return self.max_ms
+
+    def buckets(self) -> list[list[float]]:
+        return [[round(self.upper_ms(b), 3), self.counts[b]] for b in sorted(self.counts)]
+
+
+class EndpointStats:
+    """Latency and outcomes of one endpoint; 429s are the target's rate limiter, not errors, and counted apart."""
+
+    def __init__(self) -> None:
+        self.latency = LatencyHistogram()
+        self.errors = 0
+        self.rate_limited = 0
+        self.status_codes: Counter[int] = Counter()
+
+    def record(self, ms: float, code: int) -> None:
+        self.latency.record(ms)
+        self.status_codes[code] += 1
+        if code == 429:
+            self.rate_limited += 1
+        elif code == 0 or code >= 400:
+            self.errors += 1
+
+    def merge(self, other: EndpointStats) -> None:
+        self.latency.merge(other.latency)
+        self.errors += other.errors
+        self.rate_limited += other.rate_limited
+        self.status_codes.update(other.status_codes)
+
+    def summary(self, window_s: float) -> dict[str, Any]:
+        h = self.latency
+        out: dict[str, Any] = {
+            "count": h.count,
+            "errors": self.errors,
+            "error_rate": round(self.errors / h.count, 4) if h.count else 0.0,
+            "rate_limited": self.rate_limited,
+            "rate_limited_rate": round(self.rate_limited / h.count, 4) if h.count else 0.0,
+            "rps": round(h.count / window_s, 2) if window_s > 0 else 0.0,
+            "mean_ms": round(h.total_ms / h.count, 3) if h.count else None,
+        }
+        for key, p in PERCENTILES:
+            v = h.percentile(p)
+            out[key] = None if v is None else round(v, 3)
+        out["max_ms"] = round(h.max_ms, 3) if h.count else None
+        out["status_codes"] = {str(k): v for k, v in sorted(self.status_codes.items())}
+        out["histogram"] = h.buckets()
+        return out
+
+
+class Session:
+    """One virtual user: its own account, tokens and keep-alive connection."""
+
+    def __init__(self, base_url: str, timeout_s: float):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname or "127.0.0.1"
+        self.port = parts.port or 80
+        self.prefix = parts.path.rstrip("/")
+        self.timeout_s = timeout_s
+        self.conn: http.client.HTTPConnection | None = None
+        suffix = secrets.token_hex(5)
+        self.username = f"load_{suffix}"
+        self.password = f"P@ss-{secrets.token_hex(6)}"
+        self.access_token: str | None = None
+        self.refresh_token: str | None = None
+        self.retry_after = 1.0  # Retry-After of the last 429
+        self.throttled = 0  # 429 responses seen, retried or not
+        self.setup_error: str | None = None
+
+    def close(self) -> None:
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def request(self, method: str, path: str, body: dict[str, Any] | None = None, auth: bool = True) -> tuple[int, Any]:
+        if self.conn is None:
+            self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout_s)
+        headers = {"Content-Type": "application/json"}
+        if auth and self.access_token:
+            headers["Authorization"] = f"Bearer {self.access_token}"
+        data = None if body is None else json.dumps(body).encode("utf-8")
+        try:
+            self.conn.request(method, self.prefix + path, body=data, headers=headers)
+            resp = self.conn.getresponse()
+            raw = resp.read()
+        except (OSError, http.client.HTTPException):
+            self.close()
+            return 0, None
+        if resp.getheader("Connection", "").lower() == "close":
+            self.close()
+        if resp.status == 429:
+            self.throttled += 1
+            try:
+                self.retry_after = max(0.05, float(resp.getheader("Retry-After", "1")))
+            except ValueError:
+                self.retry_after = 1.0
+        try:
+            return resp.status, (json.loads(raw) if raw else None)
+        except ValueError:
+            return resp.status, None
+
+    def retrying(self, call: Callable[[], int], deadline: float) -> int:
+        """`call()` again after each 429 once Retry-After has passed (with jitter, so users do not retry in step), until `deadline`."""
+        while (code := call()) == 429:
+            wait = self.retry_after * random.uniform(1.0, 1.25)
+            if time.perf_counter() + wait > deadline:
+                break
+            time.sleep(wait)
+        return code
+
+    def login(self) -> int:
+        # carries the current access token, if any: the target's limiter then counts this user, not the shared loopback IP
+        code, payload = self.request("POST", "/auth/login", {"username": self.username, "password": self.password})
+        if code == 200 and isinstance(payload, dict):
+            self.access_token = payload.get("accessToken")
+            self.refresh_token = payload.get("refreshToken")
+        return code
+
+    def setup(self, deadline: float) -> bool:
+        body = {"username": self.username, "email": f"{self.username}@example.local", "password": self.password}
+        code = self.retrying(lambda: self.request("POST", "/auth/register", body, auth=False)[0], deadline)
+        if code not in (200, 201):
+            self.setup_error = f"register {code}"
+            return False
+        code = self.retrying(self.login, deadline)
+        if code != 200 or not self.access_token:
+            self.setup_error = f"login {code}"
+            return False
+        return True
+
+    def teardown(self) -> None:
+        if self.access_token:
+            self.request("DELETE", "/auth/self")
+        self.close()
+
+
+def _refresh_once(s: Session) -> int:
+    code, payload = s.request("POST", "/auth/refresh", {"refreshToken": s.refresh_token or ""})
+    if code == 200 and isinstance(payload, dict):
+        s.access_token = payload.get("accessToken") or s.access_token
+        # follows rotation when the implementation issues a new refresh token
+        s.refresh_token = payload.get("refreshToken") or s.refresh_token
+    return code
+
+
+def _op_refresh(s: Session) -> int:
+    # a client told to back off retries, and the wait is part of the latency it sees
+    return s.retrying(lambda: _refresh_once(s), time.perf_counter() + s.timeout_s)
+
+
+OPERATIONS: dict[str, Callable[[Session], int]] = {
+    "metrics": lambda s: s.request("GET", "/metrics/current")[0],
+    "me": lambda s: s.request("GET", "/auth/me")[0],
+    "status": lambda s: s.request("GET", "/gateway/status")[0],
+    "refresh": _op_refresh,
+    "login": lambda s: s.login(),
+}
+
+
+def parse_mix(spec: str) -> dict[str, float]:
+    mix: dict[str, float] = {}
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(f"unknown endpoint {name!r} in mix, expected one of {', '.join(OPERATIONS)}")
+        mix[name] = float(weight or 1)
+    if not mix or sum(mix.values()) <= 0:
+        raise ValueError("endpoint mix must have a positive total weight")
+    return mix
+
+
+def arrival_offset(k: int, rate: float, ramp_up_s: float) -> float:
+    """Intended send time of the k-th request: rate grows linearly to `rate` over the ramp-up, then stays."""
+    ramp_requests = rate * ramp_up_s / 2.0
+    if k < ramp_requests:
+        return math.sqrt(2.0 * ramp_up_s * k / rate)
+    return ramp_up_s + (k - ramp_requests) / rate
+
+
+def run_load(base_url: str, cfg: LoadConfig, mark: Callable[[str], None] | None = None) -> dict[str, Any]:
+    """Drive the target with `cfg.users` virtual users and summarise latency per endpoint.
+
+    Closed-loop: every user sends its next request when the previous one returns.
+    Open-loop: requests are scheduled at a fixed arrival rate and latency is measured from the
+    intended send time, so queueing in the target (or in the generator) is not hidden by
+    coordinated omission. Samples from the ramp-up are not reported. `mark` is called with
+    "load_start"/"load_end" at the edges of the measured window.
+    """
+    mix = parse_mix(cfg.mix)
+    names, weights = list(mix), list(mix.values())
+    sessions = [Session(base_url, cfg.timeout_s) for _ in range(cfg.users)]
+    setup_ok = [False] * cfg.users
+    setup_started = time.perf_counter()
+    setup_deadline = setup_started + cfg.setup_timeout_s
+    threads = [threading.Thread(target=lambda i=i: setup_ok.__setitem__(i, sessions[i].setup(setup_deadline))) for i in range(cfg.users)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    setup_s = time.perf_counter() - setup_started
+    setup_throttled = sum(s.throttled for s in sessions)
+    active = [s for s, ok in zip(sessions, setup_ok) if ok]
+
+    per_worker: list[dict[str, EndpointStats]] = [{n: EndpointStats() for n in names} for _ in active]
+    missed = [0] * len(active)
+    t0 = time.perf_counter() + 0.1
+    measure_from = t0 + cfg.ramp_up_s
+    until = measure_from + cfg.duration_s
+    arrivals: queue.Queue[float | None] = queue.Queue()
+
+    def closed_worker(i: int) -> None:
+        rng = random.Random()
+        time.sleep(max(0.0, t0 + cfg.ramp_up_s * i / max(len(active), 1) - time.perf_counter()))
+        while (started := time.perf_counter()) < until:
+            name = rng.choices(names, weights)[0]
+            code = OPERATIONS[name](active[i])
+            if started >= measure_from:
+                per_worker[i][name].record((time.perf_counter() - started) * 1000.0, code)
+
+    def open_worker(i: int) -> None:
+        rng = random.Random()
+        while (intended := arrivals.get()) is not None:
+            now = time.perf_counter()
+            if now >= until:
+                missed[i] += 1
+                continue
+            if intended > now:
+                time.sleep(intended - now)
+            name = rng.choices(names, weights)[0]
+            code = OPERATIONS[name](active[i])
+            if intended >= measure_from:
+                per_worker[i][name].record((time.perf_counter() - intended) * 1000.0, code)
+
+    timers = [threading.Timer(max(0.0, at - time.perf_counter()), mark, (label,)) for label, at in (("load_start", measure_from), ("load_end", until))] if mark else []
+    for timer in timers:
+        timer.start()
+    workers = [threading.Thread(target=closed_worker if cfg.rate is None else open_worker, args=(i,), daemon=True) for i in range(len(active))]
+    for w in workers:
+        w.start()
+    if cfg.rate is not None and active:
+        k = 0
+        while (intended := t0 + arrival_offset(k, cfg.rate, cfg.ramp_up_s)) < until:
+            # released slightly ahead of time; the worker sleeps the remainder
+            time.sleep(max(0.0, intended - time.perf_counter() - 0.002))
+            arrivals.put(intended)
+            k += 1
+        for _ in workers:
+            arrivals.put(None)
+    for w in workers:
+        w.join(timeout=max(0.0, until - time.perf_counter()) + cfg.timeout_s * 2)
+    for timer in timers:
+        timer.join()
+
+    teardown = [threading.Thread(target=s.teardown) for s in sessions]
+    for t in teardown:
+        t.start()
+    for t in teardown:
+        t.join()
+
+    endpoints = {n: EndpointStats() for n in names}
+    total = EndpointStats()
+    for stats in per_worker:
+        for n, s in stats.items():
+            endpoints[n].merge(s)
+            total.merge(s)
+    return {
+        "mode": cfg.mode,
+        "users": cfg.users,
+        "users_ready": len(active),
+        "users_failed": cfg.users - len(active),
+        "setup_errors": dict(Counter(s.setup_error for s in sessions if s.setup_error)),
+        "setup_s": round(setup_s, 2),
+        "setup_rate_limited": setup_throttled,
+        # 429s during the run, including retried ones that never show up as a sample
+        "rate_limited_total": sum(s.throttled for s in sessions) - setup_throttled,
+        "target_rps": cfg.rate,
+        "duration_s": cfg.duration_s,
+        "ramp_up_s": cfg.ramp_up_s,
+        "mix": mix,
+        "missed": sum(missed),
+        "endpoints": {n: s.summary(cfg.duration_s) for n, s in endpoints.items()},
+        "total": total.summary(cfg.duration_s),
+    }
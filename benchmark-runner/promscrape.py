@@ -0,0 +1,96 @@
+"""Scrape a target's Prometheus-text /metrics once and reduce it to report-sized numbers.
+
+Histograms become count / mean / p50 / p99 per series (linear interpolation inside the bucket),
+gauges are kept as-is. Targets without the endpoint yield None.
+"""
+from __future__ import annotations
+
+import math
+import re
+from typing import Any
+from urllib.error import URLError
+from urllib.request import urlopen
+
+SAMPLE_RE = re.compile(r"^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})?\s+(\S+)")
+LABEL_RE = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"')
+
+
+def scrape(url: str, timeout_s: float = 4.0) -> str | None:
+    try:
+        with urlopen(url, timeout=timeout_s) as resp:
+            if resp.status != 200 or "text/plain" not in resp.headers.get("Content-Type", ""):
+                return None
+            return resp.read().decode("utf-8")
+    except (URLError, OSError):
+        return None
+
+
+def parse(text: str) -> tuple[dict[str, str], list[tuple[str, dict[str, str], float]]]:
+    """(metric name -> type, [(sample name, labels, value)])."""
+    types: dict[str, str] = {}
+    samples: list[tuple[str, dict[str, str], float]] = []
+    for line in text.splitlines():
+        if line.startswith("# TYPE "):
+            _, _, name, kind = line.split(None, 3)
+            types[name] = kind.strip()
+            continue
+        if not line or line.startswith("#"):
+            continue
+        m = SAMPLE_RE.match(line)
+        if m:
+            samples.append((m.group(1), dict(LABEL_RE.findall(m.group(2) or "")), float(m.group(3))))
+    return types, samples
+
+
+def series_key(name: str, labels: dict[str, str]) -> str:
+    return name + ("{" + ",".join(f"{k}={v}" for k, v in sorted(labels.items())) + "}" if labels else "")
+
+
+def quantile(buckets: list[tuple[float, float]], q: float) -> float | None:
+    """Quantile from sorted cumulative (upper bound, count) pairs, as histogram_quantile() does."""
+    if not buckets or buckets[-1][1] == 0:
+        return None
+    rank = q * buckets[-1][1]
+    lower, below = 0.0, 0.0
+    for bound, count in buckets:
+        if count >= rank:
+            if math.isinf(bound):
+                return lower
+            return lower + (bound - lower) * ((rank - below) / (count - below) if count > below else 0.0)
+        lower, below = bound, count
+    return None
+
+
+def summarize(text: str) -> dict[str, Any]:
+    types, samples = parse(text)
+    histograms: dict[str, dict[str, Any]] = {}
+    gauges: dict[str, float] = {}
+    for name, labels, value in samples:
+        base = next((name[: -len(s)] for s in ("_bucket", "_sum", "_count") if name.endswith(s) and types.get(name[: -len(s)]) == "histogram"), None)
+        if base is None:
+            gauges[series_key(name, labels)] = value
+            continue
+        le = labels.pop("le", None)
+        h = histograms.setdefault(series_key(base, labels), {"buckets": [], "sum": 0.0, "count": 0})
+        if le is not None:
+            h["buckets"].append((float(le), value))
+        elif name.endswith("_sum"):
+            h["sum"] = value
+        else:
+            h["count"] = int(value)
+    out: dict[str, Any] = {"gauges": gauges, "histograms": {}}
+    for key, h in histograms.items():
+        buckets = sorted(h["buckets"])
+        p50, p99 = quantile(buckets, 0.5), quantile(buckets, 0.99)
+        out["histograms"][key] = {
+            "count": h["count"],
+            "mean_ms": round(h["sum"] / h["count"] * 1000, 3) if h["count"] else None,
+            "p50_ms": None if p50 is None else round(p50 * 1000, 3),
+            "p99_ms": None if p99 is None else round(p99 * 1000, 3),
+        }
+    return out
+
+
+def scrape_summary(url: str) -> dict[str, Any] | None:
+    text = scrape(url)
+    return None if text is None else summarize(text)
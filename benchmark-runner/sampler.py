@@ -0,0 +1,155 @@
+from __future__ import annotations
+
+import os
+import statistics
+import threading
+import time
+from typing import Any
+
+CLK_TCK = os.sysconf("SC_CLK_TCK")
+
+
+def _read(path: str) -> str | None:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def process_tree(root: int) -> list[int]:
+    """`root` and all its descendants, found by scanning /proc for parent pids."""
+    children: dict[int, list[int]] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        stat = _read(f"/proc/{entry}/stat")
+        if stat is None:
+            continue
+        ppid = int(stat[stat.rindex(")") + 2:].split()[1])
+        children.setdefault(ppid, []).append(int(entry))
+    tree, stack = [], [root]
+    while stack:
+        pid = stack.pop()
+        tree.append(pid)
+        stack.extend(children.get(pid, []))
+    return tree
+
+
+def sample_process(pid: int) -> dict[str, float] | None:
+    stat = _read(f"/proc/{pid}/stat")
+    status = _read(f"/proc/{pid}/status")
+    if stat is None or status is None:
+        return None
+    # fields after "pid (comm) ": state=0 ... utime=11 stime=12 cutime=13 cstime=14 num_threads=17
+    fields = stat[stat.rindex(")") + 2:].split()
+    ticks = sum(int(fields[i]) for i in (11, 12, 13, 14))
+    values = {"rss_kb": 0.0, "voluntary_ctxt_switches": 0.0, "nonvoluntary_ctxt_switches": 0.0}
+    for line in status.splitlines():
+        key, _, rest = line.partition(":")
+        if key == "VmRSS":
+            values["rss_kb"] = float(rest.split()[0])
+        elif key in values:
+            values[key] = float(rest.split()[0])
+    try:
+        fds = len(os.listdir(f"/proc/{pid}/fd"))
+    except OSError:
+        fds = 0
+    return {
+        "rss_mb": values["rss_kb"] / 1024.0,
+        # cutime/cstime cover reaped children, which have already left the tree
+        "cpu_s": ticks / CLK_TCK,
+        "threads": float(fields[17]),
+        "fds": float(fds),
+        "ctx_voluntary": values["voluntary_ctxt_switches"],
+        "ctx_involuntary": values["nonvoluntary_ctxt_switches"],
+    }
+
+
+def sample_tree(root: int) -> dict[str, float] | None:
+    total: dict[str, float] = {}
+    for pid in process_tree(root):
+        s = sample_process(pid)
+        if s is None:
+            continue
+        for k, v in s.items():
+            total[k] = total.get(k, 0.0) + v
+        total["processes"] = total.get("processes", 0.0) + 1
+    return total or None
+
+
+class ResourceSampler:
+    """Samples the whole process tree of a target in a background thread for the entire run.
+
+    Launchers (gradlew, npm, cargo, dotnet run) fork the real server, so the root pid alone
+    would measure the wrong process. `mark()` records an extra sample with a label so the
+    CPU spent between two points (e.g. the load window) can be attributed to its requests.
+    """
+
+    def __init__(self, pid: int, interval_s: float = 0.5):
+        self.pid = pid
+        self.interval_s = interval_s
+        self.started = time.perf_counter()
+        self.samples: list[dict[str, Any]] = []
+        self.marks: dict[str, dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _take(self) -> dict[str, Any] | None:
+        s = sample_tree(self.pid)
+        if s is None:
+            return None
+        sample = {"t_s": round(time.perf_counter() - self.started, 3), **{k: round(v, 3) for k, v in s.items()}}
+        with self._lock:
+            self.samples.append(sample)
+        return sample
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._take()
+            self._stop.wait(self.interval_s)
+
+    def mark(self, label: str) -> None:
+        sample = self._take()
+        if sample is not None:
+            self.marks[label] = sample
+
+    def cpu_between(self, start: str, end: str) -> float | None:
+        if start not in self.marks or end not in self.marks:
+            return None
+        return self.marks[end]["cpu_s"] - self.marks[start]["cpu_s"]
+
+    def peak_between(self, start: str, end: str, key: str = "rss_mb") -> float | None:
+        if start not in self.marks or end not in self.marks:
+            return None
+        lo, hi = self.marks[start]["t_s"], self.marks[end]["t_s"]
+        with self._lock:
+            values = [s[key] for s in self.samples if lo <= s["t_s"] <= hi]
+        return max(values) if values else None
+
+    def summary(self) -> dict[str, Any]:
+        with self._lock:
+            samples = list(self.samples)
+        if not samples:
+            return {"samples": []}
+        rss = [s["rss_mb"] for s in samples]
+        last = samples[-1]
+        return {
+            "peak_rss_mb": round(max(rss), 2),
+            "mean_rss_mb": round(statistics.mean(rss), 2),
+            "cpu_s": round(last["cpu_s"], 3),
+            "max_threads": int(max(s["threads"] for s in samples)),
+            "max_fds": int(max(s["fds"] for s in samples)),
+            "max_processes": int(max(s["processes"] for s in samples)),
+            "ctx_voluntary": int(last["ctx_voluntary"]),
+            "ctx_involuntary": int(last["ctx_involuntary"]),
+            "samples": samples,
+        }
@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import json
+import math
+import os
+import statistics
+import subprocess
+import time
+from pathlib import Path
+from typing import Any
+
+from loadgen import PERCENTILES
+
+ROOT = Path(__file__).resolve().parents[1]
+RESULTS_DIR = Path(os.getenv("BENCHMARK_RESULTS_DIR", ROOT / "benchmark-runner" / "results"))
+RUNS_DIR = RESULTS_DIR / "runs"
+BASELINE_DIR = RESULTS_DIR / "baseline"
+
+
+def git_revision() -> str:
+    """Short HEAD hash, suffixed with -dirty when tracked files have uncommitted changes."""
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short=12", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return f"{rev}-dirty" if dirty else rev
+
+
+def save_run(results: list[dict[str, Any]], meta: dict[str, Any]) -> list[Path]:
+    """Store each result as runs/<revision>/<implementation>-<timestamp>-<repeat>.json."""
+    stamp = time.strftime("%Y%m%dT%H%M%S", time.gmtime())
+    run_dir = RUNS_DIR / meta["revision"]
+    run_dir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for r in results:
+        path = run_dir / f"{r['name']}-{stamp}-{r.get('repeat', 0)}.json"
+        path.write_text(json.dumps({"meta": {**meta, "stamp": stamp}, "result": r}, indent=2, ensure_ascii=False), encoding="utf-8")
+        paths.append(path)
+    return paths
+
+
+def _pool_endpoint(stats: list[dict[str, Any]]) -> dict[str, Any]:
+    """Load stats of one endpoint over several repeats: histograms summed bucket by bucket."""
+    counts: dict[float, float] = {}
+    for s in stats:
+        for upper, count in s.get("histogram", []):
+            counts[upper] = counts.get(upper, 0) + count
+    histogram = [[upper, counts[upper]] for upper in sorted(counts)]
+    total = sum(s.get("count", 0) for s in stats)
+    errors = sum(s.get("errors", 0) for s in stats)
+    rate_limited = sum(s.get("rate_limited", 0) for s in stats)
+    out = {
+        **stats[0], "count": total, "errors": errors, "error_rate": round(errors / total, 4) if total else 0.0,
+        "rate_limited": rate_limited, "rate_limited_rate": round(rate_limited / total, 4) if total else 0.0,
+        "rps": round(statistics.mean(s.get("rps", 0.0) for s in stats), 2), "histogram": histogram,
+    }
+    for key, p in PERCENTILES:
+        rank, seen = max(1, math.ceil(p / 100.0 * total)), 0
+        out[key] = None
+        for upper, count in histogram:
+            seen += count
+            if seen >= rank:
+                out[key] = upper
+                break
+    return out
+
+
+def pool_repeats(records: list[dict[str, Any]]) -> dict[str, Any]:
+    """One record for the `--repeat` results of one implementation in one run.
+
+    Scenario samples of all repeats are concatenated (so compare.py bootstraps over every trial of
+    every repeat), load histograms are summed and resource figures are the median across repeats.
+    """
+    records = sorted(records, key=lambda r: r["result"].get("repeat", 0))
+    if len(records) == 1:
+        return records[0]
+    results = [r["result"] for r in records]
+    pooled = dict(results[0])
+    samples: dict[str, list[float]] = {}
+    for r in results:
+        for key, values in (r.get("timings_samples_ms") or {k: [v] for k, v in r.get("timings_ms", {}).items()}).items():
+            samples.setdefault(key, []).extend(values)
+    pooled["timings_samples_ms"] = samples
+    pooled["timings_ms"] = {k: statistics.median(v) for k, v in samples.items()}
+    pooled["passed"] = all(r.get("passed") for r in results)
+    resources = [r.get("resources") or {} for r in results]
+    pooled["resources"] = {
+        k: statistics.median(res[k] for res in resources)
+        for k, v in resources[0].items() if isinstance(v, (int, float)) and all(isinstance(res.get(k), (int, float)) for res in resources)
+    }
+    loads = [r.get("load") for r in results]
+    if all(loads):
+        endpoints = sorted(set().union(*(load["endpoints"] for load in loads)))
+        pooled["load"] = {
+            **loads[0], "total": _pool_endpoint([load["total"] for load in loads]),
+            "endpoints": {n: _pool_endpoint([load["endpoints"][n] for load in loads if n in load["endpoints"]]) for n in endpoints},
+        }
+    pooled["repeats"] = [r.get("repeat", 0) for r in results]
+    return {"meta": records[0]["meta"], "result": pooled}
+
+
+def _latest_per_implementation(paths: list[Path]) -> dict[str, dict[str, Any]]:
+    """Newest run of each implementation, all of its repeats pooled into one record."""
+    runs: dict[str, dict[str, dict[int, dict[str, Any]]]] = {}  # name -> stamp -> repeat -> record
+    for path in paths:
+        record = json.loads(path.read_text(encoding="utf-8"))
+        result = record["result"]
+        runs.setdefault(result["name"], {}).setdefault(record["meta"]["stamp"], {})[result.get("repeat", 0)] = record
+    return {name: pool_repeats(list(by_stamp[max(by_stamp)].values())) for name, by_stamp in runs.items()}
+
+
+def load_ref(ref: str) -> dict[str, dict[str, Any]]:
+    """Records by implementation for `ref`, the repeats of a run pooled (see pool_repeats).
+
+    `ref` is "baseline", "latest" (newest stored run of each implementation), a git revision
+    prefix (newest run of each implementation at that revision), a stored record file, or a
+    benchmark-report.json.
+    """
+    path = Path(ref)
+    if path.is_file():
+        data = json.loads(path.read_text(encoding="utf-8"))
+        if "result" in data:
+            return {data["result"]["name"]: data}
+        meta = {"revision": data.get("revision", path.name), "stamp": data.get("stamp", "")}
+        grouped: dict[str, list[dict[str, Any]]] = {}
+        for r in data.get("results", []):
+            grouped.setdefault(r["name"], []).append({"meta": meta, "result": r})
+        return {name: pool_repeats(records) for name, records in grouped.items()}
+    if ref == "baseline":
+        return _latest_per_implementation(sorted(BASELINE_DIR.glob("*.json")))
+    if ref == "latest":
+        return _latest_per_implementation(sorted(RUNS_DIR.glob("*/*.json")))
+    dirs = [d for d in RUNS_DIR.glob(f"{ref}*") if d.is_dir()] if RUNS_DIR.is_dir() else []
+    if not dirs:
+        raise LookupError(f"no stored runs for {ref!r} in {RUNS_DIR}")
+    return _latest_per_implementation([p for d in dirs for p in d.glob("*.json")])
+
+
+def set_baseline(ref: str) -> list[Path]:
+    """Copy the records of `ref` into baseline/, one file per implementation."""
+    records = load_ref(ref)
+    if not records:
+        raise LookupError(f"{ref!r} has no results")
+    BASELINE_DIR.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for name, record in records.items():
+        path = BASELINE_DIR / f"{name}.json"
+        path.write_text(json.dumps(record, indent=2, ensure_ascii=False), encoding="utf-8")
+        paths.append(path)
+    return paths
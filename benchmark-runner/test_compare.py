@@ -0,0 +1,65 @@
+"""python3 -m unittest discover benchmark-runner"""
+from __future__ import annotations
+
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import compare
+import store
+
+
+def record(stamp: str, repeat: int, login_ms: list[float], latency_ms: float) -> dict:
+    endpoint = {"count": 100, "errors": 1, "error_rate": 0.01, "rps": 50.0, "histogram": [[latency_ms, 100]]}
+    return {
+        "meta": {"revision": "abc", "stamp": stamp},
+        "result": {
+            "name": "fastapi-python", "repeat": repeat, "passed": True,
+            "timings_ms": {"login_ms": login_ms[0]}, "timings_samples_ms": {"login_ms": login_ms},
+            "resources": {"peak_rss_mb": 100.0 + repeat},
+            "load": {"mode": "closed", "users": 8, "target_rps": None, "duration_s": 10, "mix": "metrics=100",
+                     "endpoints": {"metrics": endpoint}, "total": endpoint},
+        },
+    }
+
+
+class CompareRepeatsTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.runs = Path(self.tmp.name) / "runs"
+        patcher = mock.patch.object(store, "RUNS_DIR", self.runs)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.tmp.cleanup)
+
+    def save(self, revision: str, rec: dict) -> None:
+        path = self.runs / revision / f"fastapi-python-{rec['meta']['stamp']}-{rec['result']['repeat']}.json"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(rec), encoding="utf-8")
+
+    def test_two_repeats_are_pooled_into_the_comparison(self) -> None:
+        # two trials per repeat: a single repeat is below MIN_TRIALS, both together are not
+        self.save("base", record("20260101T000000", 0, [10.0, 11.0], 2.0))
+        self.save("base", record("20260101T000000", 1, [10.5, 9.5], 2.0))
+        self.save("cand", record("20260101T000000", 0, [100.0, 100.0], 9.0))  # older run, ignored
+        self.save("cand", record("20260102T000000", 0, [20.0, 21.0], 4.0))
+        self.save("cand", record("20260102T000000", 1, [20.5, 19.5], 4.0))
+
+        base, cand = store.load_ref("base"), store.load_ref("cand")
+        self.assertEqual(base["fastapi-python"]["result"]["repeats"], [0, 1])
+        self.assertEqual(sorted(cand["fastapi-python"]["result"]["timings_samples_ms"]["login_ms"]), [19.5, 20.0, 20.5, 21.0])
+        self.assertEqual(cand["fastapi-python"]["result"]["load"]["total"]["count"], 200)
+
+        rows = {r["metric"]: r for r in compare.compare(base, cand, 0.10, 0.01)}
+        login = rows["scenario.login_ms"]
+        self.assertEqual(login["verdict"], "regression")
+        self.assertIsNotNone(login["ci"][0])
+        self.assertAlmostEqual(login["base"], 10.25)
+        self.assertEqual(rows["load.total.p50_ms"]["verdict"], "regression")
+        self.assertEqual(rows["resources.peak_rss_mb"]["base"], 100.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
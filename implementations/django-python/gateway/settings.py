@@ -1,3 +1,17 @@
+import os
+
 SECRET_KEY='dev';DEBUG=True;ROOT_URLCONF='gateway.urls';ALLOWED_HOSTS=['*']
 INSTALLED_APPS=[]
 MIDDLEWARE=[]
+
+# same contract as fastapi-python: no signing key, no start (JWT_ALLOW_DEV_SECRET=true for local runs)
+JWT_SECRET = os.getenv('JWT_SECRET', '')
+if not JWT_SECRET:
+    if os.getenv('JWT_ALLOW_DEV_SECRET', 'false').lower() not in ('1', 'true', 'yes'):
+        raise RuntimeError('JWT_SECRET is not set (JWT_ALLOW_DEV_SECRET=true runs with the public development key)')
+    JWT_SECRET = 'dev-only-change-me-0123456789abcdef'
+JWT_ISSUER = os.getenv('JWT_ISSUER', 'opcua-gateway')
+JWT_AUDIENCE = os.getenv('JWT_AUDIENCE', 'opcua-gateway-api')
+JWT_ACCESS_TOKEN_TTL_SEC = int(os.getenv('JWT_ACCESS_TOKEN_TTL_SEC', '900'))
+# same switch and default as fastapi-python: logout also revokes the access token it was called with
+AUTH_LOGOUT_REVOKES_ACCESS = os.getenv('AUTH_LOGOUT_REVOKES_ACCESS', 'false').lower() in ('1', 'true', 'yes')
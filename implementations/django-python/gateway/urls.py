@@ -1,12 +1,20 @@
 import json
 import secrets
+import time
+import uuid
 from datetime import datetime, timezone
+
+import jwt
+from django.conf import settings
 from django.urls import path
 from django.http import JsonResponse
 
-USERS = {}
-ACCESS = {}
+USERS = {}  # username -> user
+USERS_BY_ID = {}
 REFRESH = {}
+# access token jti -> exp, kept until the token would have expired anyway. Like USERS and REFRESH it lives in this
+# process only: with several workers a revocation only holds on the worker that handled the logout.
+REVOKED = {}
 UPTIME = {'value': 0}
 
 
@@ -17,12 +25,33 @@ def _json(request):
         return {}
 
 
-def _current_user(request):
+def _issue_access_token(user):
+    now = int(time.time())
+    claims = {
+        'sub': user['id'], 'role': user['role'], 'username': user['username'], 'email': user['email'],
+        'iss': settings.JWT_ISSUER, 'aud': settings.JWT_AUDIENCE,
+        'iat': now, 'exp': now + settings.JWT_ACCESS_TOKEN_TTL_SEC, 'jti': uuid.uuid4().hex,
+    }
+    return jwt.encode(claims, settings.JWT_SECRET, algorithm='HS256')
+
+
+def _claims(request):
     auth = request.headers.get('Authorization', '')
     if not auth.startswith('Bearer '):
         return None
-    username = ACCESS.get(auth[7:])
-    return USERS.get(username)
+    try:
+        claims = jwt.decode(
+            auth[7:], settings.JWT_SECRET, algorithms=['HS256'], audience=settings.JWT_AUDIENCE, issuer=settings.JWT_ISSUER,
+            options={'require': ['sub', 'role', 'iss', 'aud', 'iat', 'exp', 'jti']},
+        )
+    except jwt.PyJWTError:
+        return None
+    return None if claims.get('jti') in REVOKED else claims
+
+
+def _current_user(request):
+    claims = _claims(request)
+    return USERS_BY_ID.get(claims['sub']) if claims else None
 
 
 def register(request):
@@ -34,7 +63,8 @@ def register(request):
         return JsonResponse({'error': {'code': 'VALIDATION_ERROR'}}, status=400)
     if username in USERS:
         return JsonResponse({'error': {'code': 'CONFLICT'}}, status=409)
-    USERS[username] = {'username': username, 'email': payload.get('email', f'{username}@example.local'), 'password': password, 'role': 'viewer'}
+    user = {'id': str(uuid.uuid4()), 'username': username, 'email': payload.get('email', f'{username}@example.local'), 'password': password, 'role': 'viewer'}
+    USERS[username] = USERS_BY_ID[user['id']] = user
     return JsonResponse({'status': 'registered'}, status=201)
 
 
@@ -43,9 +73,8 @@ def login(request):
     user = USERS.get(payload.get('username'))
     if not user or user['password'] != payload.get('password'):
         return JsonResponse({'error': {'code': 'UNAUTHORIZED'}}, status=401)
-    access_token = secrets.token_hex(24)
+    access_token = _issue_access_token(user)
     refresh_token = secrets.token_hex(24)
-    ACCESS[access_token] = user['username']
     REFRESH[refresh_token] = user['username']
     return JsonResponse({'accessToken': access_token, 'refreshToken': refresh_token})
 
@@ -55,16 +84,24 @@ def refresh(request):
     username = REFRESH.get(payload.get('refreshToken'))
     if not username:
         return JsonResponse({'error': {'code': 'UNAUTHORIZED'}}, status=401)
-    access_token = secrets.token_hex(24)
-    ACCESS[access_token] = username
+    user = USERS.get(username)
+    if not user:
+        return JsonResponse({'error': {'code': 'UNAUTHORIZED'}}, status=401)
+    access_token = _issue_access_token(user)
     return JsonResponse({'accessToken': access_token, 'refreshToken': payload.get('refreshToken')})
 
 
 def logout(request):
-    if not _current_user(request):
+    claims = _claims(request)
+    if not claims or claims['sub'] not in USERS_BY_ID:
         return JsonResponse({'error': {'code': 'UNAUTHORIZED'}}, status=401)
     payload = _json(request)
     REFRESH.pop(payload.get('refreshToken'), None)
+    if settings.AUTH_LOGOUT_REVOKES_ACCESS:
+        now = time.time()
+        for jti in [j for j, exp in REVOKED.items() if exp <= now]:
+            del REVOKED[jti]
+        REVOKED[claims['jti']] = claims['exp']
     return JsonResponse({'status': 'ok'})
 
 
@@ -72,7 +109,7 @@ def me(request):
     user = _current_user(request)
     if not user:
         return JsonResponse({'error': {'code': 'UNAUTHORIZED'}}, status=401)
-    return JsonResponse({'username': user['username'], 'email': user['email'], 'role': user['role']})
+    return JsonResponse({'id': user['id'], 'username': user['username'], 'email': user['email'], 'role': user['role']})
 
 
 def metrics(request):
@@ -0,0 +1,282 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import tempfile
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Optional
+
+from db import db_conn
+
+AUDIT_QUEUE_SIZE = int(os.getenv('AUDIT_QUEUE_SIZE', '10000'))
+AUDIT_BATCH_SIZE = int(os.getenv('AUDIT_BATCH_SIZE', '500'))
+AUDIT_FLUSH_INTERVAL_MS = int(os.getenv('AUDIT_FLUSH_INTERVAL_MS', '200'))
+# block: wait for queue space; drop-debug: discard debug events, block on the rest; spill: append to the spill file
+AUDIT_BACKPRESSURE = os.getenv('AUDIT_BACKPRESSURE', 'block')
+# each process appends to '<AUDIT_SPILL_PATH>.<pid>'; torn lines found on replay go to '<AUDIT_SPILL_PATH>.corrupt'
+AUDIT_SPILL_PATH = os.getenv('AUDIT_SPILL_PATH', os.path.join(tempfile.gettempdir(), 'gateway-audit-spill.jsonl'))
+AUDIT_SHUTDOWN_TIMEOUT_SEC = float(os.getenv('AUDIT_SHUTDOWN_TIMEOUT_SEC', '5'))
+
+AUDIT_COLUMNS = (
+    'event_time', 'actor_user_id', 'actor_username', 'event_type', 'action', 'resource_type', 'resource_id',
+    'success', 'severity', 'http_method', 'http_path', 'http_status', 'details',
+)
+
+# Batches go through a per-connection staging table so that actor ids of users deleted
+# between enqueue and flush (login -> delete_self) are nulled instead of failing the whole COPY.
+SQL_STAGE = """
+    CREATE TEMP TABLE IF NOT EXISTS audit_stage (
+        event_time TIMESTAMPTZ, actor_user_id UUID, actor_username TEXT, event_type TEXT, action TEXT,
+        resource_type TEXT, resource_id TEXT, success BOOLEAN, severity TEXT, http_method TEXT, http_path TEXT, http_status INTEGER, details JSONB
+    ) ON COMMIT DELETE ROWS
+"""
+SQL_COPY = f"COPY audit_stage ({', '.join(AUDIT_COLUMNS)}) FROM STDIN"
+SQL_MERGE = f"""
+    INSERT INTO audit_log ({', '.join(AUDIT_COLUMNS)})
+    SELECT s.event_time, u.id, s.actor_username, s.event_type, s.action, s.resource_type, s.resource_id, s.success,
+           s.severity, s.http_method, s.http_path, s.http_status, s.details
+    FROM audit_stage s LEFT JOIN users u ON u.id = s.actor_user_id
+"""
+
+
+@dataclass
+class AuditEvent:
+    event_type: str
+    action: str
+    actor_user_id: Optional[str] = None
+    actor_username: Optional[str] = None
+    resource_type: Optional[str] = None
+    resource_id: Optional[str] = None
+    success: bool = True
+    severity: str = 'info'
+    http_method: Optional[str] = None
+    http_path: Optional[str] = None
+    http_status: Optional[int] = None
+    details: dict = field(default_factory=dict)
+    event_time: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+
+    def row(self) -> list:
+        return [
+            self.event_time.isoformat(), self.actor_user_id, self.actor_username, self.event_type, self.action,
+            self.resource_type, self.resource_id, self.success, self.severity, self.http_method, self.http_path, self.http_status, json.dumps(self.details),
+        ]
+
+
+class AuditWriter:
+    """Bounded in-process queue of audit events flushed to `audit_log` in COPY batches.
+
+    A flush happens every `flush_interval_sec` or as soon as `batch_size` events are queued.
+    Batches that cannot be written are spilled to this process's own file next to `spill_path`
+    and replayed after the next successful flush, so a Postgres outage does not lose audit
+    history. Replay also picks up the files of processes that are gone. A claimed file is read
+    into memory and removed before any of its rows are inserted, and rows that still fail go back
+    to this process's spill file, so a crash mid-replay can lose the rows in flight but never
+    writes them twice. File I/O on the replay path runs in a worker thread.
+    """
+
+    def __init__(
+        self,
+        queue_size: int = AUDIT_QUEUE_SIZE,
+        batch_size: int = AUDIT_BATCH_SIZE,
+        flush_interval_sec: float = AUDIT_FLUSH_INTERVAL_MS / 1000.0,
+        backpressure: str = AUDIT_BACKPRESSURE,
+        spill_path: str = AUDIT_SPILL_PATH,
+    ):
+        if backpressure not in ('block', 'drop-debug', 'spill'):
+            raise ValueError(f'unknown AUDIT_BACKPRESSURE mode: {backpressure}')
+        self.queue: asyncio.Queue[AuditEvent] = asyncio.Queue(maxsize=queue_size)
+        self.batch_size = batch_size
+        self.flush_interval_sec = flush_interval_sec
+        self.backpressure = backpressure
+        self.spill_path = spill_path
+        self.counters = {'enqueued': 0, 'written': 0, 'dropped': 0, 'spilled': 0, 'replayed': 0, 'spillCorrupt': 0, 'flushErrors': 0, 'loopErrors': 0}
+        self.last_flush_at: Optional[str] = None
+        self._wake = asyncio.Event()
+        self._closing = False
+        self._replay_due = False
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def emit(self, event: AuditEvent) -> None:
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            if self.backpressure == 'spill':
+                self._spill([event.row()])
+                return
+            if self.backpressure == 'drop-debug' and event.severity == 'debug':
+                self.counters['dropped'] += 1
+                return
+            await self.queue.put(event)
+        self.counters['enqueued'] += 1
+        if self.queue.qsize() >= self.batch_size:
+            self._wake.set()
+
+    async def stop(self, timeout: float = AUDIT_SHUTDOWN_TIMEOUT_SEC) -> None:
+        """Drain the queue; whatever is still queued after `timeout` goes to the spill file."""
+        if self._task is None:
+            return
+        self._closing = True
+        self._wake.set()
+        try:
+            await asyncio.wait_for(self._task, timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            pass
+        self._task = None
+        leftover = []
+        while not self.queue.empty():
+            leftover.append(self.queue.get_nowait().row())
+        if leftover:
+            self._spill(leftover)
+
+    def stats(self) -> dict:
+        return {**self.counters, 'queued': self.queue.qsize(), 'backpressure': self.backpressure, 'lastFlushAt': self.last_flush_at}
+
+    async def _run(self) -> None:
+        starting = True
+        while not (self._closing and self.queue.empty()):
+            try:
+                if starting:
+                    starting = False
+                    await self._replay_spill()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.flush_interval_sec)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+                flushed = False
+                while not self.queue.empty():
+                    batch = [self.queue.get_nowait().row() for _ in range(min(self.batch_size, self.queue.qsize()))]
+                    flushed = await self._flush(batch) or flushed
+                if flushed and self._replay_due:
+                    await self._replay_spill()
+            except Exception:
+                # nothing else drains the queue: a bad batch or spill file must not end the task
+                self.counters['loopErrors'] += 1
+                await asyncio.sleep(self.flush_interval_sec)
+
+    async def _flush(self, rows: list[list], spill: bool = True) -> bool:
+        try:
+            async with db_conn() as conn:
+                async with conn.cursor() as cur:
+                    await cur.execute(SQL_STAGE)
+                    async with cur.copy(SQL_COPY) as copy:
+                        for row in rows:
+                            await copy.write_row(row)
+                    await cur.execute(SQL_MERGE)
+        except Exception:
+            self.counters['flushErrors'] += 1
+            if spill:
+                self._spill(rows)
+            return False
+        self.counters['written'] += len(rows)
+        self.last_flush_at = datetime.now(timezone.utc).isoformat()
+        return True
+
+    def _spill(self, rows: list[list]) -> None:
+        try:
+            _append_spill(f'{self.spill_path}.{os.getpid()}', rows)
+        except OSError:
+            self.counters['dropped'] += len(rows)
+            return
+        self.counters['spilled'] += len(rows)
+        self._replay_due = True
+
+    def _claimable(self) -> list[str]:
+        """Spill files of this process, of processes that no longer exist, and the legacy single file."""
+        directory, base = os.path.split(os.path.abspath(self.spill_path))
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            return []
+        paths = []
+        for name in names:
+            if name == base:
+                paths.append(os.path.join(directory, name))
+                continue
+            if not name.startswith(base + '.'):
+                continue
+            pid = name[len(base) + 1:].split('.', 1)[0]
+            if pid.isdigit() and (int(pid) == os.getpid() or not _alive(int(pid))):
+                paths.append(os.path.join(directory, name))
+        return sorted(paths)
+
+    async def _replay_spill(self) -> None:
+        pending = False
+        for path in await asyncio.to_thread(self._claimable):
+            # the rename is the claim: of several workers only one gets each file
+            claimed = f'{self.spill_path}.{os.getpid()}.replay-{uuid.uuid4().hex[:8]}'
+            try:
+                await asyncio.to_thread(os.replace, path, claimed)
+            except FileNotFoundError:
+                continue
+            if not await self._replay_file(claimed):
+                pending = True
+                break
+        self._replay_due = pending
+
+    async def _replay_file(self, path: str) -> bool:
+        rows, corrupt = await asyncio.to_thread(_take_spill, path)
+        if corrupt:
+            # torn by a crash mid-append: kept for inspection instead of stopping the replay
+            self.counters['spillCorrupt'] += len(corrupt)
+            await asyncio.to_thread(_append_lines, self.spill_path + '.corrupt', corrupt)
+        for i in range(0, len(rows), self.batch_size):
+            if not await self._flush(rows[i:i + self.batch_size], spill=False):
+                # the claimed file is gone: what is left (this chunk included) goes back to our own spill file
+                try:
+                    await asyncio.to_thread(_append_spill, f'{self.spill_path}.{os.getpid()}', rows[i:])
+                except OSError:
+                    self.counters['dropped'] += len(rows) - i
+                return False
+            self.counters['replayed'] += len(rows[i:i + self.batch_size])
+        return True
+
+
+def _append_spill(path: str, rows: list[list]) -> None:
+    # one O_APPEND write per batch into a file no other process writes to
+    data = ''.join(json.dumps(row) + '\n' for row in rows).encode('utf-8')
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+    try:
+        os.write(fd, data)
+    finally:
+        os.close(fd)
+
+
+def _append_lines(path: str, lines: list[str]) -> None:
+    with open(path, 'a', encoding='utf-8') as f:
+        f.writelines(lines)
+
+
+def _take_spill(path: str) -> tuple[list[list], list[str]]:
+    """Parse a claimed spill file into (rows, corrupt lines) and remove it before anything is inserted."""
+    rows, corrupt = [], []
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            if isinstance(row, list) and len(row) == len(AUDIT_COLUMNS):
+                rows.append(row)
+            else:
+                corrupt.append(line if line.endswith('\n') else line + '\n')
+    os.remove(path)
+    return rows, corrupt
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
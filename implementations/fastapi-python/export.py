@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import importlib.util
+import os
+from datetime import datetime
+from typing import AsyncIterator, Optional
+
+import psycopg
+
+from db import POSTGRES_CONNECT_TIMEOUT_SEC, POSTGRES_DSN
+from history import HISTORY_FIELDS
+
+EXPORT_CHUNK_ROWS = int(os.getenv('EXPORT_CHUNK_ROWS', '65536'))
+EXPORT_MAX_CONCURRENT = int(os.getenv('EXPORT_MAX_CONCURRENT', '4'))
+EXPORT_FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson', 'parquet': 'application/vnd.apache.parquet'}
+
+# REST field -> metric_snapshots column, in output order
+EXPORT_FIELDS = (('timestampUtc', 'timestamp_utc'), *((name, col) for name, (col, _) in HISTORY_FIELDS.items()))
+SQL_WHERE = 'FROM metric_snapshots WHERE source_id = %(source)s AND timestamp_utc >= %(from)s AND timestamp_utc < %(to)s ORDER BY timestamp_utc'
+SQL_COPY = {
+    'csv': f"""COPY (SELECT {', '.join(f'{col} AS "{name}"' for name, col in EXPORT_FIELDS)} {SQL_WHERE}) TO STDOUT WITH (FORMAT csv, HEADER)""",
+    'ndjson': f"""COPY (SELECT json_build_object({', '.join(f"'{name}', {col}" for name, col in EXPORT_FIELDS)}) {SQL_WHERE}) TO STDOUT""",
+}
+# timestamps as epoch microseconds so the parquet column is built from plain ints
+SQL_SELECT = f"""SELECT (extract(epoch FROM timestamp_utc) * 1000000)::bigint, {', '.join(col for _, col in EXPORT_FIELDS[1:])} {SQL_WHERE}"""
+
+
+class ExportBusy(Exception):
+    pass
+
+
+def parquet_available() -> bool:
+    return importlib.util.find_spec('pyarrow') is not None
+
+
+class _ChunkSink:
+    """Write-only file object for ParquetWriter whose buffered bytes are taken after each row group."""
+
+    def __init__(self) -> None:
+        self.parts: list[bytes] = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def take(self) -> bytes:
+        data = b''.join(self.parts)
+        self.parts.clear()
+        return data
+
+
+class ExportLease:
+    """One export slot, and the connection once the stream has opened it.
+
+    release() is idempotent and called from the stream's finally and from the response's background
+    task; a lease dropped without either (the response was never sent) frees its slot when collected.
+    """
+
+    def __init__(self, exporter: MetricExporter):
+        self.exporter = exporter
+        self.conn: Optional[psycopg.AsyncConnection] = None
+        self.released = False
+
+    async def release(self) -> None:
+        if self.released:
+            return
+        self.released = True
+        self.exporter.active -= 1
+        if self.conn is not None:
+            await self.conn.close()
+
+    def __del__(self) -> None:
+        if not self.released:
+            self.released = True
+            self.exporter.active -= 1
+
+
+class MetricExporter:
+    """Streams metric_snapshots of one source over a dedicated connection, chunk by chunk.
+
+    CSV and NDJSON are produced by Postgres itself (COPY ... TO STDOUT) and relayed as they arrive.
+    Parquet reads a server-side cursor `EXPORT_CHUNK_ROWS` rows at a time and writes one row group
+    of typed columns per chunk. Memory stays bounded by one chunk whatever the time range; exports
+    do not use the shared pool, so a long export cannot starve API requests, and at most
+    `max_concurrent` run at once.
+    """
+
+    def __init__(self, max_concurrent: int = EXPORT_MAX_CONCURRENT, chunk_rows: int = EXPORT_CHUNK_ROWS):
+        self.max_concurrent = max_concurrent
+        self.chunk_rows = chunk_rows
+        self.active = 0
+        self.counters = {'exports': 0, 'bytes': 0, 'errors': 0}
+
+    def reserve(self) -> ExportLease:
+        """Take an export slot; raises ExportBusy when all slots are taken."""
+        if self.active >= self.max_concurrent:
+            raise ExportBusy(f'at most {self.max_concurrent} exports may run at once')
+        self.active += 1
+        return ExportLease(self)
+
+    async def stream(self, lease: ExportLease, fmt: str, source_id: str, from_dt: datetime, to_dt: datetime) -> AsyncIterator[bytes]:
+        """The connection is opened here, not by the handler: a response that is never iterated holds none."""
+        params = {'source': source_id, 'from': from_dt, 'to': to_dt}
+        try:
+            lease.conn = conn = await psycopg.AsyncConnection.connect(POSTGRES_DSN, connect_timeout=POSTGRES_CONNECT_TIMEOUT_SEC)
+            await conn.execute("SET TIME ZONE 'UTC'")
+            self.counters['exports'] += 1
+            chunks = self._parquet(conn, params) if fmt == 'parquet' else self._copy(conn, SQL_COPY[fmt], params)
+            async for data in chunks:
+                self.counters['bytes'] += len(data)
+                yield data
+        except Exception:
+            # headers are already sent; the client sees a truncated body
+            self.counters['errors'] += 1
+            raise
+        finally:
+            await lease.release()
+
+    async def _copy(self, conn: psycopg.AsyncConnection, sql: str, params: dict) -> AsyncIterator[bytes]:
+        async with conn.cursor() as cur:
+            async with cur.copy(sql, params) as copy:
+                async for data in copy:
+                    yield bytes(data)
+
+    async def _parquet(self, conn: psycopg.AsyncConnection, params: dict) -> AsyncIterator[bytes]:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        types = [pa.from_numpy_dtype(dtype) for _, dtype in HISTORY_FIELDS.values()]
+        schema = pa.schema([pa.field('timestampUtc', pa.timestamp('us', tz='UTC'))] + [pa.field(name, t) for (name, _), t in zip(EXPORT_FIELDS[1:], types)])
+        sink = _ChunkSink()
+        writer = pq.ParquetWriter(sink, schema)
+        async with conn.cursor(name='metric_export') as cur:
+            await cur.execute(SQL_SELECT, params)
+            while rows := await cur.fetchmany(self.chunk_rows):
+                columns = list(zip(*rows))
+                arrays = [pa.array(columns[0], pa.int64()).cast(schema.field(0).type)]
+                arrays += [pa.array(values, t) for values, t in zip(columns[1:], types)]
+                writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+                yield sink.take()
+        writer.close()
+        yield sink.take()
+
+    def stats(self) -> dict:
+        return {**self.counters, 'active': self.active, 'maxConcurrent': self.max_concurrent}
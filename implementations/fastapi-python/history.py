@@ -0,0 +1,219 @@
+from __future__ import annotations
+
+import os
+from datetime import datetime, timezone
+from typing import Optional
+
+import numpy as np
+
+from db import db_conn
+from rollups import RAW, Resolution, pick_rollup
+
+HISTORY_RETENTION_SEC = float(os.getenv('HISTORY_RETENTION_SEC', str(6 * 3600)))
+HISTORY_MAX_POINTS = int(os.getenv('HISTORY_MAX_POINTS', '86400'))
+HISTORY_MAX_BUCKETS = int(os.getenv('HISTORY_MAX_BUCKETS', '5000'))
+
+# REST field -> (metric_snapshots column, dtype)
+HISTORY_FIELDS: dict[str, tuple[str, type]] = {
+    'temperatureC': ('temperature_c', np.float64),
+    'cpuLoadPercent': ('cpu_load_percent', np.float64),
+    'ramLoadPercent': ('ram_load_percent', np.float64),
+    'uptimeSeconds': ('uptime_seconds', np.int64),
+    'supplyVoltageV': ('supply_voltage_v', np.float64),
+}
+AGGREGATES = ('min', 'max', 'avg', 'last')
+SQL_AGGREGATES = {
+    'min': 'min({col})',
+    'max': 'max({col})',
+    'avg': 'avg({col})::double precision',
+    'last': '(array_agg({col} ORDER BY timestamp_utc DESC))[1]',
+}
+# the same aggregates recombined from metric_rollup_* buckets
+ROLLUP_AGGREGATES = {
+    'min': 'min({col}_min)',
+    'max': 'max({col}_max)',
+    'avg': '(sum({col}_sum) / nullif(sum({col}_count), 0))::double precision',
+    'last': '(array_agg({col}_last ORDER BY last_at DESC))[1]',
+}
+
+
+def to_epoch_ms(value: str) -> int:
+    dt = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp() * 1000)
+
+
+def ring_capacity(interval_ms: float) -> int:
+    return max(1, min(HISTORY_MAX_POINTS, int(HISTORY_RETENTION_SEC * 1000 / max(interval_ms, 1))))
+
+
+class MetricHistory:
+    """Fixed-capacity columnar ring buffer of snapshots for one source.
+
+    One int64 epoch-ms column plus one typed column per metric; appends overwrite the oldest
+    slot. Snapshots are expected in timestamp order, repeats of the same TimestampUtc (a poll
+    faster than the server update rate) are skipped.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.ts = np.zeros(capacity, dtype=np.int64)
+        self.columns = {name: np.zeros(capacity, dtype=dtype) for name, (_, dtype) in HISTORY_FIELDS.items()}
+        self.head = 0
+        self.size = 0
+        self.last_ts: Optional[int] = None
+
+    def append(self, payload: dict) -> None:
+        try:
+            ts = to_epoch_ms(payload['timestampUtc'])
+        except (KeyError, ValueError):
+            return
+        if self.last_ts is not None and ts <= self.last_ts:
+            return
+        i = self.head
+        self.ts[i] = ts
+        for name, column in self.columns.items():
+            column[i] = payload[name]
+        self.head = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        self.last_ts = ts
+
+    def merge(self, newer: MetricHistory) -> None:
+        """Append the points of `newer` later than the last one here (a ring that took over feeding this source)."""
+        ts, columns = newer.window(-(1 << 62) if self.last_ts is None else self.last_ts + 1, 1 << 62)
+        for k in range(len(ts)):
+            i = self.head
+            self.ts[i] = ts[k]
+            for name, column in self.columns.items():
+                column[i] = columns[name][k]
+            self.head = (i + 1) % self.capacity
+            self.size = min(self.size + 1, self.capacity)
+            self.last_ts = int(ts[k])
+
+    @property
+    def oldest_ts(self) -> Optional[int]:
+        if not self.size:
+            return None
+        return int(self.ts[(self.head - self.size) % self.capacity])
+
+    def _segments(self) -> list[slice]:
+        """Slices of the backing arrays in chronological order."""
+        start = (self.head - self.size) % self.capacity
+        if start + self.size <= self.capacity:
+            return [slice(start, start + self.size)]
+        return [slice(start, self.capacity), slice(0, self.head)]
+
+    def window(self, from_ms: int, to_ms: int) -> tuple[np.ndarray, dict[str, np.ndarray]]:
+        """Copies of the points with from_ms <= ts < to_ms, oldest first."""
+        picks = []
+        for seg in self._segments():
+            ts = self.ts[seg]
+            lo, hi = np.searchsorted(ts, from_ms, 'left'), np.searchsorted(ts, to_ms, 'left')
+            if hi > lo:
+                picks.append(slice(seg.start + lo, seg.start + hi))
+        if not picks:
+            return np.empty(0, dtype=np.int64), {name: np.empty(0, dtype=c.dtype) for name, c in self.columns.items()}
+        return (
+            np.concatenate([self.ts[p] for p in picks]),
+            {name: np.concatenate([c[p] for p in picks]) for name, c in self.columns.items()},
+        )
+
+    def buckets(self, from_ms: int, to_ms: int, step_ms: int, aggs: list[str]) -> tuple[list[int], dict[str, dict[str, list]]]:
+        """Bucket [from_ms, to_ms) into step_ms windows aligned to from_ms and reduce each with `aggs`."""
+        ts, values = self.window(from_ms, to_ms)
+        if not len(ts):
+            return [], {name: {agg: [] for agg in aggs} for name in values}
+        ids = (ts - from_ms) // step_ms
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(ids)) + 1))
+        ends = np.append(starts[1:], len(ts))
+        series = {}
+        for name, v in values.items():
+            out = {}
+            for agg in aggs:
+                if agg == 'min':
+                    r = np.minimum.reduceat(v, starts)
+                elif agg == 'max':
+                    r = np.maximum.reduceat(v, starts)
+                elif agg == 'avg':
+                    r = np.add.reduceat(v.astype(np.float64), starts) / (ends - starts)
+                else:
+                    r = v[ends - 1]
+                out[agg] = r.tolist()
+            series[name] = out
+        return (from_ms + ids[starts] * step_ms).tolist(), series
+
+
+async def history_from_table(res: Resolution, source_id: str, from_ms: int, to_ms: int, step_ms: int, aggs: list[str]) -> tuple[list[int], dict[str, dict[str, list]]]:
+    """Same bucketing as MetricHistory.buckets, computed by Postgres over the raw table or a rollup."""
+    templates = SQL_AGGREGATES if res is RAW else ROLLUP_AGGREGATES
+    selects = [templates[agg].format(col=col) for col, _ in HISTORY_FIELDS.values() for agg in aggs]
+    ts = res.time_column
+    sql = f"""
+        SELECT floor((extract(epoch FROM {ts}) * 1000 - %(from)s) / %(step)s)::bigint AS bucket, {', '.join(selects)}
+        FROM {res.table}
+        WHERE source_id = %(source)s AND {ts} >= to_timestamp(%(from)s / 1000.0) AND {ts} < to_timestamp(%(to)s / 1000.0)
+        GROUP BY bucket ORDER BY bucket
+    """
+    async with db_conn() as conn:
+        rows = await (await conn.execute(sql, {'from': from_ms, 'to': to_ms, 'step': step_ms, 'source': source_id})).fetchall()
+    series = {name: {agg: [] for agg in aggs} for name in HISTORY_FIELDS}
+    pairs = [(name, agg) for name in HISTORY_FIELDS for agg in aggs]
+    for row in rows:
+        for (name, agg), value in zip(pairs, row[1:]):
+            series[name][agg].append(value)
+    return [from_ms + row[0] * step_ms for row in rows], series
+
+
+async def history_from_db(source_id: str, from_ms: int, to_ms: int, step_ms: int, aggs: list[str]) -> tuple[list[int], dict[str, dict[str, list]], list[str]]:
+    """[from_ms, to_ms) from the coarsest resolution that fits the step; returns the resolutions used too.
+
+    A rollup bucket must lie inside one requested bucket, and the last requested bucket may end
+    inside a rollup bucket, so whole steps come from the rollup and the trailing partial step from
+    the raw table.
+    """
+    rollup = pick_rollup(from_ms, step_ms)
+    if rollup is None:
+        return (*await history_from_table(RAW, source_id, from_ms, to_ms, step_ms, aggs), [RAW.name])
+    mid = from_ms + (to_ms - from_ms) // step_ms * step_ms
+    timestamps, series = await history_from_table(rollup, source_id, from_ms, mid, step_ms, aggs) if mid > from_ms else ([], {})
+    used = [rollup.name] if mid > from_ms else []
+    if mid < to_ms:
+        tail_ts, tail = await history_from_table(RAW, source_id, mid, to_ms, step_ms, aggs)
+        timestamps = timestamps + tail_ts
+        series = {name: {agg: series.get(name, {}).get(agg, []) + values for agg, values in by_agg.items()} for name, by_agg in tail.items()}
+        used.append(RAW.name)
+    return timestamps, series, used
+
+
+async def query_history(history: MetricHistory, source_id: Optional[str], from_ms: int, to_ms: int, step_ms: int, aggs: list[str]) -> dict:
+    """Serve [from_ms, to_ms) from the ring buffer, falling back to Postgres for the part older than it.
+
+    The split point is rounded up to a bucket boundary so no bucket is computed from two places.
+    """
+    oldest = history.oldest_ts
+    split = to_ms if oldest is None else min(to_ms, max(from_ms, from_ms + -(-(oldest - from_ms) // step_ms) * step_ms))
+    timestamps: list[int] = []
+    series: dict[str, dict[str, list]] = {name: {agg: [] for agg in aggs} for name in HISTORY_FIELDS}
+    used, resolutions, complete = [], [], True
+
+    def extend(part_ts: list[int], part: dict[str, dict[str, list]]) -> None:
+        timestamps.extend(part_ts)
+        for name, by_agg in part.items():
+            for agg, values in by_agg.items():
+                series[name][agg].extend(values)
+
+    if split > from_ms:
+        if source_id is None:
+            complete = False
+        else:
+            try:
+                part_ts, part, resolutions = await history_from_db(source_id, from_ms, split, step_ms, aggs)
+                extend(part_ts, part)
+                used.append('postgres')
+            except Exception:
+                complete = False
+    if split < to_ms:
+        extend(*history.buckets(split, to_ms, step_ms, aggs))
+        used.append('memory')
+    return {'timestamps': timestamps, 'series': series, 'storage': used, 'resolutions': resolutions, 'complete': complete}
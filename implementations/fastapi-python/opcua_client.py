@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import os
+import random
+from typing import Any, Awaitable, Callable, Optional
+
+from asyncua import Client, Node, ua
+
+OPCUA_REQUEST_TIMEOUT_SEC = float(os.getenv('OPCUA_REQUEST_TIMEOUT_SEC', '4'))
+OPCUA_SESSION_TIMEOUT_MS = int(os.getenv('OPCUA_SESSION_TIMEOUT_MS', '60000'))
+OPCUA_KEEPALIVE_SEC = float(os.getenv('OPCUA_KEEPALIVE_SEC', '5'))
+OPCUA_BACKOFF_BASE_SEC = float(os.getenv('OPCUA_BACKOFF_BASE_SEC', '0.5'))
+OPCUA_BACKOFF_MAX_SEC = float(os.getenv('OPCUA_BACKOFF_MAX_SEC', '30'))
+
+# REST field, OPC UA browse name, converter. TimestampUtc stays last: the server writes it
+# last as the "snapshot complete" marker (spec section 8).
+METRIC_NODES: tuple[tuple[str, str, Any], ...] = (
+    ('temperatureC', 'TemperatureC', float),
+    ('cpuLoadPercent', 'CpuLoadPercent', float),
+    ('ramLoadPercent', 'RamLoadPercent', float),
+    ('uptimeSeconds', 'UptimeSeconds', int),
+    ('supplyVoltageV', 'SupplyVoltageV', float),
+    ('timestampUtc', 'TimestampUtc', str),
+)
+
+
+def backoff_delay(attempt: int, base: float = OPCUA_BACKOFF_BASE_SEC, cap: float = OPCUA_BACKOFF_MAX_SEC) -> float:
+    """Exponential backoff with full jitter, so many gateways do not reconnect in lockstep."""
+    return random.uniform(0, min(cap, base * (2 ** max(0, attempt - 1))))
+
+
+class _SnapshotHandler:
+    """Stages data-change values and publishes a snapshot only when TimestampUtc arrives.
+
+    Values written before the marker stay staged, so a half-updated snapshot is never exposed.
+    """
+
+    def __init__(self, nodes: list[Node], on_snapshot: Callable[[dict], Awaitable[None]]):
+        self.fields = {node.nodeid: (field, convert) for node, (field, _, convert) in zip(nodes, METRIC_NODES)}
+        self.values: dict = {}
+        self.on_snapshot = on_snapshot
+        self.error: Optional[Exception] = None
+
+    async def datachange_notification(self, node: Node, val: Any, data: Any) -> None:
+        field, convert = self.fields[node.nodeid]
+        self.values[field] = convert(val)
+        if field == 'timestampUtc' and len(self.values) == len(METRIC_NODES):
+            await self.on_snapshot(dict(self.values))
+
+    async def status_change_notification(self, status: Any) -> None:
+        self.error = ConnectionError(f'OPC UA subscription status changed: {status.Status}')
+
+
+class OpcUaSession:
+    """One long-lived client session to a `DeviceMetrics` object.
+
+    Node ids are resolved by browse path once per connect and cached; every read after that
+    is a single Read service call for all variables. asyncua's watchdog keeps the session
+    alive between reads and any failure leaves the session disconnected for the caller to retry.
+    """
+
+    def __init__(self, endpoint: str, namespace_uri: str, root_path: str = 'Objects/DeviceMetrics'):
+        self.endpoint = endpoint
+        self.namespace_uri = namespace_uri
+        self.root_path = root_path
+        self.client: Optional[Client] = None
+        self.nodes: list[Node] = []
+        self._handler: Optional[_SnapshotHandler] = None
+
+    @property
+    def connected(self) -> bool:
+        return self.client is not None
+
+    async def connect(self) -> None:
+        client = Client(url=self.endpoint, timeout=OPCUA_REQUEST_TIMEOUT_SEC, watchdog_intervall=OPCUA_KEEPALIVE_SEC)
+        client.session_timeout = OPCUA_SESSION_TIMEOUT_MS
+        await client.connect()
+        try:
+            ns_idx = await client.get_namespace_index(self.namespace_uri)
+            first, *rest = [p for p in self.root_path.strip('/').split('/') if p]
+            obj = await client.nodes.root.get_child([f'0:{first}', *[f'{ns_idx}:{p}' for p in rest]])
+            self.nodes = [await obj.get_child(f'{ns_idx}:{browse_name}') for _, browse_name, _ in METRIC_NODES]
+        except Exception:
+            await client.disconnect()
+            raise
+        self.client = client
+
+    async def disconnect(self) -> None:
+        client, self.client = self.client, None
+        self._handler = None
+        if client is not None:
+            try:
+                await client.disconnect()
+            except Exception:
+                pass
+
+    async def read_snapshot(self) -> dict:
+        if self.client is None:
+            raise ConnectionError('OPC UA session is not connected')
+        try:
+            values = await self.client.read_values(self.nodes)
+        except Exception:
+            await self.disconnect()
+            raise
+        return {field: convert(value) for (field, _, convert), value in zip(METRIC_NODES, values)}
+
+    async def subscribe(
+        self,
+        on_snapshot: Callable[[dict], Awaitable[None]],
+        publishing_interval_ms: float,
+        sampling_interval_ms: float,
+        queue_size: int,
+    ) -> None:
+        """Create one subscription with a MonitoredItem per variable; TimestampUtc is added last."""
+        if self.client is None:
+            raise ConnectionError('OPC UA session is not connected')
+        self._handler = _SnapshotHandler(self.nodes, on_snapshot)
+        subscription = await self.client.create_subscription(publishing_interval_ms, self._handler)
+        results = await subscription.subscribe_data_change(self.nodes, queuesize=queue_size, sampling_interval=sampling_interval_ms)
+        for result in results:
+            if isinstance(result, ua.StatusCode):
+                result.check()
+
+    async def check_alive(self) -> None:
+        """Raise if the subscription reported a status change or the server stopped answering."""
+        if self.client is None:
+            raise ConnectionError('OPC UA session is not connected')
+        error = self._handler.error if self._handler is not None else None
+        if error is not None:
+            await self.disconnect()
+            raise error
+        try:
+            await self.client.nodes.server_state.read_value()
+        except Exception:
+            await self.disconnect()
+            raise
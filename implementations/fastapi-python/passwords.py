@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import hmac
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from argon2 import PasswordHasher, Type, extract_parameters
+from argon2.exceptions import InvalidHashError, VerificationError
+
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', str(max(1, (os.cpu_count() or 2) // 2))))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv('PASSWORD_HASH_MAX_PENDING', str(PASSWORD_HASH_WORKERS * 4)))
+ARGON2_MEMORY_COST_KIB = int(os.getenv('ARGON2_MEMORY_COST_KIB', '19456'))
+ARGON2_PARALLELISM = int(os.getenv('ARGON2_PARALLELISM', '1'))
+# Fixed so that every worker and restart hashes alike. `python passwords.py --calibrate` suggests
+# a value for this machine (ARGON2_TARGET_MS per verify); set it here once, do not recompute per start.
+ARGON2_TIME_COST = int(os.getenv('ARGON2_TIME_COST', '2'))
+ARGON2_TARGET_MS = float(os.getenv('ARGON2_TARGET_MS', '50'))
+ARGON2_MAX_TIME_COST = int(os.getenv('ARGON2_MAX_TIME_COST', '10'))
+
+# Hash spent on unknown usernames so their login costs the same as a wrong password.
+_DUMMY_PASSWORD = 'not-a-real-password'
+
+
+class HashPoolBusy(Exception):
+    pass
+
+
+def legacy_sha256(password: str) -> str:
+    return hashlib.sha256(password.encode('utf-8')).hexdigest()
+
+
+def _hasher(params: tuple[int, int, int]) -> PasswordHasher:
+    time_cost, memory_cost, parallelism = params
+    return PasswordHasher(time_cost=time_cost, memory_cost=memory_cost, parallelism=parallelism)
+
+
+# The functions below run inside the pool processes.
+
+def _hash(password: str, params: tuple[int, int, int]) -> str:
+    return _hasher(params).hash(password)
+
+
+def _needs_upgrade(stored: str, params: tuple[int, int, int]) -> bool:
+    """Only a weaker hash is replaced: a stronger one (e.g. set by a host with a higher
+    ARGON2_TIME_COST) is left alone, so mixed configurations do not rehash back and forth."""
+    current = extract_parameters(stored)
+    time_cost, memory_cost, _ = params
+    return current.type is not Type.ID or current.time_cost < time_cost or current.memory_cost < memory_cost
+
+
+def _verify(stored: str, password: str, params: tuple[int, int, int]) -> tuple[bool, Optional[str]]:
+    """(matches, replacement hash). The replacement is set when `stored` is a legacy SHA-256 digest
+    or an Argon2 hash weaker than the current parameters."""
+    ph = _hasher(params)
+    if not stored.startswith('$argon2'):
+        if hmac.compare_digest(stored, legacy_sha256(password)):
+            return True, ph.hash(password)
+        return False, None
+    try:
+        ph.verify(stored, password)
+    except (VerificationError, InvalidHashError):
+        return False, None
+    return True, ph.hash(password) if _needs_upgrade(stored, params) else None
+
+
+def _calibrate(target_ms: float, memory_cost: int, parallelism: int, max_time_cost: int) -> int:
+    """Smallest time cost whose verify takes at least target_ms on this machine."""
+    for time_cost in range(1, max_time_cost + 1):
+        ph = PasswordHasher(time_cost=time_cost, memory_cost=memory_cost, parallelism=parallelism)
+        stored = ph.hash(_DUMMY_PASSWORD)
+        started = time.perf_counter()
+        ph.verify(stored, _DUMMY_PASSWORD)
+        if (time.perf_counter() - started) * 1000 >= target_ms:
+            return time_cost
+    return max_time_cost
+
+
+class PasswordHasherPool:
+    """Argon2id hashing in a dedicated process pool, off the event loop and the default threadpool.
+
+    At most `max_pending` operations are admitted (running plus queued); further calls raise
+    HashPoolBusy right away so the caller can answer 429 instead of queueing without bound.
+    """
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_pending: int = PASSWORD_HASH_MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.params = (ARGON2_TIME_COST, ARGON2_MEMORY_COST_KIB, ARGON2_PARALLELISM)
+        self.pending = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._dummy_hash: Optional[str] = None
+
+    async def start(self) -> None:
+        # spawn: forking a process that already runs an event loop and DB connections is unsafe
+        self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+        loop = asyncio.get_running_loop()
+        self._dummy_hash = await loop.run_in_executor(self._executor, _hash, _DUMMY_PASSWORD, self.params)
+
+    async def stop(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def _submit(self, fn, *args):
+        if self._executor is None:
+            raise RuntimeError('password hasher pool is not running')
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HashPoolBusy('password hashing queue is full')
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._submit(_hash, password, self.params)
+
+    async def verify(self, stored: Optional[str], password: str) -> tuple[bool, Optional[str]]:
+        """Check `password`; with `stored=None` (unknown user) burn one verify and report a mismatch."""
+        if stored is None:
+            await self._submit(_verify, self._dummy_hash, password, self.params)
+            return False, None
+        ok, new_hash = await self._submit(_verify, stored, password, self.params)
+        if new_hash is not None:
+            self.rehashed += 1
+        return ok, new_hash
+
+    def stats(self) -> dict:
+        return {
+            'workers': self.workers,
+            'pending': self.pending,
+            'maxPending': self.max_pending,
+            'rejected': self.rejected,
+            'rehashed': self.rehashed,
+            'timeCost': self.params[0],
+            'memoryCostKiB': self.params[1],
+        }
+
+
+if __name__ == '__main__' and sys.argv[1:] == ['--calibrate']:
+    # median of several runs, so one noisy sample does not decide the value to pin
+    samples = sorted(_calibrate(ARGON2_TARGET_MS, ARGON2_MEMORY_COST_KIB, ARGON2_PARALLELISM, ARGON2_MAX_TIME_COST) for _ in range(5))
+    print(f'ARGON2_TIME_COST={samples[len(samples) // 2]}')
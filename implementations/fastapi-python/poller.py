@@ -0,0 +1,304 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import secrets
+import time
+from dataclasses import dataclass, replace
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+from db import db_conn
+from history import MetricHistory, ring_capacity
+from opcua_client import OPCUA_KEEPALIVE_SEC, OpcUaSession, backoff_delay
+from snapshots import SnapshotWriter
+from telemetry import OPCUA_READ, POLL_LAG
+
+# env: a single source described by the OPCUA_* variables below; table: every row of opcua_sources
+OPCUA_SOURCES = os.getenv('OPCUA_SOURCES', 'env')
+OPCUA_ENDPOINT = os.getenv('OPCUA_ENDPOINT', 'opc.tcp://127.0.0.1:4840/metrics/server/')
+OPCUA_NAMESPACE_URI = os.getenv('OPCUA_NAMESPACE_URI', 'urn:argum:demo:metrics')
+OPCUA_ROOT_PATH = os.getenv('OPCUA_ROOT_PATH', 'Objects/DeviceMetrics')
+OPCUA_SOURCE_NAME = os.getenv('OPCUA_SOURCE_NAME', 'default-mini-opcua')
+OPCUA_READ_MODE = os.getenv('OPCUA_READ_MODE', 'poll')  # poll | subscribe
+OPCUA_POLL_INTERVAL_SEC = float(os.getenv('OPCUA_POLL_INTERVAL_SEC', '1'))
+OPCUA_PUBLISHING_INTERVAL_MS = int(os.getenv('OPCUA_PUBLISHING_INTERVAL_MS', '1000'))
+OPCUA_SAMPLING_INTERVAL_MS = int(os.getenv('OPCUA_SAMPLING_INTERVAL_MS', '0'))
+OPCUA_QUEUE_SIZE = int(os.getenv('OPCUA_QUEUE_SIZE', '10'))
+OPCUA_MAX_SESSIONS = int(os.getenv('OPCUA_MAX_SESSIONS', '200'))
+OPCUA_SOURCES_RELOAD_SEC = float(os.getenv('OPCUA_SOURCES_RELOAD_SEC', '10'))
+OPCUA_ERROR_THRESHOLD = int(os.getenv('OPCUA_ERROR_THRESHOLD', '5'))
+OPCUA_SOURCE_SYNC_SEC = float(os.getenv('OPCUA_SOURCE_SYNC_SEC', '5'))
+OPCUA_SOURCE_SYNC_TIMEOUT_SEC = float(os.getenv('OPCUA_SOURCE_SYNC_TIMEOUT_SEC', '0.5'))
+
+SQL_LOAD_SOURCES = """
+    SELECT id, source_name, endpoint_url, namespace_uri, root_path, poll_interval_ms,
+           read_mode, publishing_interval_ms, sampling_interval_ms, queue_size
+    FROM opcua_sources
+"""
+SQL_SOURCE_ID = "SELECT id FROM opcua_sources WHERE source_name=%s"
+SQL_SOURCE_CONNECTED = "UPDATE opcua_sources SET status='connected', last_connect_at=now(), consecutive_errors=0, last_error=NULL WHERE source_name=%s"
+SQL_SOURCE_READ = "UPDATE opcua_sources SET status='connected', last_read_at=%s, consecutive_errors=0, last_error=NULL WHERE source_name=%s"
+SQL_SOURCE_ERROR = "UPDATE opcua_sources SET status=%s, consecutive_errors=%s, last_error=%s WHERE source_name=%s"
+
+
+def now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+@dataclass(frozen=True)
+class SourceConfig:
+    name: str
+    endpoint_url: str
+    namespace_uri: str
+    root_path: str = 'Objects/DeviceMetrics'
+    poll_interval_ms: int = 1000
+    read_mode: str = 'poll'
+    publishing_interval_ms: int = 1000
+    sampling_interval_ms: int = 0
+    queue_size: int = 10
+    id: Optional[str] = None
+
+
+async def update_source_row(sql: str, params: tuple) -> None:
+    try:
+        async with db_conn(timeout=OPCUA_SOURCE_SYNC_TIMEOUT_SEC) as conn:
+            await conn.execute(sql, params, prepare=True)
+    except Exception:
+        pass
+
+
+def source_history(config: SourceConfig) -> MetricHistory:
+    return MetricHistory(ring_capacity(config.publishing_interval_ms if config.read_mode == 'subscribe' else config.poll_interval_ms))
+
+
+class SourceWorker:
+    """Ingestion task for one source: its own session, cadence, snapshot and health."""
+
+    def __init__(
+        self, config: SourceConfig, sessions: asyncio.Semaphore,
+        on_snapshot: Optional[Callable[[str, dict], None]] = None, snapshots: Optional[SnapshotWriter] = None,
+    ):
+        self.config = config
+        self.sessions = sessions
+        self.on_snapshot = on_snapshot
+        self.snapshots = snapshots
+        self.snapshot: dict = {}
+        # /metrics/current body, encoded once per new snapshot and served as-is to every client
+        self.version = 0
+        self.body: Optional[bytes] = None
+        self.etag: Optional[str] = None
+        self._instance = secrets.token_hex(4)
+        self._updated = asyncio.Event()
+        self.history = source_history(config)
+        self.status = {
+            'opcua': 'disconnected', 'mode': config.read_mode, 'lastReadAt': None,
+            'consecutiveErrors': 0, 'lastError': None, 'pollLagMs': None, 'snapshotsNotPersisted': 0,
+        }
+        self.errors = 0
+        self._read_at: Optional[float] = None
+        self._last_source_sync = 0.0
+        self._sync_task: Optional[asyncio.Task] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run(), name=f'opcua-source:{self.config.name}')
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def wait_for_update(self, version: int, timeout: float) -> None:
+        """Return once the snapshot version differs from `version`, or after `timeout` seconds."""
+        if self.version != version:
+            return
+        try:
+            await asyncio.wait_for(self._updated.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def _publish(self, payload: dict) -> None:
+        self.version += 1
+        self.body = json.dumps({**payload, 'source': self.config.name, 'version': self.version}).encode()
+        # the instance tag keeps ETags unique across worker restarts, which reset the version
+        self.etag = f'"{self._instance}-{self.version}"'
+        updated, self._updated = self._updated, asyncio.Event()
+        updated.set()
+
+    def health(self) -> dict:
+        age = None if self._read_at is None else round((time.monotonic() - self._read_at) * 1000, 1)
+        return {**self.status, 'snapshotAgeMs': age}
+
+    async def ingest(self, payload: dict) -> None:
+        loop = asyncio.get_running_loop()
+        read_at = now_iso()
+        changed = payload.get('timestampUtc') != self.snapshot.get('timestampUtc')
+        self.snapshot = payload
+        self.history.append(payload)
+        if changed:
+            self._publish(payload)
+            if self.on_snapshot is not None:
+                self.on_snapshot(self.config.name, payload)
+            # rows are batched by the shared writer; a repeated TimestampUtc is not stored twice
+            if self.snapshots is not None and not self.snapshots.enqueue(self.config.id, payload):
+                self.status['snapshotsNotPersisted'] += 1
+        self._read_at = time.monotonic()
+        self.status.update({'opcua': 'connected', 'lastReadAt': read_at, 'consecutiveErrors': 0, 'lastError': None})
+        sync_source = bool(self.errors) or loop.time() - self._last_source_sync >= OPCUA_SOURCE_SYNC_SEC
+        self.errors = 0
+        # at most one status write in flight: a slow or unreachable Postgres must not stall ingestion
+        if sync_source and (self._sync_task is None or self._sync_task.done()):
+            self._last_source_sync = loop.time()
+            self._sync_task = asyncio.create_task(update_source_row(SQL_SOURCE_READ, (read_at, self.config.name)))
+
+    async def _run(self) -> None:
+        c = self.config
+        session = OpcUaSession(c.endpoint_url, c.namespace_uri, c.root_path)
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    # the slot is held for the lifetime of the session, bounding open sessions process-wide
+                    async with self.sessions:
+                        await session.connect()
+                        self.status['opcua'] = 'connected'
+                        await update_source_row(SQL_SOURCE_CONNECTED, (c.name,))
+                        if c.read_mode == 'subscribe':
+                            # notifications call ingest(); this loop only watches the session
+                            await session.subscribe(self.ingest, c.publishing_interval_ms, c.sampling_interval_ms, c.queue_size)
+                            while True:
+                                await asyncio.sleep(OPCUA_KEEPALIVE_SEC)
+                                await session.check_alive()
+                        else:
+                            interval = c.poll_interval_ms / 1000.0
+                            next_tick = loop.time()
+                            while True:
+                                lag = loop.time() - next_tick
+                                self.status['pollLagMs'] = round(lag * 1000, 1)
+                                POLL_LAG.observe(lag, c.name)
+                                started = loop.time()
+                                payload = await session.read_snapshot()
+                                OPCUA_READ.observe(loop.time() - started, c.name)
+                                await self.ingest(payload)
+                                # fixed-rate schedule: a slow read shortens the next sleep instead of stretching the period
+                                next_tick = max(next_tick + interval, loop.time())
+                                await asyncio.sleep(next_tick - loop.time())
+                except Exception as e:
+                    self.errors += 1
+                    await session.disconnect()
+                    state = 'error' if self.errors >= OPCUA_ERROR_THRESHOLD else 'degraded'
+                    self.status.update({'opcua': state, 'consecutiveErrors': self.errors, 'lastError': str(e) or type(e).__name__})
+                    await update_source_row(SQL_SOURCE_ERROR, (state, self.errors, self.status['lastError'], c.name))
+                    await asyncio.sleep(backoff_delay(self.errors))
+        finally:
+            await session.disconnect()
+
+
+class SourceScheduler:
+    """Keeps one SourceWorker per configured source and reconciles them with opcua_sources."""
+
+    def __init__(
+        self, mode: str = OPCUA_SOURCES,
+        on_snapshot: Optional[Callable[[str, dict], None]] = None, snapshots: Optional[SnapshotWriter] = None,
+    ):
+        if mode not in ('env', 'table'):
+            raise ValueError(f'unknown OPCUA_SOURCES mode: {mode}')
+        self.mode = mode
+        self.on_snapshot = on_snapshot
+        self.snapshots = snapshots
+        self.sessions = asyncio.Semaphore(OPCUA_MAX_SESSIONS)
+        self.workers: dict[str, SourceWorker] = {}
+        self.default_source: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        await self.reload()
+        self._task = asyncio.create_task(self._reload_loop())
+
+    async def stop(self) -> None:
+        # wait for an interrupted reload() to unwind first: workers it started are in self.workers by then
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.gather(*(w.stop() for w in self.workers.values()))
+        self.workers.clear()
+
+    async def load_configs(self) -> Optional[list[SourceConfig]]:
+        """Current source list, or None when it cannot be read (running workers are then kept)."""
+        if self.mode == 'env':
+            source_id = None
+            try:
+                async with db_conn(timeout=OPCUA_SOURCE_SYNC_TIMEOUT_SEC) as conn:
+                    row = await (await conn.execute(SQL_SOURCE_ID, (OPCUA_SOURCE_NAME,))).fetchone()
+                    source_id = str(row[0]) if row else None
+            except Exception:
+                if self.workers:
+                    return None
+            return [SourceConfig(
+                OPCUA_SOURCE_NAME, OPCUA_ENDPOINT, OPCUA_NAMESPACE_URI, OPCUA_ROOT_PATH,
+                int(OPCUA_POLL_INTERVAL_SEC * 1000), OPCUA_READ_MODE,
+                OPCUA_PUBLISHING_INTERVAL_MS, OPCUA_SAMPLING_INTERVAL_MS, OPCUA_QUEUE_SIZE, source_id,
+            )]
+        try:
+            async with db_conn() as conn:
+                rows = await (await conn.execute(SQL_LOAD_SOURCES)).fetchall()
+        except Exception:
+            return None
+        return [SourceConfig(r[1], r[2], r[3], r[4], r[5], r[6], r[7], r[8], r[9], str(r[0])) for r in rows]
+
+    async def reload(self) -> None:
+        configs = await self.load_configs()
+        if configs is None:
+            return
+        wanted = {c.name: c for c in configs}
+        for name, w in self.workers.items():
+            # env mode learns the row id only once Postgres answers: keep the worker, its ring and ETag version
+            if name in wanted and wanted[name] != w.config and replace(wanted[name], id=w.config.id) == w.config:
+                w.config = wanted[name]
+        stale = [name for name, w in self.workers.items() if wanted.get(name) != w.config]
+        # dropped only once stopped, so a reload cancelled meanwhile leaves them for stop() (SourceWorker.stop is idempotent)
+        await asyncio.gather(*(self.workers[name].stop() for name in stale))
+        for name in stale:
+            del self.workers[name]
+        for name, config in wanted.items():
+            if name not in self.workers:
+                worker = SourceWorker(config, self.sessions, self.on_snapshot, self.snapshots)
+                worker.start()
+                self.workers[name] = worker
+        self.default_source = OPCUA_SOURCE_NAME if OPCUA_SOURCE_NAME in self.workers else min(self.workers, default=None)
+
+    async def _reload_loop(self) -> None:
+        while True:
+            await asyncio.sleep(OPCUA_SOURCES_RELOAD_SEC)
+            await self.reload()
+
+    def worker(self, name: Optional[str] = None) -> Optional[SourceWorker]:
+        return self.workers.get(name or self.default_source or '')
+
+    def status(self) -> dict:
+        sources = {name: w.health() for name, w in self.workers.items()}
+        states = [s['opcua'] for s in sources.values()]
+        if states and all(s == 'connected' for s in states):
+            overall = 'connected'
+        elif 'connected' in states:
+            overall = 'degraded'
+        else:
+            overall = states[0] if len(states) == 1 else 'disconnected'
+        default = sources.get(self.default_source or '', {})
+        return {
+            'opcua': overall,
+            'cache': 'ready' if any(w.snapshot for w in self.workers.values()) else 'empty',
+            'lastReadAt': default.get('lastReadAt'),
+            'defaultSource': self.default_source,
+            'sources': sources,
+        }
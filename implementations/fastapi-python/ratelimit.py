@@ -0,0 +1,249 @@
+from __future__ import annotations
+
+import asyncio
+import ipaddress
+import json
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Optional
+
+from tokens import InvalidToken, verify_access_token
+
+RATE_LIMIT_MAX_KEYS = int(os.getenv('RATE_LIMIT_MAX_KEYS', '50000'))
+# comma-separated networks whose clients skip the token buckets (not admission), e.g. a load generator
+RATE_LIMIT_EXEMPT_NETS = os.getenv('RATE_LIMIT_EXEMPT_NETS', '')
+ADMISSION_MAX_CONCURRENT = int(os.getenv('ADMISSION_MAX_CONCURRENT', '64'))
+ADMISSION_QUEUE_BUDGET_MS = float(os.getenv('ADMISSION_QUEUE_BUDGET_MS', '250'))
+
+
+@dataclass(frozen=True)
+class RouteClass:
+    name: str
+    rate_per_sec: float  # tokens per second and principal; 0 disables the bucket
+    burst: float
+    admission: bool = True  # counted against ADMISSION_MAX_CONCURRENT
+
+
+def route_class(name: str, rate_per_sec: str, burst: str, admission: bool = True) -> RouteClass:
+    env = name.upper()
+    return RouteClass(
+        name, float(os.getenv(f'RATE_LIMIT_{env}_PER_SEC', rate_per_sec)), float(os.getenv(f'RATE_LIMIT_{env}_BURST', burst)), admission,
+    )
+
+
+AUTH_ROUTES = route_class('auth', '5', '20')
+METRIC_ROUTES = route_class('metrics', '50', '100')
+ADMIN_ROUTES = route_class('admin', '10', '50')
+# SSE and exports park for seconds without using the worker and have their own caps
+STREAM_ROUTES = route_class('stream', '1', '10', admission=False)
+# a long-poll client asks again right after every update, so its rate follows the fastest source poll (100 ms)
+LONGPOLL_ROUTES = route_class('longpoll', '10', '20', admission=False)
+
+# first matching prefix wins; other paths (docs, unknown) are not limited
+ROUTE_CLASSES = (
+    ('/api/v1/auth/', AUTH_ROUTES),
+    ('/api/v1/metrics/stream', STREAM_ROUTES),
+    ('/api/v1/metrics/export', STREAM_ROUTES),
+    ('/api/v1/metrics/', METRIC_ROUTES),
+    ('/api/v1/gateway/', ADMIN_ROUTES),
+    ('/metrics', ADMIN_ROUTES),
+)
+
+
+def classify(scope: dict) -> Optional[RouteClass]:
+    path = scope['path']
+    for prefix, cls in ROUTE_CLASSES:
+        if path.startswith(prefix):
+            if cls is METRIC_ROUTES and b'afterVersion=' in scope.get('query_string', b''):
+                return LONGPOLL_ROUTES
+            return cls
+    return None
+
+
+class TokenBuckets:
+    """One token bucket per (route class, principal), kept in a bounded LRU.
+
+    A bucket idle long enough to have refilled is the same as a missing one, so such entries are
+    dropped from the cold end whenever a new key arrives. Past `max_keys` the least recently used
+    bucket is evicted even if it is not full (counted: that principal starts over with a full burst).
+    """
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        # key -> [tokens, updated_at, full_at]
+        self.buckets: OrderedDict[tuple[str, str], list[float]] = OrderedDict()
+        self.evicted = 0
+
+    def take(self, key: tuple[str, str], cls: RouteClass, now: float) -> float:
+        """0 when a token was taken, else the seconds until one will be available."""
+        b = self.buckets.get(key)
+        if b is None:
+            self._make_room(now)
+            b = self.buckets[key] = [cls.burst, now, now]
+        else:
+            self.buckets.move_to_end(key)
+            b[0] = min(cls.burst, b[0] + (now - b[1]) * cls.rate_per_sec)
+            b[1] = now
+        if b[0] < 1:
+            return (1 - b[0]) / cls.rate_per_sec
+        b[0] -= 1
+        b[2] = now + (cls.burst - b[0]) / cls.rate_per_sec
+        return 0.0
+
+    def _make_room(self, now: float) -> None:
+        buckets = self.buckets
+        while buckets:
+            key, b = next(iter(buckets.items()))
+            if b[2] > now:
+                if len(buckets) < self.max_keys:
+                    return
+                self.evicted += 1
+            del buckets[key]
+
+
+class Admission:
+    """Per-worker concurrency limit with early shedding.
+
+    At most `max_concurrent` admitted requests run at once; the rest wait in FIFO order. A request
+    is turned away at once when the expected wait (queue length times the recent mean time a request
+    holds its slot, spread over the slots) is over the budget, and after the budget otherwise, so an
+    overloaded worker answers 429 quickly instead of letting every request time out.
+    """
+
+    def __init__(self, max_concurrent: int = ADMISSION_MAX_CONCURRENT, budget_sec: float = ADMISSION_QUEUE_BUDGET_MS / 1000.0):
+        self.max_concurrent = max_concurrent
+        self.budget_sec = budget_sec
+        self.active = 0
+        self.queued = 0
+        self.hold_sec = 0.005  # moving average of the time a request holds its slot
+        self.waiters: deque[asyncio.Future] = deque()
+
+    def expected_wait(self) -> float:
+        return (self.queued + 1) * self.hold_sec / self.max_concurrent
+
+    async def acquire(self) -> float:
+        """0 once admitted, else the suggested retry delay in seconds (the request was shed)."""
+        if self.active < self.max_concurrent and not self.queued:
+            self.active += 1
+            return 0.0
+        wait = self.expected_wait()
+        if wait > self.budget_sec:
+            return wait
+        fut = asyncio.get_running_loop().create_future()
+        self.waiters.append(fut)
+        self.queued += 1
+        try:
+            await asyncio.wait_for(fut, self.budget_sec)
+        except asyncio.TimeoutError:
+            return max(wait, self.budget_sec)
+        except asyncio.CancelledError:
+            # the client went away after being handed a slot: pass it on
+            if fut.done() and not fut.cancelled():
+                self.release(0.0)
+            raise
+        finally:
+            self.queued -= 1
+        return 0.0
+
+    def release(self, held_sec: float) -> None:
+        self.hold_sec += 0.05 * (held_sec - self.hold_sec)
+        while self.waiters:
+            fut = self.waiters.popleft()
+            if not fut.done():
+                # the slot moves to the waiter, `active` stays the same
+                fut.set_result(None)
+                return
+        self.active -= 1
+
+
+class RateLimiter:
+    def __init__(self, exempt_nets: str = RATE_LIMIT_EXEMPT_NETS):
+        self.buckets = TokenBuckets()
+        self.admission = Admission()
+        self.exempt = [ipaddress.ip_network(n.strip(), strict=False) for n in exempt_nets.split(',') if n.strip()]
+        self.counters = {'rateLimited': 0, 'shed': 0}
+
+    def is_exempt(self, client: Optional[tuple]) -> bool:
+        if not self.exempt or not client:
+            return False
+        try:
+            address = ipaddress.ip_address(client[0])
+        except ValueError:
+            return False
+        return any(address in net for net in self.exempt)
+
+    def stats(self) -> dict:
+        return {
+            **self.counters, 'buckets': len(self.buckets.buckets), 'bucketsEvicted': self.buckets.evicted,
+            'active': self.admission.active, 'queued': self.admission.queued, 'maxConcurrent': self.admission.max_concurrent,
+            'holdMs': round(self.admission.hold_sec * 1000, 2),
+        }
+
+
+def principal(scope: dict) -> str:
+    """User id of a valid bearer token (claims are left in the request state for get_current_user), else the client IP."""
+    for name, value in scope['headers']:
+        if name == b'authorization':
+            if value.startswith(b'Bearer '):
+                try:
+                    claims = verify_access_token(value[7:].decode('latin-1'))
+                except InvalidToken:
+                    break
+                scope.setdefault('state', {})['claims'] = claims
+                return 'user:' + claims['sub']
+            break
+    client = scope.get('client')
+    return 'ip:' + (client[0] if client else '-')
+
+
+async def reject(send, retry_after: float, message: str) -> None:
+    body = json.dumps({'detail': {'error': {'code': 'RATE_LIMITED', 'message': message}}}).encode()
+    await send({
+        'type': 'http.response.start', 'status': 429,
+        'headers': [
+            (b'content-type', b'application/json'), (b'content-length', str(len(body)).encode()),
+            (b'retry-after', str(max(1, math.ceil(retry_after))).encode()),
+        ],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+class AdmissionControl:
+    """Pure ASGI middleware: per-principal token buckets by route class, then the concurrency limit.
+
+    Both checks run before the body is read or a route dependency touches Postgres or the
+    threadpool; refused requests get 429 RATE_LIMITED with Retry-After. Limits are per worker.
+    """
+
+    def __init__(self, app, limiter: RateLimiter):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        cls = classify(scope) if scope['type'] == 'http' else None
+        if cls is None:
+            await self.app(scope, receive, send)
+            return
+        limiter = self.limiter
+        if cls.rate_per_sec > 0 and not limiter.is_exempt(scope.get('client')):
+            retry_after = limiter.buckets.take((cls.name, principal(scope)), cls, time.monotonic())
+            if retry_after:
+                limiter.counters['rateLimited'] += 1
+                await reject(send, retry_after, f'too many {cls.name} requests')
+                return
+        if not cls.admission:
+            await self.app(scope, receive, send)
+            return
+        retry_after = await limiter.admission.acquire()
+        if retry_after:
+            limiter.counters['shed'] += 1
+            await reject(send, retry_after, 'server is busy')
+            return
+        started = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.admission.release(time.monotonic() - started)
@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+from db import db_conn
+
+# days of data kept per resolution; whole partitions are dropped, so up to one partition more survives. 0 keeps forever
+METRIC_RETENTION_RAW_DAYS = float(os.getenv('METRIC_RETENTION_RAW_DAYS', '7'))
+METRIC_RETENTION_1M_DAYS = float(os.getenv('METRIC_RETENTION_1M_DAYS', '30'))
+METRIC_RETENTION_1H_DAYS = float(os.getenv('METRIC_RETENTION_1H_DAYS', '730'))
+METRIC_PARTITIONS_AHEAD = int(os.getenv('METRIC_PARTITIONS_AHEAD', '2'))
+
+ROLLUP_METRICS = ('temperature_c', 'cpu_load_percent', 'ram_load_percent', 'uptime_seconds', 'supply_voltage_v')
+
+SQL_ENSURE_PARTITIONS = "SELECT ensure_time_partitions(%s, date_trunc(%s, now(), 'UTC') - %s::interval, %s::interval, %s)"
+SQL_DROP_PARTITIONS = 'SELECT drop_expired_partitions(%s, now() - make_interval(secs => %s))'
+
+
+@dataclass(frozen=True)
+class Resolution:
+    name: str
+    table: str
+    time_column: str
+    bucket_ms: int
+    partition_step: str  # date_trunc field: day | month
+    retention_days: float
+
+
+RAW = Resolution('raw', 'metric_snapshots', 'timestamp_utc', 0, 'day', METRIC_RETENTION_RAW_DAYS)
+# coarsest first
+ROLLUPS = (
+    Resolution('1h', 'metric_rollup_1h', 'bucket_utc', 3_600_000, 'month', METRIC_RETENTION_1H_DAYS),
+    Resolution('1m', 'metric_rollup_1m', 'bucket_utc', 60_000, 'day', METRIC_RETENTION_1M_DAYS),
+)
+
+
+def rollup_upsert_sql(r: Resolution, stage: str) -> str:
+    """Fold the rows of `stage` into `r.table`: min/max/sum/count merge, last follows the newest timestamp.
+
+    `<metric>_count` counts the rows where the metric is not NULL, so avg = sum / count ignores gaps the
+    way avg() over the raw rows does; a NULL sum (no values yet) merges as 0.
+    """
+    cols, selects, updates = [], [], []
+    for m in ROLLUP_METRICS:
+        cols += [f'{m}_min', f'{m}_max', f'{m}_sum', f'{m}_last', f'{m}_count']
+        selects += [
+            f'min(s.{m})', f'max(s.{m})', f'sum(s.{m})::double precision', f'(array_agg(s.{m} ORDER BY s.timestamp_utc DESC))[1]',
+            f'count(s.{m})',
+        ]
+        updates += [
+            f'{m}_min = least(r.{m}_min, excluded.{m}_min)',
+            f'{m}_max = greatest(r.{m}_max, excluded.{m}_max)',
+            f'{m}_sum = coalesce(r.{m}_sum, 0) + coalesce(excluded.{m}_sum, 0)',
+            f'{m}_count = r.{m}_count + excluded.{m}_count',
+            f'{m}_last = CASE WHEN excluded.last_at >= r.last_at THEN excluded.{m}_last ELSE r.{m}_last END',
+        ]
+    return f"""
+        INSERT INTO {r.table} AS r (source_id, bucket_utc, samples, last_at, {', '.join(cols)})
+        SELECT s.source_id, date_bin('{r.bucket_ms} milliseconds', s.timestamp_utc, TIMESTAMPTZ 'epoch'), count(*), max(s.timestamp_utc), {', '.join(selects)}
+        FROM {stage} s JOIN opcua_sources o ON o.id = s.source_id
+        GROUP BY 1, 2
+        ON CONFLICT (source_id, bucket_utc) DO UPDATE SET
+            samples = r.samples + excluded.samples, last_at = greatest(r.last_at, excluded.last_at), {', '.join(updates)}
+    """
+
+
+def pick_rollup(from_ms: int, step_ms: int) -> Optional[Resolution]:
+    """Coarsest rollup whose buckets tile the requested ones exactly (step and start on its bucket grid)."""
+    for r in ROLLUPS:
+        if step_ms % r.bucket_ms == 0 and from_ms % r.bucket_ms == 0:
+            return r
+    return None
+
+
+async def maintain_partitions() -> tuple[int, int]:
+    """Create partitions from the previous one up to METRIC_PARTITIONS_AHEAD ahead and apply retention.
+
+    Returns (created, dropped).
+    """
+    created = dropped = 0
+    async with db_conn() as conn:
+        for r in (RAW, *ROLLUPS):
+            step = f'1 {r.partition_step}'
+            row = await (await conn.execute(SQL_ENSURE_PARTITIONS, (r.table, r.partition_step, step, step, METRIC_PARTITIONS_AHEAD + 2))).fetchone()
+            created += row[0] if row else 0
+            if r.retention_days > 0:
+                row = await (await conn.execute(SQL_DROP_PARTITIONS, (r.table, r.retention_days * 86400))).fetchone()
+                dropped += row[0] if row else 0
+    return created, dropped
@@ -0,0 +1,430 @@
+from __future__ import annotations
+
+import asyncio
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import secrets
+import struct
+import tempfile
+import time
+from dataclasses import asdict, replace
+from typing import Callable, Optional
+
+from db import POSTGRES_DSN
+from poller import OPCUA_ENDPOINT, OPCUA_SOURCE_NAME, OPCUA_SOURCES, SourceConfig, SourceScheduler, SourceWorker, now_iso, source_history
+
+# default: /dev/shm/opcua-gateway-<hash of DSN, sources and layout>, so unrelated gateways on one host never share
+GATEWAY_SHM_PATH = os.getenv('GATEWAY_SHM_PATH', '')
+GATEWAY_SHM_SLOTS = int(os.getenv('GATEWAY_SHM_SLOTS', '256'))
+GATEWAY_SHM_SLOT_BYTES = int(os.getenv('GATEWAY_SHM_SLOT_BYTES', '4096'))
+GATEWAY_SHM_STATUS_BYTES = int(os.getenv('GATEWAY_SHM_STATUS_BYTES', str(1 << 20)))
+GATEWAY_SHM_STATUS_SEC = float(os.getenv('GATEWAY_SHM_STATUS_SEC', '0.5'))
+# follower watcher period: the floor on how late a follower's long polls and SSE see a new snapshot
+GATEWAY_SHM_WATCH_MS = float(os.getenv('GATEWAY_SHM_WATCH_MS', '20'))
+GATEWAY_LEADER_RETRY_SEC = float(os.getenv('GATEWAY_LEADER_RETRY_SEC', '1'))
+
+MAGIC = b'OPCGWSHM'
+LAYOUT_VERSION = 1
+# magic, layout version, slots, slot bytes, status bytes, leader pid, leader instance, leader heartbeat (epoch s), takeovers
+HEADER = struct.Struct('<8sIIIII8sdI')
+HEADER_SIZE = 64
+HEARTBEAT = struct.Struct('<d')
+HEARTBEAT_OFFSET = struct.calcsize('<8sIIIII8s')
+SEQ = struct.Struct('<Q')
+RECORD = struct.Struct('<QI4x')  # seqlock counter, payload length; the payload follows
+SLOT = struct.Struct('<QHH')  # snapshot version, source name length, etag length; then name, etag, body
+SEQLOCK_READ_ATTEMPTS = 64
+
+
+def _align(n: int, to: int = 64) -> int:
+    return -(-n // to) * to
+
+
+def default_segment_path(slots: int, slot_bytes: int, status_bytes: int) -> str:
+    key = '|'.join((POSTGRES_DSN, OPCUA_SOURCES, OPCUA_ENDPOINT, OPCUA_SOURCE_NAME, str(slots), str(slot_bytes), str(status_bytes)))
+    directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(directory, f'opcua-gateway-{hashlib.sha1(key.encode()).hexdigest()[:12]}')
+
+
+class SharedSegment:
+    """Fixed-layout mmap'd file shared by the gateway processes of one host.
+
+    A header, one status record and `slots` snapshot records. Every record is a seqlock: the
+    writer makes the counter odd, writes the payload and makes it even again; a reader copies the
+    payload and keeps it only if the counter was even and unchanged around the copy. There is a
+    single writer (the leader) and readers never take a lock, so neither side can stall the other.
+    """
+
+    def __init__(self, path: str, slots: int, slot_bytes: int, status_bytes: int):
+        self.path = path
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self.status_bytes = status_bytes
+        self.status_offset = HEADER_SIZE
+        self.slots_offset = _align(HEADER_SIZE + RECORD.size + status_bytes)
+        self.slot_stride = _align(RECORD.size + slot_bytes)
+        self.size = self.slots_offset + slots * self.slot_stride
+        self.fd: Optional[int] = None
+        self.mm: Optional[mmap.mmap] = None
+
+    def open(self) -> None:
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+
+    def close(self) -> None:
+        # closing the descriptor also releases the leader lock
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def try_lock(self) -> bool:
+        try:
+            fcntl.flock(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        return True
+
+    def initialize(self, instance: str) -> None:
+        """Leader only: size and map the file and stamp the new leader into the header.
+
+        Record counters are kept, so they never repeat for a follower that cached an older value.
+        """
+        if os.fstat(self.fd).st_size < self.size:
+            os.ftruncate(self.fd, self.size)
+        if self.mm is None:
+            self.mm = mmap.mmap(self.fd, self.size)
+        previous = self.header()
+        takeovers = 0 if previous is None else previous['takeovers'] + 1
+        HEADER.pack_into(
+            self.mm, 0, MAGIC, LAYOUT_VERSION, self.slots, self.slot_bytes, self.status_bytes,
+            os.getpid(), instance.encode(), time.time(), takeovers,
+        )
+
+    def attach(self) -> bool:
+        """Follower: map the file once a leader has sized it. False while there is no valid segment."""
+        if self.mm is None:
+            # mapping past the end of the file would fault on first access
+            if os.fstat(self.fd).st_size < self.size:
+                return False
+            self.mm = mmap.mmap(self.fd, self.size)
+        return self.header() is not None
+
+    def header(self) -> Optional[dict]:
+        magic, layout, slots, slot_bytes, status_bytes, pid, instance, heartbeat, takeovers = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or (layout, slots, slot_bytes, status_bytes) != (LAYOUT_VERSION, self.slots, self.slot_bytes, self.status_bytes):
+            return None
+        return {'pid': pid, 'instance': instance.decode(), 'heartbeat': heartbeat, 'takeovers': takeovers}
+
+    def heartbeat(self) -> None:
+        HEARTBEAT.pack_into(self.mm, HEARTBEAT_OFFSET, time.time())
+
+    def slot_offset(self, slot: int) -> int:
+        return self.slots_offset + slot * self.slot_stride
+
+    def seq(self, offset: int) -> int:
+        return SEQ.unpack_from(self.mm, offset)[0]
+
+    def write(self, offset: int, capacity: int, data: bytes) -> bool:
+        if len(data) > capacity:
+            return False
+        mm = self.mm
+        # odd while writing; `| 1` also recovers a record left odd by a leader that died mid-write
+        seq = SEQ.unpack_from(mm, offset)[0] | 1
+        RECORD.pack_into(mm, offset, seq, len(data))
+        mm[offset + RECORD.size:offset + RECORD.size + len(data)] = data
+        SEQ.pack_into(mm, offset, seq + 1)
+        return True
+
+    def read(self, offset: int, capacity: int) -> tuple[int, Optional[bytes]]:
+        """(counter, payload) of a consistent copy; payload is None if the writer kept it busy throughout."""
+        mm = self.mm
+        for _ in range(SEQLOCK_READ_ATTEMPTS):
+            seq, length = RECORD.unpack_from(mm, offset)
+            if not seq & 1 and length <= capacity:
+                data = mm[offset + RECORD.size:offset + RECORD.size + length]
+                if SEQ.unpack_from(mm, offset)[0] == seq:
+                    return seq, data
+            # the writer is another process; let it finish rather than spin against it
+            os.sched_yield()
+        return 0, None
+
+
+class SharedSource:
+    """Follower-side stand-in for a SourceWorker, backed by the leader's slot for that source.
+
+    Reads are not zero-copy: each new version is copied out of the slot into a bytes object (and
+    parsed once for the ring), since a view over the mmap could change under a response being
+    sent. A request for an unchanged snapshot costs one 8-byte read and gets the cached body
+    object. Every snapshot picked up is also appended to a local ring buffer, so recent
+    /metrics/history is served from memory on followers too (at the watcher's resolution when a
+    source polls faster than GATEWAY_SHM_WATCH_MS).
+
+    Long polls and SSE here are woken by the watcher, so they trail the leader by up to
+    GATEWAY_SHM_WATCH_MS; /metrics/current syncs on the request itself.
+    """
+
+    def __init__(self, segment: SharedSegment, slot: int, config: SourceConfig, on_snapshot: Optional[Callable[[str, dict], None]] = None):
+        self.segment = segment
+        self.slot = slot
+        self.config = config
+        self.on_snapshot = on_snapshot
+        self.history = source_history(config)
+        self.version = 0
+        self.body: Optional[bytes] = None
+        self.etag: Optional[str] = None
+        self._seq = 0
+        self._snapshot: Optional[dict] = None
+        self._updated = asyncio.Event()
+
+    def sync(self) -> bool:
+        """Pick up a newer snapshot from the slot; True when there was one.
+
+        Called when the view is handed to a request and by the watcher, never between the reads of
+        one response, so body, etag and version always belong together.
+        """
+        offset = self.segment.slot_offset(self.slot)
+        if self.segment.seq(offset) == self._seq:
+            return False
+        seq, data = self.segment.read(offset, self.segment.slot_bytes)
+        if data is None:
+            return False
+        version, name_len, etag_len = SLOT.unpack_from(data)
+        start = SLOT.size
+        # a slot freed and handed to another source before the next status write
+        if data[start:start + name_len].decode() != self.config.name:
+            return False
+        self._seq = seq
+        self.version = version
+        self.etag = data[start + name_len:start + name_len + etag_len].decode()
+        self.body = data[start + name_len + etag_len:]
+        self._snapshot = None
+        self.history.append(self.snapshot)
+        updated, self._updated = self._updated, asyncio.Event()
+        updated.set()
+        if self.on_snapshot is not None:
+            self.on_snapshot(self.config.name, self.snapshot)
+        return True
+
+    @property
+    def snapshot(self) -> dict:
+        if self._snapshot is None:
+            payload = json.loads(self.body) if self.body else {}
+            payload.pop('source', None)
+            payload.pop('version', None)
+            self._snapshot = payload
+        return self._snapshot
+
+    async def wait_for_update(self, version: int, timeout: float) -> None:
+        """Same contract as SourceWorker.wait_for_update; the watcher's sync() wakes the waiters."""
+        self.sync()
+        if self.version != version:
+            return
+        try:
+            await asyncio.wait_for(self._updated.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+class SharedPoller:
+    """Runs the OPC UA poller in exactly one gateway process per host and shares what it reads.
+
+    Every process (uvicorn worker) opens the same segment and tries an exclusive flock on it. The
+    holder is the leader: it runs the SourceScheduler (so one OPC UA session and one
+    metric_snapshots row per source and tick), writes each new pre-encoded /metrics/current body
+    into the source's slot and, every GATEWAY_SHM_STATUS_SEC, the scheduler status into the status
+    record. Followers serve /metrics/current, SSE, long-polls and /gateway/status from the segment
+    and retry the lock every GATEWAY_LEADER_RETRY_SEC; the kernel drops the lock when the leader
+    exits or crashes, so one of them takes over within that interval. If the segment cannot be
+    opened the process polls on its own and reports role 'standalone'.
+    """
+
+    def __init__(
+        self, on_snapshot: Optional[Callable[[str, dict], None]] = None, path: str = GATEWAY_SHM_PATH,
+        slots: int = GATEWAY_SHM_SLOTS, slot_bytes: int = GATEWAY_SHM_SLOT_BYTES, status_bytes: int = GATEWAY_SHM_STATUS_BYTES,
+    ):
+        self.on_snapshot = on_snapshot
+        self.segment = SharedSegment(path or default_segment_path(slots, slot_bytes, status_bytes), slots, slot_bytes, status_bytes)
+        self.scheduler: Optional[SourceScheduler] = None
+        self.role = 'follower'  # leader | follower | standalone
+        self.instance = secrets.token_hex(4)
+        self.leader_since: Optional[str] = None
+        self.slots: dict[str, int] = {}  # leader: source name -> slot
+        self.views: dict[str, SharedSource] = {}  # follower: the leader's sources
+        self.shared_status: dict = {}
+        self.counters = {'slotsFull': 0, 'oversize': 0, 'errors': 0}
+        self._status_seq = 0
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def leader(self) -> bool:
+        return self.role != 'follower'
+
+    @property
+    def default_source(self) -> Optional[str]:
+        return self.scheduler.default_source if self.leader else self.shared_status.get('defaultSource')
+
+    async def start(self, scheduler: SourceScheduler) -> None:
+        self.scheduler = scheduler
+        try:
+            self.segment.open()
+        except OSError:
+            self.role = 'standalone'
+            await scheduler.start()
+            return
+        if self.segment.try_lock():
+            await self._lead()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # the poller stops before the lock is released, so two never run at once
+        if self.leader and self.scheduler is not None:
+            await self.scheduler.stop()
+        self.segment.close()
+
+    def publish(self, name: str, payload: dict) -> None:
+        """SourceScheduler's on_snapshot: fan out locally and, on the leader, copy the body into the slot."""
+        if self.on_snapshot is not None:
+            self.on_snapshot(name, payload)
+        if self.role != 'leader':
+            return
+        worker = self.scheduler.workers.get(name)
+        slot = self._slot(name)
+        if worker is None or slot is None or worker.body is None:
+            return
+        name_b, etag_b = name.encode(), worker.etag.encode()
+        data = SLOT.pack(worker.version, len(name_b), len(etag_b)) + name_b + etag_b + worker.body
+        if not self.segment.write(self.segment.slot_offset(slot), self.segment.slot_bytes, data):
+            self.counters['oversize'] += 1
+
+    def worker(self, name: Optional[str] = None) -> Optional[SourceWorker | SharedSource]:
+        if not self.leader:
+            view = self.views.get(name or self.default_source or '')
+            if view is not None:
+                view.sync()
+            return view
+        worker = self.scheduler.worker(name)
+        # right after a takeover the local worker has not read yet; the old leader's snapshot is still good
+        if worker is not None and worker.body is None and worker.config.name in self.views:
+            view = self.views[worker.config.name]
+            view.sync()
+            return view
+        return worker
+
+    def status(self) -> dict:
+        if self.leader:
+            return self.scheduler.status()
+        if not self.shared_status:
+            return {'opcua': 'disconnected', 'cache': 'empty', 'lastReadAt': None, 'defaultSource': None, 'sources': {}}
+        return {k: v for k, v in self.shared_status.items() if k != 'slots'}
+
+    def stats(self) -> dict:
+        stats = {'role': self.role, 'pid': os.getpid(), 'segment': self.segment.path, **self.counters}
+        header = self.segment.header() if self.segment.mm is not None else None
+        if header is not None:
+            stats.update({
+                'leaderPid': header['pid'], 'takeovers': header['takeovers'],
+                'leaderHeartbeatAgeMs': round((time.time() - header['heartbeat']) * 1000, 1),
+            })
+        if self.role == 'leader':
+            stats.update({'leaderSince': self.leader_since, 'slotsUsed': len(self.slots)})
+        elif self.role == 'follower':
+            stats.update({'sources': len(self.views), 'watchMs': GATEWAY_SHM_WATCH_MS})
+        return stats
+
+    async def _lead(self) -> None:
+        self.segment.initialize(self.instance)
+        for view in self.views.values():
+            # kept only as a fallback until the local workers have read; the scheduler fans out from now on
+            view.on_snapshot = None
+        self.role = 'leader'
+        self.leader_since = now_iso()
+        await self.scheduler.start()
+
+    async def _run(self) -> None:
+        last_attempt = time.monotonic()
+        while True:
+            try:
+                if self.role == 'leader':
+                    self._write_status()
+                    await asyncio.sleep(GATEWAY_SHM_STATUS_SEC)
+                    continue
+                if time.monotonic() - last_attempt >= GATEWAY_LEADER_RETRY_SEC:
+                    last_attempt = time.monotonic()
+                    if self.segment.try_lock():
+                        await self._lead()
+                        continue
+                self._follow()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.counters['errors'] += 1
+            await asyncio.sleep(GATEWAY_SHM_WATCH_MS / 1000.0)
+
+    def _slot(self, name: str) -> Optional[int]:
+        slot = self.slots.get(name)
+        if slot is None:
+            free = set(range(self.segment.slots)).difference(self.slots.values())
+            if not free:
+                self.counters['slotsFull'] += 1
+                return None
+            slot = self.slots[name] = min(free)
+        return slot
+
+    def _write_status(self) -> None:
+        workers = self.scheduler.workers
+        for name in [n for n in self.slots if n not in workers]:
+            del self.slots[name]
+        slots = {name: [slot, asdict(workers[name].config)] for name in workers if (slot := self._slot(name)) is not None}
+        data = json.dumps({**self.scheduler.status(), 'slots': slots}).encode()
+        if not self.segment.write(self.segment.status_offset, self.segment.status_bytes, data):
+            self.counters['oversize'] += 1
+        self.segment.heartbeat()
+        if self.views and all(w.body is not None for w in workers.values()):
+            # after a takeover: the local rings continue the ones this process kept as a follower
+            for name, view in self.views.items():
+                worker = workers.get(name)
+                if worker is not None and worker.history.capacity == view.history.capacity:
+                    view.history.merge(worker.history)
+                    worker.history = view.history
+            self.views.clear()
+
+    def _follow(self) -> None:
+        if not self.segment.attach():
+            return
+        if self.segment.seq(self.segment.status_offset) != self._status_seq:
+            seq, data = self.segment.read(self.segment.status_offset, self.segment.status_bytes)
+            if data is not None:
+                self._status_seq = seq
+                self.shared_status = json.loads(data)
+                self._reconcile(self.shared_status.get('slots', {}))
+        for view in list(self.views.values()):
+            view.sync()
+
+    def _reconcile(self, slots: dict) -> None:
+        for name in [n for n in self.views if n not in slots]:
+            del self.views[name]
+        for name, (slot, config) in slots.items():
+            view = self.views.get(name)
+            config = SourceConfig(**config)
+            if view is not None and view.slot == slot and replace(config, id=view.config.id) == view.config:
+                view.config = config
+            if view is None or view.slot != slot or view.config != config:
+                fresh = SharedSource(self.segment, slot, config, self.on_snapshot)
+                if view is not None:
+                    # long-polls parked on the old view are woken by the new one
+                    fresh._updated = view._updated
+                    if fresh.history.capacity == view.history.capacity:
+                        fresh.history = view.history
+                self.views[name] = fresh
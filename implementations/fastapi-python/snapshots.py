@@ -0,0 +1,191 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import time
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+from db import db_conn
+from rollups import ROLLUPS, maintain_partitions, rollup_upsert_sql
+
+METRIC_SNAPSHOT_QUEUE_SIZE = int(os.getenv('METRIC_SNAPSHOT_QUEUE_SIZE', '100000'))
+METRIC_SNAPSHOT_BATCH_SIZE = int(os.getenv('METRIC_SNAPSHOT_BATCH_SIZE', '5000'))
+METRIC_SNAPSHOT_FLUSH_INTERVAL_MS = int(os.getenv('METRIC_SNAPSHOT_FLUSH_INTERVAL_MS', '500'))
+# the payload only repeats the typed columns; store it when something downstream needs the raw JSON
+METRIC_SNAPSHOT_RAW_PAYLOAD = os.getenv('METRIC_SNAPSHOT_RAW_PAYLOAD', 'false').lower() in ('1', 'true', 'yes')
+METRIC_PARTITION_CHECK_SEC = float(os.getenv('METRIC_PARTITION_CHECK_SEC', '3600'))
+# a failed batch is retried with doubling delays up to this cap, and dropped after that many attempts
+METRIC_SNAPSHOT_FLUSH_RETRIES = int(os.getenv('METRIC_SNAPSHOT_FLUSH_RETRIES', '8'))
+METRIC_SNAPSHOT_RETRY_MAX_SEC = float(os.getenv('METRIC_SNAPSHOT_RETRY_MAX_SEC', '30'))
+
+SNAPSHOT_COLUMNS = (
+    'source_id', 'timestamp_utc', 'temperature_c', 'cpu_load_percent', 'ram_load_percent',
+    'uptime_seconds', 'supply_voltage_v', 'raw_payload',
+)
+# Batches are staged so that one COPY feeds both the raw table and the rollups, and so that rows of a
+# source deleted between enqueue and flush get a NULL source_id instead of failing the whole batch.
+# Rows already stored (same source and timestamp, e.g. a batch retried after its COMMIT went through)
+# are skipped, and only the rows actually inserted land in metric_snapshot_new for the rollups.
+SQL_STAGE = """
+    CREATE TEMP TABLE IF NOT EXISTS metric_snapshot_stage (
+        source_id UUID, timestamp_utc TIMESTAMPTZ, temperature_c DOUBLE PRECISION, cpu_load_percent DOUBLE PRECISION,
+        ram_load_percent DOUBLE PRECISION, uptime_seconds BIGINT, supply_voltage_v DOUBLE PRECISION, raw_payload JSONB
+    ) ON COMMIT DELETE ROWS
+"""
+SQL_STAGE_NEW = 'CREATE TEMP TABLE IF NOT EXISTS metric_snapshot_new (LIKE metric_snapshot_stage) ON COMMIT DELETE ROWS'
+SQL_COPY = f"COPY metric_snapshot_stage ({', '.join(SNAPSHOT_COLUMNS)}) FROM STDIN"
+SQL_MERGE = f"""
+    WITH inserted AS (
+        INSERT INTO metric_snapshots ({', '.join(SNAPSHOT_COLUMNS)})
+        SELECT o.id, {', '.join('s.' + c for c in SNAPSHOT_COLUMNS[1:])}
+        FROM metric_snapshot_stage s LEFT JOIN opcua_sources o ON o.id = s.source_id
+        ON CONFLICT DO NOTHING
+        RETURNING {', '.join(SNAPSHOT_COLUMNS)}
+    )
+    INSERT INTO metric_snapshot_new ({', '.join(SNAPSHOT_COLUMNS)}) SELECT * FROM inserted
+"""
+SQL_ROLLUPS = [rollup_upsert_sql(r, 'metric_snapshot_new') for r in ROLLUPS]
+
+
+class SnapshotWriter:
+    """Bounded queue of metric snapshots from every source, flushed to `metric_snapshots` with COPY.
+
+    A flush happens every `flush_interval_sec` or as soon as `batch_size` rows are queued, over one
+    pooled connection for all sources; the same transaction folds the newly inserted rows into the
+    1m/1h rollups, so rows already stored (`duplicates`) count toward neither.
+    Ingestion never waits for Postgres: when the queue is full the rows are dropped and counted (the
+    in-memory history still has them). A failed batch is kept and retried with backoff while new rows
+    queue up behind it, and only dropped after `max_retries` attempts. Every METRIC_PARTITION_CHECK_SEC the writer
+    also creates upcoming partitions and drops the ones past retention (see rollups.py), unless
+    `maintain_partitions` says another process owns that.
+    """
+
+    def __init__(
+        self,
+        queue_size: int = METRIC_SNAPSHOT_QUEUE_SIZE,
+        batch_size: int = METRIC_SNAPSHOT_BATCH_SIZE,
+        flush_interval_sec: float = METRIC_SNAPSHOT_FLUSH_INTERVAL_MS / 1000.0,
+        raw_payload: bool = METRIC_SNAPSHOT_RAW_PAYLOAD,
+        maintain_partitions: Optional[Callable[[], bool]] = None,
+        max_retries: int = METRIC_SNAPSHOT_FLUSH_RETRIES,
+        retry_max_sec: float = METRIC_SNAPSHOT_RETRY_MAX_SEC,
+    ):
+        self.queue: asyncio.Queue[tuple] = asyncio.Queue(maxsize=queue_size)
+        self.batch_size = batch_size
+        self.flush_interval_sec = flush_interval_sec
+        self.raw_payload = raw_payload
+        self.maintain_partitions = maintain_partitions
+        self.max_retries = max_retries
+        self.retry_max_sec = retry_max_sec
+        self.counters = {
+            'enqueued': 0, 'written': 0, 'duplicates': 0, 'dropped': 0, 'flushErrors': 0, 'flushRetries': 0,
+            'partitionsCreated': 0, 'partitionsDropped': 0,
+        }
+        self._retry: list[tuple] = []
+        self._retry_attempts = 0
+        self._retry_at = 0.0
+        self.last_flush_at: Optional[str] = None
+        self._partitions_checked = 0.0
+        self._wake = asyncio.Event()
+        self._closing = False
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    def enqueue(self, source_id: Optional[str], payload: dict) -> bool:
+        row = (
+            source_id, payload['timestampUtc'], payload['temperatureC'], payload['cpuLoadPercent'], payload['ramLoadPercent'],
+            payload['uptimeSeconds'], payload['supplyVoltageV'], json.dumps(payload) if self.raw_payload else None,
+        )
+        try:
+            self.queue.put_nowait(row)
+        except asyncio.QueueFull:
+            self.counters['dropped'] += 1
+            return False
+        self.counters['enqueued'] += 1
+        if self.queue.qsize() >= self.batch_size:
+            self._wake.set()
+        return True
+
+    async def stop(self, timeout: float = 5.0) -> None:
+        """Flush what is queued; rows still queued (or awaiting a retry) after `timeout` are dropped."""
+        if self._task is None:
+            return
+        self._closing = True
+        self._wake.set()
+        try:
+            await asyncio.wait_for(self._task, timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            pass
+        self._task = None
+        self.counters['dropped'] += self.queue.qsize() + len(self._retry)
+        self._retry = []
+
+    def stats(self) -> dict:
+        return {
+            **self.counters, 'queued': self.queue.qsize(), 'retrying': len(self._retry),
+            'rawPayload': self.raw_payload, 'lastFlushAt': self.last_flush_at,
+        }
+
+    async def _run(self) -> None:
+        while not (self._closing and self.queue.empty() and not self._retry):
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval_sec)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            due = time.monotonic() - self._partitions_checked >= METRIC_PARTITION_CHECK_SEC
+            if due and (self.maintain_partitions is None or self.maintain_partitions()):
+                await self._maintain()
+            if self._retry:
+                if time.monotonic() < self._retry_at and not self._closing:
+                    continue
+                self.counters['flushRetries'] += 1
+                if not await self._flush(self._retry):
+                    continue
+            while not self.queue.empty():
+                if not await self._flush([self.queue.get_nowait() for _ in range(min(self.batch_size, self.queue.qsize()))]):
+                    break
+
+    async def _maintain(self) -> None:
+        try:
+            created, dropped = await maintain_partitions()
+        except Exception:
+            # retry in a minute rather than on every flush while Postgres is away
+            self._partitions_checked = time.monotonic() - METRIC_PARTITION_CHECK_SEC + 60
+            return
+        self.counters['partitionsCreated'] += created
+        self.counters['partitionsDropped'] += dropped
+        self._partitions_checked = time.monotonic()
+
+    async def _flush(self, rows: list[tuple]) -> bool:
+        try:
+            async with db_conn() as conn:
+                async with conn.cursor() as cur:
+                    await cur.execute(SQL_STAGE)
+                    await cur.execute(SQL_STAGE_NEW)
+                    async with cur.copy(SQL_COPY) as copy:
+                        for row in rows:
+                            await copy.write_row(row)
+                    await cur.execute(SQL_MERGE)
+                    inserted = cur.rowcount
+                    for sql in SQL_ROLLUPS:
+                        await cur.execute(sql)
+        except Exception:
+            self.counters['flushErrors'] += 1
+            self._retry_attempts += 1
+            if self._closing or self._retry_attempts > self.max_retries:
+                self.counters['dropped'] += len(rows)
+                self._retry, self._retry_attempts = [], 0
+            else:
+                delay = min(self.flush_interval_sec * 2 ** (self._retry_attempts - 1), self.retry_max_sec)
+                self._retry, self._retry_at = rows, time.monotonic() + delay
+            return False
+        self._retry, self._retry_attempts = [], 0
+        self.counters['written'] += inserted
+        self.counters['duplicates'] += len(rows) - inserted
+        self.last_flush_at = datetime.now(timezone.utc).isoformat()
+        return True
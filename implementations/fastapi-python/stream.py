@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+from collections import Counter
+from typing import AsyncIterator, Optional
+
+STREAM_MAX_CLIENTS = int(os.getenv('STREAM_MAX_CLIENTS', '5000'))
+STREAM_MAX_CLIENTS_PER_USER = int(os.getenv('STREAM_MAX_CLIENTS_PER_USER', '10'))
+STREAM_HEARTBEAT_SEC = float(os.getenv('STREAM_HEARTBEAT_SEC', '15'))
+
+HEARTBEAT = b': keepalive\n\n'
+
+
+class StreamLimitExceeded(Exception):
+    pass
+
+
+def encode_frame(source: str, sequence: int, payload: dict) -> bytes:
+    return f'id: {sequence}\nevent: snapshot\ndata: {json.dumps({**payload, "source": source})}\n\n'.encode()
+
+
+class Subscriber:
+    """One connected client. Holds only the newest frame: a slow reader skips frames instead of queueing them."""
+
+    __slots__ = ('source', 'user_id', 'frame', 'ready', 'dropped')
+
+    def __init__(self, source: str, user_id: str):
+        self.source = source
+        self.user_id = user_id
+        self.frame: Optional[bytes] = None
+        self.ready = asyncio.Event()
+        self.dropped = 0
+
+    def offer(self, frame: bytes) -> None:
+        if self.ready.is_set():
+            self.dropped += 1
+        self.frame = frame
+        self.ready.set()
+
+    async def frames(self, heartbeat_sec: float = STREAM_HEARTBEAT_SEC) -> AsyncIterator[bytes]:
+        while True:
+            try:
+                await asyncio.wait_for(self.ready.wait(), heartbeat_sec)
+            except asyncio.TimeoutError:
+                yield HEARTBEAT
+                continue
+            self.ready.clear()
+            yield self.frame
+
+
+class SnapshotBroadcaster:
+    """Fans each new snapshot out to SSE subscribers; the frame is encoded once and shared by all clients."""
+
+    def __init__(self, max_clients: int = STREAM_MAX_CLIENTS, max_clients_per_user: int = STREAM_MAX_CLIENTS_PER_USER):
+        self.max_clients = max_clients
+        self.max_clients_per_user = max_clients_per_user
+        self.subscribers: dict[str, set[Subscriber]] = {}
+        self.per_user: Counter[str] = Counter()
+        self.client_count = 0
+        self.sequence: Counter[str] = Counter()
+        self.latest: dict[str, bytes] = {}
+        self.published = 0
+        self.dropped = 0
+
+    def publish(self, source: str, payload: dict) -> None:
+        self.sequence[source] += 1
+        subscribers = self.subscribers.get(source)
+        if not subscribers:
+            self.latest.pop(source, None)
+            return
+        frame = encode_frame(source, self.sequence[source], payload)
+        self.latest[source] = frame
+        self.published += 1
+        for subscriber in subscribers:
+            subscriber.offer(frame)
+
+    def subscribe(self, source: str, user_id: str, current: Optional[dict] = None) -> Subscriber:
+        if self.client_count >= self.max_clients:
+            raise StreamLimitExceeded('stream connection limit reached')
+        if self.per_user[user_id] >= self.max_clients_per_user:
+            raise StreamLimitExceeded('too many streams for this user')
+        subscriber = Subscriber(source, user_id)
+        self.subscribers.setdefault(source, set()).add(subscriber)
+        self.per_user[user_id] += 1
+        self.client_count += 1
+        frame = self.latest.get(source)
+        if frame is None and current:
+            frame = encode_frame(source, self.sequence[source], current)
+        if frame is not None:
+            subscriber.offer(frame)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        subscribers = self.subscribers.get(subscriber.source)
+        if subscribers is None or subscriber not in subscribers:
+            return
+        subscribers.discard(subscriber)
+        if not subscribers:
+            del self.subscribers[subscriber.source]
+            self.latest.pop(subscriber.source, None)
+        self.per_user[subscriber.user_id] -= 1
+        self.client_count -= 1
+        if self.per_user[subscriber.user_id] <= 0:
+            del self.per_user[subscriber.user_id]
+        self.dropped += subscriber.dropped
+
+    def stats(self) -> dict:
+        live_dropped = sum(s.dropped for subs in self.subscribers.values() for s in subs)
+        return {'clients': self.client_count, 'framesPublished': self.published, 'framesDropped': self.dropped + live_dropped}
@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import time
+from bisect import bisect_left
+from typing import Callable, Iterable, Optional, Union
+
+# Prometheus text exposition for GET /metrics. Counters live in plain dicts/lists of the worker
+# process and are only touched from its event loop, so the hot path takes no lock and allocates
+# nothing once a label set has been seen. Each uvicorn worker exports its own numbers; a scrape
+# lands on one of them (see gateway_worker_info).
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+GaugeValue = Union[float, Iterable[tuple[tuple[str, ...], float]]]
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Histogram:
+    """Cumulative-on-render histogram: observe() is one bisect and two in-place adds."""
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self.buckets = buckets
+        # label values -> [count per bucket..., +Inf count, sum]
+        self.series: dict[tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        s = self.series.get(labels)
+        if s is None:
+            s = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        s[bisect_left(self.buckets, value)] += 1
+        s[-1] += value
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        for labels, s in self.series.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, None), s[:-1]):
+                cumulative += count
+                le = 'le="+Inf"' if bound is None else f'le="{bound}"'
+                lines.append(f'{self.name}_bucket{_labels(self.label_names, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.label_names, labels)} {_number(s[-1])}')
+            lines.append(f'{self.name}_count{_labels(self.label_names, labels)} {cumulative}')
+        return lines
+
+
+class Gauge:
+    """Value read at scrape time from a callback: a number, or (label values, number) pairs.
+
+    Also used for counters the component already keeps (kind 'counter').
+    """
+
+    def __init__(self, name: str, help: str, read: Callable[[], GaugeValue], labels: tuple[str, ...] = (), kind: str = 'gauge'):
+        self.name = name
+        self.help = help
+        self.read = read
+        self.label_names = labels
+        self.kind = kind
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        try:
+            value = self.read()
+        except Exception:
+            return lines
+        samples = [((), value)] if isinstance(value, (int, float)) else value
+        for labels, v in samples:
+            if v is not None:
+                lines.append(f'{self.name}{_labels(self.label_names, labels)} {_number(v)}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: list[Union[Histogram, Gauge]] = []
+
+    def histogram(self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, help, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, help: str, read: Callable[[], GaugeValue], labels: tuple[str, ...] = ()) -> Gauge:
+        metric = Gauge(name, help, read, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, read: Callable[[], GaugeValue], labels: tuple[str, ...] = ()) -> Gauge:
+        metric = Gauge(name, help, read, labels, 'counter')
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> bytes:
+        lines: list[str] = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return ('\n'.join(lines) + '\n').encode()
+
+
+METRICS = Registry()
+HTTP_DURATION = METRICS.histogram(
+    'gateway_http_request_duration_seconds', 'Time from request start to the last response byte, by route template.',
+    ('method', 'route', 'status'),
+)
+DB_ACQUIRE = METRICS.histogram('gateway_db_acquire_seconds', 'Wait for a pooled Postgres connection.', buckets=FAST_BUCKETS)
+DB_QUERY = METRICS.histogram('gateway_db_query_seconds', 'Time a pooled connection is held: the statements of one db_conn() transaction.', buckets=FAST_BUCKETS)
+OPCUA_READ = METRICS.histogram('gateway_opcua_read_seconds', 'Round trip of one OPC UA snapshot read (poll mode).', ('source',))
+POLL_LAG = METRICS.histogram('gateway_poll_lag_seconds', 'How late a poll tick fired against its fixed-rate schedule.', ('source',), FAST_BUCKETS)
+IN_FLIGHT = [0]
+METRICS.gauge('gateway_http_requests_in_flight', 'Requests being handled by this worker.', lambda: IN_FLIGHT[0])
+
+
+class RequestTimer:
+    """Pure ASGI middleware feeding HTTP_DURATION and IN_FLIGHT.
+
+    The route label is the matched path template (Starlette leaves the route in the scope), so
+    ids and query strings never become label values; unmatched paths share one series.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        status = [500]
+
+        async def send_status(message):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+            await send(message)
+
+        IN_FLIGHT[0] += 1
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            IN_FLIGHT[0] -= 1
+            route: Optional[object] = scope.get('route')
+            HTTP_DURATION.observe(time.perf_counter() - started, scope['method'], getattr(route, 'path', 'unmatched'), str(status[0]))
@@ -0,0 +1,62 @@
+"""python3 -m unittest discover implementations/fastapi-python (needs POSTGRES_DSN with the schema applied, else skipped)"""
+from __future__ import annotations
+
+import asyncio
+import os
+import secrets
+import unittest
+
+import psycopg
+
+os.environ.setdefault('JWT_SECRET', 'test-only-0123456789abcdef0123456789abcdef')
+
+import main  # noqa: E402
+from db import POSTGRES_DSN  # noqa: E402
+
+SQL_USER = "INSERT INTO users (username, email, password_hash) VALUES (%s, %s, 'x') RETURNING id"
+SQL_FAMILY_LIVE = "SELECT count(*) FROM refresh_tokens WHERE user_id=%s AND revoked_at IS NULL"
+
+
+class ConcurrentRefreshTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        try:
+            self.admin = await psycopg.AsyncConnection.connect(POSTGRES_DSN, autocommit=True, connect_timeout=2)
+        except psycopg.OperationalError as e:
+            self.skipTest(f'no database at POSTGRES_DSN: {e}')
+        name = f'refresh_{secrets.token_hex(5)}'
+        self.user_id = (await (await self.admin.execute(SQL_USER, (name, f'{name}@example.local'))).fetchone())[0]
+        self.presented = main.token_hash(secrets.token_hex(24))
+        await self.admin.execute(main.SQL_LOGIN_ISSUE, (None, self.user_id, self.presented))
+
+    async def asyncTearDown(self) -> None:
+        await self.admin.execute(main.SQL_DELETE_SELF, (self.user_id,))
+        await self.admin.close()
+
+    async def test_second_concurrent_refresh_is_a_replay_and_revokes_the_family(self) -> None:
+        first = await psycopg.AsyncConnection.connect(POSTGRES_DSN)
+        second = await psycopg.AsyncConnection.connect(POSTGRES_DSN)
+        try:
+            async def rotate(conn: psycopg.AsyncConnection) -> tuple:
+                async with conn.transaction():
+                    return await main.rotate_refresh_token(conn, self.presented, main.token_hash(secrets.token_hex(24)))
+
+            async with first.transaction():
+                won = await main.rotate_refresh_token(first, self.presented, main.token_hash(secrets.token_hex(24)))
+                lost = asyncio.create_task(rotate(second))
+                await asyncio.sleep(0.3)
+                self.assertFalse(lost.done(), 'the second refresh must wait for the row lock')
+            lost = await lost
+        finally:
+            await first.close()
+            await second.close()
+
+        self.assertEqual(won[0], self.user_id)
+        self.assertIsNone(lost[0])
+        self.assertTrue(lost[5], 'the loser sees the rotation as a replay')
+        self.assertGreaterEqual(lost[6], 1)
+        live = (await (await self.admin.execute(SQL_FAMILY_LIVE, (self.user_id,))).fetchone())[0]
+        self.assertEqual(live, 0, "the winner's successor is revoked with the family")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+"""python3 -m unittest discover implementations/fastapi-python"""
+from __future__ import annotations
+
+import asyncio
+import gc
+import os
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+os.environ.setdefault('JWT_SECRET', 'test-only-0123456789abcdef0123456789abcdef')
+
+import main  # noqa: E402
+
+SCOPE = {'type': 'http', 'asgi': {'spec_version': '2.3'}}
+SNAPSHOT = {'timestampUtc': '2026-01-01T00:00:00Z', 'temperatureC': 40.0}
+
+
+class MetricsStreamReleaseTest(unittest.TestCase):
+    def setUp(self) -> None:
+        worker = SimpleNamespace(config=SimpleNamespace(name='test-source'), snapshot=SNAPSHOT)
+        patcher = mock.patch.object(main, 'source_worker', return_value=worker)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(setattr, main, 'STREAM', main.STREAM)
+        main.STREAM = main.SnapshotBroadcaster()
+
+    async def open_stream(self):
+        response = await main.metrics_stream(source=None, current={'userId': 'u1'})
+        self.assertEqual(main.STREAM.client_count, 1)
+        return response
+
+    def test_client_gone_before_first_frame_releases_the_subscriber(self) -> None:
+        async def scenario():
+            response = await self.open_stream()
+            await response(SCOPE, self.disconnect, self.discard)
+
+        asyncio.run(scenario())
+        self.assertEqual(main.STREAM.client_count, 0)
+        self.assertEqual(dict(main.STREAM.per_user), {})
+
+    def test_response_never_sent_releases_the_subscriber(self) -> None:
+        async def scenario():
+            response = await self.open_stream()
+            del response
+
+        asyncio.run(scenario())
+        gc.collect()
+        self.assertEqual(main.STREAM.client_count, 0)
+
+    def test_per_user_cap_frees_up_after_aborted_streams(self) -> None:
+        async def scenario():
+            for _ in range(main.STREAM.max_clients_per_user + 1):
+                await (await self.open_stream())(SCOPE, self.disconnect, self.discard)
+
+        asyncio.run(scenario())
+        self.assertEqual(main.STREAM.client_count, 0)
+
+    @staticmethod
+    async def disconnect():
+        return {'type': 'http.disconnect'}
+
+    @staticmethod
+    async def discard(message):
+        if message['type'] == 'http.response.start':
+            # the client is gone while the headers are still being sent: the body never starts
+            await asyncio.sleep(1)
+
+
+if __name__ == '__main__':
+    unittest.main()
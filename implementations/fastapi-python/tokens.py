@@ -0,0 +1,215 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+import jwt
+
+from db import db_conn
+
+JWT_SECRET = os.getenv('JWT_SECRET', '')
+if not JWT_SECRET:
+    # a key checked into the repo would let anyone mint admin tokens; it is opt-in for local runs only
+    if os.getenv('JWT_ALLOW_DEV_SECRET', 'false').lower() not in ('1', 'true', 'yes'):
+        raise RuntimeError('JWT_SECRET is not set (JWT_ALLOW_DEV_SECRET=true runs with the public development key)')
+    JWT_SECRET = 'dev-only-change-me-0123456789abcdef'
+JWT_ISSUER = os.getenv('JWT_ISSUER', 'opcua-gateway')
+JWT_AUDIENCE = os.getenv('JWT_AUDIENCE', 'opcua-gateway-api')
+JWT_ALGORITHM = os.getenv('JWT_ALGORITHM', 'HS256')
+JWT_ACCESS_TOKEN_TTL_SEC = int(os.getenv('JWT_ACCESS_TOKEN_TTL_SEC', '900'))
+JWT_LEEWAY_SEC = int(os.getenv('JWT_LEEWAY_SEC', '5'))
+REVOCATION_BUCKET_SEC = int(os.getenv('REVOCATION_BUCKET_SEC', '60'))
+REFRESH_TOKEN_PURGE_INTERVAL_SEC = float(os.getenv('REFRESH_TOKEN_PURGE_INTERVAL_SEC', '300'))
+REFRESH_TOKEN_PURGE_BATCH_SIZE = int(os.getenv('REFRESH_TOKEN_PURGE_BATCH_SIZE', '1000'))
+# how long logged-out / family-revoked refresh tokens are kept (rotated ones stay until expiry)
+REFRESH_TOKEN_REVOKED_RETENTION_SEC = float(os.getenv('REFRESH_TOKEN_REVOKED_RETENTION_SEC', '86400'))
+
+REVOCATION_CHANNEL = 'token_revoked'
+SQL_REVOKE = """
+    INSERT INTO revoked_tokens (token_key, revoked_at, expires_at)
+    VALUES (%s, to_timestamp(%s), to_timestamp(%s))
+    ON CONFLICT (token_key) DO NOTHING
+"""
+SQL_LOAD_REVOKED = "SELECT token_key, extract(epoch FROM revoked_at), extract(epoch FROM expires_at) FROM revoked_tokens WHERE expires_at > now()"
+SQL_PURGE_REVOKED = "DELETE FROM revoked_tokens WHERE expires_at <= now()"
+# A rotated token keeps replaced_by_token_id until it expires: presenting it again is how reuse is
+# detected. SKIP LOCKED leaves rows a refresh is rotating right now for the next batch.
+SQL_PURGE_REFRESH_TOKENS = """
+    DELETE FROM refresh_tokens WHERE id IN (
+        SELECT id FROM refresh_tokens
+        WHERE expires_at <= now() OR (revoked_at <= now() - make_interval(secs => %s) AND replaced_by_token_id IS NULL)
+        LIMIT %s FOR UPDATE SKIP LOCKED
+    )
+"""
+
+# the algorithm object and prepared key are built once, not per verified request
+_KEY = jwt.algorithms.get_default_algorithms()[JWT_ALGORITHM].prepare_key(JWT_SECRET)
+_DECODER = jwt.PyJWT()
+
+
+class InvalidToken(Exception):
+    pass
+
+
+class RevocationSet:
+    """Revoked token keys grouped by expiry bucket.
+
+    Keys are `jti:<id>` (one access token, logout) or `sub:<user id>` (every token issued
+    until `revoked_at`, delete-self). An entry is useless once the tokens it covers have
+    expired, so whole buckets are dropped after their window instead of tracking each key.
+    Lookups trigger that sweep too, at most once per bucket, so a set that stops receiving
+    revocations still empties.
+    """
+
+    def __init__(self, bucket_sec: int = REVOCATION_BUCKET_SEC):
+        self.bucket_sec = bucket_sec
+        self.keys: dict[str, float] = {}
+        self.buckets: dict[int, list[str]] = {}
+        self.purged_bucket = 0
+
+    def add(self, key: str, revoked_at: float, expires_at: float) -> None:
+        if key in self.keys or expires_at <= time.time():
+            return
+        self.keys[key] = revoked_at
+        self.buckets.setdefault(int(expires_at // self.bucket_sec), []).append(key)
+        self.purge()
+
+    def purge(self, now: Optional[float] = None) -> None:
+        current = int((time.time() if now is None else now) // self.bucket_sec)
+        self.purged_bucket = current
+        for bucket in [b for b in self.buckets if b < current]:
+            for key in self.buckets.pop(bucket):
+                self.keys.pop(key, None)
+
+    def is_revoked(self, claims: dict) -> bool:
+        if self.buckets and time.time() // self.bucket_sec > self.purged_bucket:
+            self.purge()
+        if f"jti:{claims['jti']}" in self.keys:
+            return True
+        revoked_at = self.keys.get(f"sub:{claims['sub']}")
+        return revoked_at is not None and claims['iat'] <= revoked_at
+
+    def on_notify(self, payload: str) -> None:
+        key, revoked_at, expires_at = payload.split(' ')
+        self.add(key, float(revoked_at), float(expires_at))
+
+    async def resync(self) -> None:
+        async with db_conn() as conn:
+            await conn.execute(SQL_PURGE_REVOKED)
+            rows = await (await conn.execute(SQL_LOAD_REVOKED)).fetchall()
+        for key, revoked_at, expires_at in rows:
+            self.add(key, float(revoked_at), float(expires_at))
+
+
+REVOKED = RevocationSet()
+
+
+def issue_access_token(user_id: str, username: str, email: str, role: str) -> str:
+    now = int(time.time())
+    claims = {
+        'sub': user_id,
+        'role': role,
+        'username': username,
+        'email': email,
+        'iss': JWT_ISSUER,
+        'aud': JWT_AUDIENCE,
+        'iat': now,
+        'exp': now + JWT_ACCESS_TOKEN_TTL_SEC,
+        'jti': uuid.uuid4().hex,
+    }
+    return jwt.encode(claims, _KEY, algorithm=JWT_ALGORITHM)
+
+
+def verify_access_token(token: str) -> dict:
+    """Signature, iss/aud/exp and revocation check; CPU-only and the same on every worker."""
+    try:
+        claims = _DECODER.decode(
+            token, _KEY, algorithms=[JWT_ALGORITHM], audience=JWT_AUDIENCE, issuer=JWT_ISSUER, leeway=JWT_LEEWAY_SEC,
+            options={'require': ['sub', 'role', 'iss', 'aud', 'iat', 'exp', 'jti']},
+        )
+    except jwt.PyJWTError as e:
+        raise InvalidToken(str(e))
+    if REVOKED.is_revoked(claims):
+        raise InvalidToken('token has been revoked')
+    return claims
+
+
+async def revoke(key: str, expires_at: float) -> None:
+    """Apply locally right away; the insert trigger NOTIFYs every other worker."""
+    revoked_at = time.time()
+    REVOKED.add(key, revoked_at, expires_at)
+    async with db_conn() as conn:
+        await conn.execute(SQL_REVOKE, (key, revoked_at, expires_at), prepare=True)
+
+
+async def revoke_token(claims: dict) -> None:
+    await revoke(f"jti:{claims['jti']}", claims['exp'] + JWT_LEEWAY_SEC)
+
+
+async def revoke_subject(user_id: str) -> None:
+    await revoke(f'sub:{user_id}', time.time() + JWT_ACCESS_TOKEN_TTL_SEC + JWT_LEEWAY_SEC)
+
+
+class RefreshTokenPurger:
+    """Deletes expired and long-revoked refresh tokens every `interval_sec`, `batch_size` rows per statement.
+
+    Each batch is its own short autocommit statement, so a backlog never holds locks or a pooled
+    connection for long. With several workers only the one `should_run` picks does the work.
+    """
+
+    def __init__(
+        self,
+        interval_sec: float = REFRESH_TOKEN_PURGE_INTERVAL_SEC,
+        batch_size: int = REFRESH_TOKEN_PURGE_BATCH_SIZE,
+        retention_sec: float = REFRESH_TOKEN_REVOKED_RETENTION_SEC,
+        should_run: Optional[Callable[[], bool]] = None,
+    ):
+        self.interval_sec = interval_sec
+        self.batch_size = batch_size
+        self.retention_sec = retention_sec
+        self.should_run = should_run
+        self.counters = {'runs': 0, 'batches': 0, 'deleted': 0, 'errors': 0}
+        self.last_run_at: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {**self.counters, 'lastRunAt': self.last_run_at}
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval_sec)
+            if self.should_run is None or self.should_run():
+                await self.purge()
+
+    async def purge(self) -> int:
+        deleted = 0
+        try:
+            while True:
+                async with db_conn(transaction=False) as conn:
+                    cur = await conn.execute(SQL_PURGE_REFRESH_TOKENS, (self.retention_sec, self.batch_size), prepare=True)
+                self.counters['batches'] += 1
+                deleted += cur.rowcount
+                if cur.rowcount < self.batch_size:
+                    break
+        except Exception:
+            self.counters['errors'] += 1
+        self.counters['runs'] += 1
+        self.counters['deleted'] += deleted
+        self.last_run_at = datetime.now(timezone.utc).isoformat()
+        return deleted
@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from db import db_conn
+
+USER_CACHE_MAX_ENTRIES = int(os.getenv('USER_CACHE_MAX_ENTRIES', '10000'))
+# wait for a pooled connection while the listener is down (usually Postgres is): answer fast instead
+USER_CACHE_OFFLINE_TIMEOUT_SEC = float(os.getenv('USER_CACHE_OFFLINE_TIMEOUT_SEC', '0.25'))
+# how long after the listener was last seen connected its entries may still be used
+USER_CACHE_MAX_STALE_SEC = float(os.getenv('USER_CACHE_MAX_STALE_SEC', '10'))
+
+USER_CHANGED_CHANNEL = 'user_changed'
+SQL_LOAD_USER = "SELECT id, username, email, role, is_active FROM users WHERE id=%s"
+
+
+@dataclass(frozen=True)
+class UserRecord:
+    id: str
+    username: str
+    email: str
+    role: str
+    is_active: bool
+
+
+class UserCache:
+    """Bounded LRU of user records (None for a user that does not exist), filled on demand.
+
+    A trigger on `users` NOTIFYs `user_changed` with the id whenever role, is_active, email or
+    username change or the row is deleted, and every worker drops that entry. Entries are only
+    trusted while `is_live` says the listener is connected (notifications sent meanwhile would
+    be lost), and for at most `max_stale_sec` after it was last seen connected; past that every
+    lookup goes to Postgres and its errors propagate, so callers fail closed. A load that raced
+    with any invalidation is returned but not stored.
+    """
+
+    def __init__(
+        self, max_entries: int = USER_CACHE_MAX_ENTRIES, is_live: Optional[Callable[[], bool]] = None,
+        max_stale_sec: float = USER_CACHE_MAX_STALE_SEC,
+    ):
+        self.max_entries = max_entries
+        self.is_live = is_live
+        self.max_stale_sec = max_stale_sec
+        self.entries: OrderedDict[str, Optional[UserRecord]] = OrderedDict()
+        self.generation = 0
+        self.live_seen_at = 0.0
+        self.counters = {'hits': 0, 'staleHits': 0, 'misses': 0, 'invalidations': 0, 'evicted': 0}
+
+    async def get(self, user_id: str) -> Optional[UserRecord]:
+        now = time.monotonic()
+        live = self.is_live is None or self.is_live()
+        if live:
+            self.live_seen_at = now
+        if user_id in self.entries:
+            if live:
+                self.entries.move_to_end(user_id)
+                self.counters['hits'] += 1
+                return self.entries[user_id]
+            if now - self.live_seen_at <= self.max_stale_sec:
+                self.counters['staleHits'] += 1
+                return self.entries[user_id]
+        self.counters['misses'] += 1
+        generation = self.generation
+        async with db_conn(None if live else USER_CACHE_OFFLINE_TIMEOUT_SEC, transaction=False) as conn:
+            row = await (await conn.execute(SQL_LOAD_USER, (user_id,), prepare=True)).fetchone()
+        record = UserRecord(str(row[0]), row[1], row[2], row[3], row[4]) if row else None
+        if live and generation == self.generation:
+            self.entries[user_id] = record
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.counters['evicted'] += 1
+        return record
+
+    def on_notify(self, payload: str) -> None:
+        self.generation += 1
+        self.counters['invalidations'] += 1
+        self.entries.pop(payload, None)
+
+    async def resync(self) -> None:
+        """After a (re)connect: anything may have changed while nobody was listening."""
+        self.generation += 1
+        self.entries.clear()
+
+    def stats(self) -> dict:
+        return {**self.counters, 'entries': len(self.entries), 'maxEntries': self.max_entries, 'maxStaleSec': self.max_stale_sec}
@@ -1,27 +1,84 @@
+import argparse
 import asyncio
+import contextlib
+import csv
 import math
 import os
 import random
 import time
+from dataclasses import dataclass
 from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterator
+from urllib.parse import urlsplit, urlunsplit
 
+import numpy as np
 import psutil
-from asyncua import Server, ua
+from asyncua import Node, Server, ua
+
+# Метрики устройства в порядке записи; TimestampUtc всегда пишется отдельно и последним.
+STANDARD_VARIABLES = (
+    ("TemperatureC", ua.VariantType.Double, 0.0),
+    ("CpuLoadPercent", ua.VariantType.Double, 0.0),
+    ("RamLoadPercent", ua.VariantType.Double, 0.0),
+    ("UptimeSeconds", ua.VariantType.UInt32, 0),
+    ("SupplyVoltageV", ua.VariantType.Double, 0.0),
+)
+
+
+# Столбцы трейса: те же, что в metric_snapshots, в порядке STANDARD_VARIABLES после timestamp_utc.
+TRACE_COLUMNS = ("timestamp_utc", "temperature_c", "cpu_load_percent", "ram_load_percent", "uptime_seconds", "supply_voltage_v")
+# Те же столбцы под именами REST (`timestampUtc`, `temperatureC`, ... — заголовок CSV из /api/v1/metrics/export).
+TRACE_REST_COLUMNS = ("timestampUtc", *(name[0].lower() + name[1:] for name, _, _ in STANDARD_VARIABLES))
+# Компактный бинарный трейс (.npy): timestamp_utc — секунды Unix; файл читается через memmap, а не целиком в память.
+TRACE_DTYPE = np.dtype([(name, "<u4" if name == "uptime_seconds" else "<f8") for name in TRACE_COLUMNS])
+TRACE_CHUNK_ROWS = 65536
+
+# Загрузка CPU/RAM хоста читается из /proc не чаще этого интервала, даже при тиках в доли миллисекунды.
+HOST_SAMPLE_SEC = 0.5
 
 
 class MetricsGenerator:
-    def __init__(self):
+    """Метрики хоста + синтетика; с `seed` — полностью детерминированная синтетика без psutil.
+
+    В детерминированном режиме uptime считается по тикам (`period_s`), а не по часам, чтобы два прогона
+    с одним seed давали одинаковые значения независимо от того, успел ли сервер выдержать период.
+    """
+
+    def __init__(self, seed: int | None = None, period_s: float = 1.0):
         self.start_time = time.time()
         self._phase = 0.0
+        self._host_sampled_at = 0.0
+        self._host = (0.0, 0.0)
+        self.rng = random.Random(seed) if seed is not None else None
+        self.period_s = period_s
+        self.tick = 0
+        if self.rng is not None:
+            self._host = (self.rng.uniform(5.0, 60.0), self.rng.uniform(20.0, 70.0))
+
+    def _sample_host(self) -> tuple[float, float]:
+        if self.rng is not None:
+            cpu, ram = self._host
+            cpu = min(100.0, max(0.0, cpu + self.rng.gauss(0.0, 3.0)))
+            ram = min(100.0, max(0.0, ram + self.rng.gauss(0.0, 0.5)))
+            self._host = (cpu, ram)
+        elif time.monotonic() - self._host_sampled_at >= HOST_SAMPLE_SEC:
+            self._host = (psutil.cpu_percent(interval=None), psutil.virtual_memory().percent)
+            self._host_sampled_at = time.monotonic()
+        return self._host
 
     def read(self) -> dict:
-        cpu_load = psutil.cpu_percent(interval=None)
-        ram_load = psutil.virtual_memory().percent
-        uptime_s = max(0, int(time.time() - self.start_time))
+        cpu_load, ram_load = self._sample_host()
+        if self.rng is not None:
+            uptime_s = int(self.tick * self.period_s)
+        else:
+            uptime_s = max(0, int(time.time() - self.start_time))
+        self.tick += 1
 
+        noise = self.rng.uniform if self.rng is not None else random.uniform
         self._phase += 0.15
-        temperature = 42.0 + 8.0 * math.sin(self._phase) + random.uniform(-0.5, 0.5)
-        voltage = 12.2 + 0.3 * math.sin(self._phase / 2.0) + random.uniform(-0.03, 0.03)
+        temperature = 42.0 + 8.0 * math.sin(self._phase) + noise(-0.5, 0.5)
+        voltage = 12.2 + 0.3 * math.sin(self._phase / 2.0) + noise(-0.03, 0.03)
 
         return {
             "temperature_c": round(temperature, 2),
@@ -29,64 +86,451 @@ class MetricsGenerator:
             "ram_load_percent": round(float(ram_load), 2),
             "uptime_seconds": uptime_s,
             "supply_voltage_v": round(voltage, 3),
-            "timestamp_utc": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
+            "timestamp_utc": utc_now_iso(),
         }
 
+    def read_columns(self) -> tuple[list[list], str]:
+        """То же, что read(), в форме FleetGenerator.read() для парка из одного устройства."""
+        m = self.read()
+        keys = ("temperature_c", "cpu_load_percent", "ram_load_percent", "uptime_seconds", "supply_voltage_v")
+        return [[m[k]] for k in keys], m["timestamp_utc"]
 
-async def main() -> None:
-    endpoint = os.getenv("OPCUA_ENDPOINT", "opc.tcp://0.0.0.0:4840/metrics/server/")
-    namespace_uri = os.getenv("OPCUA_NAMESPACE_URI", "urn:argum:demo:metrics")
-    update_period_ms = int(os.getenv("METRICS_UPDATE_PERIOD_MS", "1000"))
-    sleep_seconds = max(0.1, update_period_ms / 1000.0)
 
+class FleetGenerator:
+    """Значения для всех устройств парка за один тик: каждая метрика — один массив формы (devices,)."""
+
+    def __init__(self, devices: int, extra_variables: int = 0, seed: int | None = None, period_s: float = 1.0):
+        self.devices = devices
+        self.start_time = time.time()
+        # с seed uptime считается по тикам, как в MetricsGenerator
+        self.seeded = seed is not None
+        self.period_s = period_s
+        self.rng = np.random.default_rng(seed)
+        # у каждого устройства своя фаза и свой «возраст», чтобы кривые не совпадали
+        self.phase = self.rng.uniform(0.0, 2.0 * math.pi, devices)
+        self.uptime_offset = self.rng.integers(0, 86400, devices)
+        self.cpu = self.rng.uniform(5.0, 60.0, devices)
+        self.ram = self.rng.uniform(20.0, 70.0, devices)
+        self.extra_freq = self.rng.uniform(0.05, 0.5, (devices, extra_variables))
+        self.tick = 0
+
+    def read(self) -> tuple[list[np.ndarray], str]:
+        """Столбцы в порядке STANDARD_VARIABLES + Extra*, и общий TimestampUtc тика."""
+        d = self.devices
+        self.tick += 1
+        self.phase += 0.15
+        self.cpu = np.clip(self.cpu + self.rng.normal(0.0, 3.0, d), 0.0, 100.0)
+        self.ram = np.clip(self.ram + self.rng.normal(0.0, 0.5, d), 0.0, 100.0)
+        temperature = 42.0 + 8.0 * np.sin(self.phase) + self.rng.uniform(-0.5, 0.5, d)
+        voltage = 12.2 + 0.3 * np.sin(self.phase / 2.0) + self.rng.uniform(-0.03, 0.03, d)
+        elapsed = (self.tick - 1) * self.period_s if self.seeded else time.time() - self.start_time
+        uptime = self.uptime_offset + max(0, int(elapsed))
+        columns = [np.round(temperature, 2), np.round(self.cpu, 2), np.round(self.ram, 2), uptime, np.round(voltage, 3)]
+        if self.extra_freq.shape[1]:
+            extra = np.round(100.0 * np.sin(self.extra_freq * self.tick + self.phase[:, None]), 3)
+            columns.extend(extra.T)
+        return columns, utc_now_iso()
+
+
+def trace_header(fieldnames: list[str] | None) -> tuple[str, ...]:
+    """Имена столбцов CSV-трейса в порядке TRACE_COLUMNS: принимается и вариант metric_snapshots, и вариант REST."""
+    fields = set(fieldnames or ())
+    names, missing = [], []
+    for column, rest in zip(TRACE_COLUMNS, TRACE_REST_COLUMNS):
+        if column in fields:
+            names.append(column)
+        elif rest in fields:
+            names.append(rest)
+        else:
+            missing.append(f"{column}/{rest}")
+    if missing:
+        raise ValueError(
+            f"missing columns {', '.join(missing)}; expected {', '.join(TRACE_COLUMNS)} "
+            f"or {', '.join(TRACE_REST_COLUMNS)}, got {', '.join(fieldnames or ()) or 'no header'}"
+        )
+    return tuple(names)
+
+
+def _parse_trace_row(row: dict, names: tuple[str, ...] = TRACE_COLUMNS) -> tuple:
+    ts = datetime.fromisoformat(row[names[0]])
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    values = [float(row[name]) if row.get(name) not in (None, "") else math.nan for name in names[1:]]
+    values[3] = 0 if math.isnan(values[3]) else int(values[3])
+    return (ts.timestamp(), *values)
+
+
+def iter_trace(path: Path) -> Iterator[tuple]:
+    """Строки трейса (timestamp в секундах Unix, затем метрики) потоком, без загрузки файла в память.
+
+    .npy (TRACE_DTYPE) читается через memmap кусками по TRACE_CHUNK_ROWS; .csv — построчно, по заголовку,
+    так что годится и прямой экспорт metric_snapshots, и CSV из /api/v1/metrics/export (лишние столбцы вроде
+    id/raw_payload игнорируются).
+    """
+    if path.suffix == ".npy":
+        data = np.load(path, mmap_mode="r")
+        if data.dtype.names != TRACE_COLUMNS:
+            raise ValueError(f"{path}: expected fields {TRACE_COLUMNS}, got {data.dtype.names}")
+        for start in range(0, len(data), TRACE_CHUNK_ROWS):
+            yield from data[start:start + TRACE_CHUNK_ROWS].tolist()
+        return
+    with path.open(newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        try:
+            names = trace_header(reader.fieldnames)
+        except ValueError as e:
+            raise ValueError(f"{path}: {e}") from None
+        for row in reader:
+            yield _parse_trace_row(row, names)
+
+
+def convert_trace(src: Path, dst: Path) -> int:
+    """CSV -> .npy в TRACE_DTYPE: два прохода по файлу, результат пишется прямо в memmap."""
+    rows = sum(1 for _ in iter_trace(src))
+    out = np.lib.format.open_memmap(dst, mode="w+", dtype=TRACE_DTYPE, shape=(rows,))
+    chunk: list[tuple] = []
+    written = 0
+    for row in iter_trace(src):
+        chunk.append(row)
+        if len(chunk) == TRACE_CHUNK_ROWS:
+            out[written:written + len(chunk)] = chunk
+            written += len(chunk)
+            chunk = []
+    out[written:written + len(chunk)] = chunk
+    out.flush()
+    return rows
+
+
+@dataclass
+class DeviceNodes:
+    name: str
+    variables: list[Node]
+    types: list[ua.VariantType]
+    timestamp: Node
+
+
+class BatchWriter:
+    """Все изменившиеся значения тика одним вызовом AttributeService.write с SourceTimestamp.
+
+    Порядок внутри пакета — по устройствам, TimestampUtc каждого устройства идёт после его метрик,
+    так что правило "timestamp пишется последним" сохраняется и для подписчиков на изменения.
+    Неизменившиеся значения (например UptimeSeconds внутри секунды) в пакет не попадают.
+    """
+
+    def __init__(self, server: Server, devices: list[DeviceNodes]):
+        self.service = server.iserver.attribute_service
+        self.devices = devices
+        self.requests = [[ua.WriteValue(NodeId=n.nodeid, AttributeId=ua.AttributeIds.Value) for n in d.variables] for d in devices]
+        self.ts_requests = [ua.WriteValue(NodeId=d.timestamp.nodeid, AttributeId=ua.AttributeIds.Value) for d in devices]
+        self.previous: list[list] | None = None
+        self.values_written = 0
+        self.errors = 0
+
+    async def write(self, columns: list, ts: str) -> None:
+        now = datetime.now(timezone.utc)
+        columns = [c.tolist() if isinstance(c, np.ndarray) else c for c in columns]
+        previous = self.previous
+        batch = []
+        for i, device in enumerate(self.devices):
+            for j, (vtype, column) in enumerate(zip(device.types, columns)):
+                value = column[i]
+                if previous is not None and previous[j][i] == value:
+                    continue
+                wv = self.requests[i][j]
+                wv.Value = ua.DataValue(ua.Variant(int(value) if vtype == ua.VariantType.UInt32 else float(value), vtype), SourceTimestamp=now, ServerTimestamp=now)
+                batch.append(wv)
+            # Timestamp пишем последним как маркер "готового" снапшота устройства
+            wv = self.ts_requests[i]
+            wv.Value = ua.DataValue(ua.Variant(ts, ua.VariantType.String), SourceTimestamp=now, ServerTimestamp=now)
+            batch.append(wv)
+        self.previous = columns
+        results = await self.service.write(ua.WriteParameters(NodesToWrite=batch))
+        self.values_written += len(batch)
+        self.errors += sum(1 for status in results if not status.is_good())
+
+
+class TickScheduler:
+    """Фиксированный шаг без накопления дрейфа: следующий тик считается от планового, а не от фактического времени.
+
+    Если цикл отстал больше чем на период, пропущенные тики не догоняются пачкой, а учитываются в `missed`.
+    """
+
+    def __init__(self, period_s: float):
+        self.period_s = period_s
+        self.target = f"{1 / period_s:.1f}"
+        self.next_at: float | None = None
+        self.ticks = 0
+        self.missed = 0
+
+    async def wait(self) -> None:
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        self.next_at = now if self.next_at is None else self.next_at + self.period_s
+        behind = now - self.next_at
+        if behind >= self.period_s:
+            skipped = int(behind // self.period_s)
+            self.missed += skipped
+            self.next_at += skipped * self.period_s
+        if self.next_at > now:
+            await asyncio.sleep(self.next_at - now)
+        self.ticks += 1
+
+
+class ReplayClock:
+    """Расписание воспроизведения трейса: строка i выходит в момент (t_i - t_0) / speed от старта.
+
+    speed=0 — так быстро, как получается. Строки никогда не пропускаются (иначе прогоны перестанут
+    совпадать); если сервер не успевает, строка пишется с опозданием и учитывается в `missed`.
+    """
+
+    def __init__(self, speed: float):
+        self.speed = speed
+        self.started: float | None = None
+        self.trace_t0: float | None = None
+        self.ticks = 0
+        self.missed = 0
+        self.target = f"trace x{speed:g}" if speed > 0 else "max"
+
+    def restart(self) -> None:
+        """Начало нового прохода по трейсу (--replay-loop)."""
+        self.started = self.trace_t0 = None
+
+    async def wait(self, trace_ts: float) -> None:
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        if self.started is None:
+            self.started, self.trace_t0 = now, trace_ts
+        if self.speed > 0:
+            due = self.started + (trace_ts - self.trace_t0) / self.speed
+            if due > now:
+                await asyncio.sleep(due - now)
+            elif now - due > 0.001:
+                self.missed += 1
+        elif self.ticks % 64 == 0:
+            # даже в режиме "как можно быстрее" отдаём цикл событий клиентам
+            await asyncio.sleep(0)
+        self.ticks += 1
+
+
+class RateLog:
+    """Не больше одной строки лога за `interval_s` (0 — лог выключен) с фактической частотой тиков."""
+
+    def __init__(self, interval_s: float):
+        self.interval_s = interval_s
+        self.started = time.monotonic()
+        self.ticks = 0
+        self.missed = 0
+
+    def __call__(self, scheduler: TickScheduler | ReplayClock, writers: list[BatchWriter], detail: str) -> None:
+        if self.interval_s <= 0:
+            return
+        now = time.monotonic()
+        elapsed = now - self.started
+        if elapsed < self.interval_s:
+            return
+        rate = (scheduler.ticks - self.ticks) / elapsed
+        missed = scheduler.missed - self.missed
+        print(f"{detail} | {rate:.1f} ticks/s (target {scheduler.target}), missed {missed}, "
+              f"values {sum(w.values_written for w in writers)}, errors {sum(w.errors for w in writers)}")
+        self.started, self.ticks, self.missed = now, scheduler.ticks, scheduler.missed
+
+
+def utc_now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def utc_iso(seconds: float) -> str:
+    return datetime.fromtimestamp(seconds, timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def endpoint_with_port_offset(endpoint: str, offset: int) -> str:
+    parts = urlsplit(endpoint)
+    return urlunsplit(parts._replace(netloc=f"{parts.hostname}:{(parts.port or 4840) + offset}"))
+
+
+async def add_device(parent: Node, idx: int, name: str, extra_variables: int = 0) -> DeviceNodes:
+    device = await parent.add_object(idx, name)
+    specs = list(STANDARD_VARIABLES) + [(f"Extra{i + 1:02d}", ua.VariantType.Double, 0.0) for i in range(extra_variables)]
+    variables = [await device.add_variable(idx, browse_name, initial, vtype) for browse_name, vtype, initial in specs]
+    timestamp = await device.add_variable(idx, "TimestampUtc", "", ua.VariantType.String)
+    # Сохраняем поведение "как в текущей реализации" — переменные writable.
+    for node in (*variables, timestamp):
+        await node.set_writable()
+    return DeviceNodes(name, variables, [vtype for _, vtype, _ in specs], timestamp)
+
+
+async def new_server(endpoint: str, name: str) -> Server:
     server = Server()
     await server.init()
     server.set_endpoint(endpoint)
-    server.set_server_name("Mini OPC UA Metrics Server")
+    server.set_server_name(name)
+    return server
 
-    idx = await server.register_namespace(namespace_uri)
-    objects = server.nodes.objects
-    device = await objects.add_object(idx, "DeviceMetrics")
 
-    temp_var = await device.add_variable(idx, "TemperatureC", 0.0, ua.VariantType.Double)
-    cpu_var = await device.add_variable(idx, "CpuLoadPercent", 0.0, ua.VariantType.Double)
-    ram_var = await device.add_variable(idx, "RamLoadPercent", 0.0, ua.VariantType.Double)
-    uptime_var = await device.add_variable(idx, "UptimeSeconds", 0, ua.VariantType.UInt32)
-    volt_var = await device.add_variable(idx, "SupplyVoltageV", 0.0, ua.VariantType.Double)
-    ts_var = await device.add_variable(idx, "TimestampUtc", "", ua.VariantType.String)
+async def replay_trace(args: argparse.Namespace, writer: BatchWriter, log: RateLog) -> None:
+    """Строки трейса через те же узлы DeviceMetrics; значения берутся из файла, а не из генератора."""
+    clock = ReplayClock(args.replay_speed)
+    passes = 0
+    while True:
+        rows = 0
+        for row in iter_trace(args.trace):
+            await clock.wait(row[0])
+            ts = utc_iso(row[0]) if args.replay_timestamps == "original" else utc_now_iso()
+            try:
+                await writer.write([[v] for v in row[1:]], ts)
+            except Exception as e:
+                print(f"Update error: {e}")
+            rows += 1
+            log(clock, [writer], f"pass {passes + 1} row {rows} | TS={ts}")
+        passes += 1
+        if not rows:
+            raise ValueError(f"{args.trace}: trace is empty")
+        if not args.replay_loop:
+            print(f"Трейс воспроизведён: {rows} строк, опозданий {clock.missed}; узлы сохраняют последние значения.")
+            await asyncio.Event().wait()
+        clock.restart()
 
-    # Сохраняем поведение "как в текущей реализации" — переменные writable.
-    for node in (temp_var, cpu_var, ram_var, uptime_var, volt_var, ts_var):
-        await node.set_writable()
 
-    gen = MetricsGenerator()
+async def run_single(args: argparse.Namespace, period_s: float) -> None:
+    server = await new_server(args.endpoint, "Mini OPC UA Metrics Server")
+    idx = await server.register_namespace(args.namespace_uri)
+    device = await add_device(server.nodes.objects, idx, "DeviceMetrics")
+
+    gen = MetricsGenerator(args.seed, period_s)
+    writer = BatchWriter(server, [device])
+    scheduler = TickScheduler(period_s)
+    log = RateLog(args.log_interval)
 
     print("OPC UA сервер запущен:")
-    print(f"  Endpoint: {endpoint.replace('0.0.0.0', 'localhost')}")
-    print(f"  Namespace URI: {namespace_uri}")
+    print(f"  Endpoint: {args.endpoint.replace('0.0.0.0', 'localhost')}")
+    print(f"  Namespace URI: {args.namespace_uri}")
+    if args.trace:
+        speed = f"x{args.replay_speed:g}" if args.replay_speed > 0 else "максимальная"
+        print(f"  Трейс: {args.trace}, скорость {speed}" + (", по кругу" if args.replay_loop else ""))
     print("  Нажмите Ctrl+C для остановки")
 
     async with server:
+        if args.trace:
+            await replay_trace(args, writer, log)
+        while True:
+            await scheduler.wait()
+            try:
+                columns, ts = gen.read_columns()
+                await writer.write(columns, ts)
+                t, cpu, ram, uptime, volt = (c[0] for c in columns)
+                log(scheduler, [writer], f"T={t}°C | CPU={cpu}% | RAM={ram}% | Uptime={uptime}s | V={volt}V | TS={ts}")
+            except Exception as e:
+                print(f"Update error: {e}")
+
+
+async def run_fleet(args: argparse.Namespace, period_s: float) -> None:
+    """Парк из N устройств: Objects/<folder>/DeviceNNNN/*, общий или отдельный endpoint/namespace на устройство."""
+    extra = args.variables - len(STANDARD_VARIABLES)
+    width = max(4, len(str(args.devices - 1)))
+    servers: list[Server] = []
+    devices: list[DeviceNodes] = []
+    slots: list[int] = []
+    folders: dict[int, tuple[Node, int]] = {}
+
+    for i in range(args.devices):
+        slot = i if args.endpoint_mode == "per-device" else 0
+        if slot == len(servers):
+            server = await new_server(endpoint_with_port_offset(args.endpoint, slot), f"Mini OPC UA Fleet Server {slot}")
+            servers.append(server)
+        server = servers[slot]
+        uri = f"{args.namespace_uri}:device:{i:0{width}d}" if args.namespace_mode == "per-device" else args.namespace_uri
+        idx = await server.register_namespace(uri)
+        if slot not in folders:
+            folders[slot] = (await server.nodes.objects.add_object(idx, args.folder), idx)
+        devices.append(await add_device(folders[slot][0], idx, f"Device{i:0{width}d}", extra))
+        slots.append(slot)
+
+    gen = FleetGenerator(args.devices, extra, args.seed, period_s)
+    # отдельный endpoint на устройство — отдельный сервер и отдельный пакет записи
+    writers = [BatchWriter(server, [d for d, s in zip(devices, slots) if s == k]) for k, server in enumerate(servers)]
+    scheduler = TickScheduler(period_s)
+    log = RateLog(args.log_interval)
+
+    print("OPC UA сервер запущен в режиме парка устройств:")
+    print(f"  Устройств: {args.devices}, переменных на устройство: {args.variables} + TimestampUtc")
+    print(f"  Browse path: Objects/{args.folder}/{devices[0].name} ... {devices[-1].name}")
+    if args.endpoint_mode == "per-device":
+        print(f"  Endpoints: {endpoint_with_port_offset(args.endpoint, 0)} ... {endpoint_with_port_offset(args.endpoint, len(servers) - 1)}")
+    else:
+        print(f"  Endpoint: {args.endpoint.replace('0.0.0.0', 'localhost')}")
+    print(f"  Namespace URI: {args.namespace_uri}" + (":device:<N>" if args.namespace_mode == "per-device" else ""))
+
+    async with contextlib.AsyncExitStack() as stack:
+        for server in servers:
+            await stack.enter_async_context(server)
         while True:
+            await scheduler.wait()
             try:
-                m = gen.read()
-                await temp_var.write_value(ua.Variant(float(m["temperature_c"]), ua.VariantType.Double))
-                await cpu_var.write_value(ua.Variant(float(m["cpu_load_percent"]), ua.VariantType.Double))
-                await ram_var.write_value(ua.Variant(float(m["ram_load_percent"]), ua.VariantType.Double))
-                await uptime_var.write_value(ua.Variant(int(m["uptime_seconds"]), ua.VariantType.UInt32))
-                await volt_var.write_value(ua.Variant(float(m["supply_voltage_v"]), ua.VariantType.Double))
-                # Timestamp пишем последним как маркер "готового" снапшота
-                await ts_var.write_value(ua.Variant(str(m["timestamp_utc"]), ua.VariantType.String))
-
-                print(
-                    f"T={m['temperature_c']}°C | CPU={m['cpu_load_percent']}% | "
-                    f"RAM={m['ram_load_percent']}% | Uptime={m['uptime_seconds']}s | "
-                    f"V={m['supply_voltage_v']}V | TS={m['timestamp_utc']}"
-                )
+                started = time.perf_counter()
+                columns, ts = gen.read()
+                if len(writers) == 1:
+                    await writers[0].write(columns, ts)
+                else:
+                    for k, writer in enumerate(writers):
+                        await writer.write([c[k:k + 1] for c in columns], ts)
+                log(scheduler, writers, f"tick {gen.tick}: {args.devices} devices in {(time.perf_counter() - started) * 1000:.2f} ms | TS={ts}")
             except Exception as e:
                 print(f"Update error: {e}")
 
-            await asyncio.sleep(sleep_seconds)
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Mini OPC UA metrics server (одно устройство или парк устройств).")
+    parser.add_argument("--endpoint", default=os.getenv("OPCUA_ENDPOINT", "opc.tcp://0.0.0.0:4840/metrics/server/"))
+    parser.add_argument("--namespace-uri", default=os.getenv("OPCUA_NAMESPACE_URI", "urn:argum:demo:metrics"))
+    parser.add_argument("--update-period-ms", type=float, default=float(os.getenv("METRICS_UPDATE_PERIOD_MS", "1000")),
+                        help="период тика; дробные значения допустимы (0.5 — 2 кГц)")
+    parser.add_argument("--log-interval", type=float, default=float(os.getenv("METRICS_LOG_INTERVAL_SEC", "1")),
+                        help="не чаще одной строки лога за столько секунд; 0 — без лога")
+    parser.add_argument("--seed", type=int, default=int(os.environ["OPCUA_SEED"]) if os.getenv("OPCUA_SEED") else None,
+                        help="детерминированная синтетика: одинаковый seed — одинаковые значения в каждом прогоне")
+    parser.add_argument("--trace", type=Path, default=os.getenv("OPCUA_TRACE_FILE") or None,
+                        help="воспроизводить трейс (.csv в столбцах metric_snapshots или .npy) вместо генератора")
+    parser.add_argument("--replay-speed", type=float, default=float(os.getenv("OPCUA_REPLAY_SPEED", "1")),
+                        help="множитель скорости трейса; 0 — так быстро, как получается")
+    parser.add_argument("--replay-loop", action="store_true", default=os.getenv("OPCUA_REPLAY_LOOP", "false").lower() == "true")
+    parser.add_argument("--replay-timestamps", choices=("now", "original"), default=os.getenv("OPCUA_REPLAY_TIMESTAMPS", "now"),
+                        help="TimestampUtc: текущее время (по умолчанию) или записанное в трейсе")
+    parser.add_argument("--convert-trace", nargs=2, type=Path, metavar=("SRC_CSV", "DST_NPY"),
+                        help="сконвертировать CSV-трейс в компактный .npy и выйти")
+    parser.add_argument("--devices", type=int, default=int(os.getenv("OPCUA_FLEET_DEVICES", "0")),
+                        help="0 — одно устройство Objects/DeviceMetrics (по умолчанию); N — парк из N устройств")
+    parser.add_argument("--variables", type=int, default=int(os.getenv("OPCUA_FLEET_VARIABLES", str(len(STANDARD_VARIABLES)))),
+                        help="метрик на устройство без TimestampUtc; сверх пяти стандартных добавляются Extra01..")
+    parser.add_argument("--folder", default=os.getenv("OPCUA_FLEET_FOLDER", "Fleet"))
+    parser.add_argument("--endpoint-mode", choices=("shared", "per-device"), default=os.getenv("OPCUA_FLEET_ENDPOINT_MODE", "shared"),
+                        help="per-device: отдельный сервер на устройство, порт endpoint + номер устройства")
+    parser.add_argument("--namespace-mode", choices=("shared", "per-device"), default=os.getenv("OPCUA_FLEET_NAMESPACE_MODE", "shared"),
+                        help="per-device: namespace <uri>:device:<N> на каждое устройство")
+    args = parser.parse_args()
+    if args.update_period_ms <= 0:
+        parser.error("--update-period-ms must be positive")
+    if args.replay_speed < 0:
+        parser.error("--replay-speed must be >= 0")
+    if args.trace and args.devices:
+        parser.error("--trace replays a single device; it cannot be combined with --devices")
+    if args.trace and not args.trace.is_file():
+        parser.error(f"trace file not found: {args.trace}")
+    if args.devices and args.variables < len(STANDARD_VARIABLES):
+        parser.error(f"--variables must be at least {len(STANDARD_VARIABLES)}")
+    return args
+
+
+async def main() -> None:
+    args = parse_args()
+    if args.convert_trace:
+        src, dst = args.convert_trace
+        print(f"{dst}: {convert_trace(src, dst)} строк")
+        return
+    period_s = args.update_period_ms / 1000.0
+    if args.devices > 0:
+        await run_fleet(args, period_s)
+    else:
+        await run_single(args, period_s)
 
 
 if __name__ == "__main__":
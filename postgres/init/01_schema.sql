@@ -40,6 +40,20 @@ CREATE TABLE IF NOT EXISTS refresh_tokens (
 CREATE INDEX IF NOT EXISTS idx_refresh_tokens_user_id ON refresh_tokens(user_id);
 CREATE INDEX IF NOT EXISTS idx_refresh_tokens_expires_at ON refresh_tokens(expires_at);
 CREATE INDEX IF NOT EXISTS idx_refresh_tokens_revoked_at ON refresh_tokens(revoked_at);
+-- Ротация: при повторном предъявлении уже заменённого токена отзывается всё семейство;
+-- ON DELETE SET NULL по replaced_by_token_id при пакетной очистке ищет ссылающиеся строки по индексу.
+CREATE INDEX IF NOT EXISTS idx_refresh_tokens_family_live ON refresh_tokens(token_family_id) WHERE revoked_at IS NULL;
+CREATE INDEX IF NOT EXISTS idx_refresh_tokens_replaced_by ON refresh_tokens(replaced_by_token_id) WHERE replaced_by_token_id IS NOT NULL;
+
+-- Отозванные access-токены (JWT): jti:<id> — один токен (logout), sub:<user id> — все токены
+-- пользователя, выпущенные до revoked_at (удаление аккаунта). Строка нужна только до expires_at.
+CREATE TABLE IF NOT EXISTS revoked_tokens (
+    token_key TEXT PRIMARY KEY,
+    revoked_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    expires_at TIMESTAMPTZ NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_revoked_tokens_expires_at ON revoked_tokens(expires_at);
 
 -- Аудит API (логирование безопасности и бизнес-действий)
 CREATE TABLE IF NOT EXISTS audit_log (
@@ -77,6 +91,10 @@ CREATE TABLE IF NOT EXISTS opcua_sources (
     namespace_uri TEXT NOT NULL,
     root_path TEXT NOT NULL DEFAULT 'Objects/DeviceMetrics',
     poll_interval_ms INTEGER NOT NULL DEFAULT 1000,
+    read_mode TEXT NOT NULL DEFAULT 'poll',
+    publishing_interval_ms INTEGER NOT NULL DEFAULT 1000,
+    sampling_interval_ms INTEGER NOT NULL DEFAULT 0,
+    queue_size INTEGER NOT NULL DEFAULT 10,
     status TEXT NOT NULL DEFAULT 'disconnected',
     last_connect_at TIMESTAMPTZ,
     last_read_at TIMESTAMPTZ,
@@ -84,12 +102,16 @@ CREATE TABLE IF NOT EXISTS opcua_sources (
     last_error TEXT,
     updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
     CONSTRAINT opcua_sources_status_chk CHECK (status IN ('connected', 'disconnected', 'degraded', 'error')),
-    CONSTRAINT opcua_sources_poll_chk CHECK (poll_interval_ms BETWEEN 100 AND 60000)
+    CONSTRAINT opcua_sources_poll_chk CHECK (poll_interval_ms BETWEEN 100 AND 60000),
+    CONSTRAINT opcua_sources_read_mode_chk CHECK (read_mode IN ('poll', 'subscribe')),
+    CONSTRAINT opcua_sources_subscription_chk CHECK (publishing_interval_ms > 0 AND sampling_interval_ms >= 0 AND queue_size > 0)
 );
 
--- Необязательная история снапшотов метрик (если web-сервис решит сохранять значения)
+-- Необязательная история снапшотов метрик (если web-сервис решит сохранять значения).
+-- Секционирована по суткам (UTC): старые данные удаляются целыми секциями, вставка не раздувает общий индекс.
+-- Ключ секционирования обязан входить в первичный ключ, поэтому PK — (timestamp_utc, id).
 CREATE TABLE IF NOT EXISTS metric_snapshots (
-    id BIGSERIAL PRIMARY KEY,
+    id BIGSERIAL,
     source_id UUID REFERENCES opcua_sources(id) ON DELETE SET NULL,
     timestamp_utc TIMESTAMPTZ NOT NULL,
     temperature_c DOUBLE PRECISION,
@@ -98,11 +120,124 @@ CREATE TABLE IF NOT EXISTS metric_snapshots (
     uptime_seconds BIGINT,
     supply_voltage_v DOUBLE PRECISION,
     raw_payload JSONB,
-    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
-);
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (timestamp_utc, id)
+) PARTITION BY RANGE (timestamp_utc);
+
+-- Строки вне созданных секций (например, воспроизведение старого трейса) попадают сюда
+CREATE TABLE IF NOT EXISTS metric_snapshots_default PARTITION OF metric_snapshots DEFAULT;
+
+-- Время вставки монотонно растёт, так что для диапазонов по времени хватает BRIN вместо B-tree
+CREATE INDEX IF NOT EXISTS idx_metric_snapshots_ts ON metric_snapshots USING brin (timestamp_utc);
+-- Один снапшот на источник и момент: повтор пакета после потерянного подтверждения COMMIT не дублирует строки и агрегаты
+-- (вставка идёт с ON CONFLICT DO NOTHING). Строки удалённых источников (source_id IS NULL) не сравниваются.
+-- Это тот же B-tree по (source_id, timestamp_utc), что нужен запросам истории по источнику, только уникальный: новых
+-- индексов на вставку не добавляется (BRIN по времени остаётся единственным вторым), цена — проверка конфликта перед
+-- вставкой строки, ещё один спуск по этому индексу, обычно по уже горячим страницам правого края.
+CREATE UNIQUE INDEX IF NOT EXISTS uq_metric_snapshots_source_ts ON metric_snapshots(source_id, timestamp_utc DESC);
+
+-- Агрегаты metric_snapshots по минутам и часам; web-сервис обновляет их в той же транзакции, что и вставку снапшотов.
+-- avg = <metric>_sum / <metric>_count (count — число строк, где метрика не NULL; samples — все строки бакета),
+-- last — значение снапшота с наибольшим timestamp_utc в бакете (last_at).
+CREATE TABLE IF NOT EXISTS metric_rollup_1m (
+    source_id UUID NOT NULL REFERENCES opcua_sources(id) ON DELETE CASCADE,
+    bucket_utc TIMESTAMPTZ NOT NULL,
+    samples BIGINT NOT NULL,
+    last_at TIMESTAMPTZ NOT NULL,
+    temperature_c_min DOUBLE PRECISION,
+    temperature_c_max DOUBLE PRECISION,
+    temperature_c_sum DOUBLE PRECISION,
+    temperature_c_last DOUBLE PRECISION,
+    temperature_c_count BIGINT NOT NULL DEFAULT 0,
+    cpu_load_percent_min DOUBLE PRECISION,
+    cpu_load_percent_max DOUBLE PRECISION,
+    cpu_load_percent_sum DOUBLE PRECISION,
+    cpu_load_percent_last DOUBLE PRECISION,
+    cpu_load_percent_count BIGINT NOT NULL DEFAULT 0,
+    ram_load_percent_min DOUBLE PRECISION,
+    ram_load_percent_max DOUBLE PRECISION,
+    ram_load_percent_sum DOUBLE PRECISION,
+    ram_load_percent_last DOUBLE PRECISION,
+    ram_load_percent_count BIGINT NOT NULL DEFAULT 0,
+    uptime_seconds_min BIGINT,
+    uptime_seconds_max BIGINT,
+    uptime_seconds_sum DOUBLE PRECISION,
+    uptime_seconds_last BIGINT,
+    uptime_seconds_count BIGINT NOT NULL DEFAULT 0,
+    supply_voltage_v_min DOUBLE PRECISION,
+    supply_voltage_v_max DOUBLE PRECISION,
+    supply_voltage_v_sum DOUBLE PRECISION,
+    supply_voltage_v_last DOUBLE PRECISION,
+    supply_voltage_v_count BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (source_id, bucket_utc)
+) PARTITION BY RANGE (bucket_utc);
+
+CREATE TABLE IF NOT EXISTS metric_rollup_1m_default PARTITION OF metric_rollup_1m DEFAULT;
+
+CREATE TABLE IF NOT EXISTS metric_rollup_1h (
+    LIKE metric_rollup_1m INCLUDING DEFAULTS,
+    PRIMARY KEY (source_id, bucket_utc),
+    FOREIGN KEY (source_id) REFERENCES opcua_sources(id) ON DELETE CASCADE
+) PARTITION BY RANGE (bucket_utc);
+
+CREATE TABLE IF NOT EXISTS metric_rollup_1h_default PARTITION OF metric_rollup_1h DEFAULT;
+
+-- Создаёт `count` секций <parent>_pYYYYMMDD по `step` (1 day, 1 month), начиная с first_start; возвращает число новых.
+-- Строки этих диапазонов, уже попавшие в <parent>_default, переносятся в новую секцию.
+-- Вызывается при инициализации и периодически самим web-сервисом (несколько экземпляров сериализуются advisory lock).
+CREATE OR REPLACE FUNCTION ensure_time_partitions(parent TEXT, first_start TIMESTAMPTZ, step INTERVAL, count INTEGER) RETURNS INTEGER AS $$
+DECLARE
+    key_column TEXT := substring(pg_get_partkeydef(parent::regclass) FROM '\((.*)\)');
+    lo TIMESTAMPTZ;
+    hi TIMESTAMPTZ;
+    part_name TEXT;
+    created INTEGER := 0;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('time_partitions:' || parent));
+    FOR i IN 0 .. count - 1 LOOP
+        -- арифметика в UTC, чтобы границы суток/месяцев не зависели от TimeZone сессии
+        lo := ((first_start AT TIME ZONE 'UTC') + step * i) AT TIME ZONE 'UTC';
+        hi := ((first_start AT TIME ZONE 'UTC') + step * (i + 1)) AT TIME ZONE 'UTC';
+        part_name := parent || '_p' || to_char(lo AT TIME ZONE 'UTC', 'YYYYMMDD');
+        CONTINUE WHEN to_regclass(part_name) IS NOT NULL;
+        EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', part_name, parent);
+        EXECUTE format(
+            'WITH moved AS (DELETE FROM %I WHERE %I >= %L AND %I < %L RETURNING *) INSERT INTO %I SELECT * FROM moved',
+            parent || '_default', key_column, lo, key_column, hi, part_name
+        );
+        EXECUTE format('ALTER TABLE %I ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)', parent, part_name, lo, hi);
+        created := created + 1;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
 
-CREATE INDEX IF NOT EXISTS idx_metric_snapshots_ts ON metric_snapshots(timestamp_utc DESC);
-CREATE INDEX IF NOT EXISTS idx_metric_snapshots_source_ts ON metric_snapshots(source_id, timestamp_utc DESC);
+-- Политика хранения: удаляет целиком секции <parent>, чья верхняя граница не позже cutoff, и старые строки из
+-- <parent>_default (DELETE только там, где секции нет). Возвращает число удалённых секций.
+CREATE OR REPLACE FUNCTION drop_expired_partitions(parent TEXT, cutoff TIMESTAMPTZ) RETURNS INTEGER AS $$
+DECLARE
+    key_column TEXT := substring(pg_get_partkeydef(parent::regclass) FROM '\((.*)\)');
+    part RECORD;
+    dropped INTEGER := 0;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('time_partitions:' || parent));
+    FOR part IN
+        SELECT c.relname, substring(pg_get_expr(c.relpartbound, c.oid) FROM 'TO \(''([^'']+)''\)')::timestamptz AS upper_bound
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = parent::regclass
+    LOOP
+        CONTINUE WHEN part.upper_bound IS NULL OR part.upper_bound > cutoff;
+        EXECUTE format('DROP TABLE %I', part.relname);
+        dropped := dropped + 1;
+    END LOOP;
+    EXECUTE format('DELETE FROM %I WHERE %I < %L', parent || '_default', key_column, cutoff);
+    RETURN dropped;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT ensure_time_partitions('metric_snapshots', date_trunc('day', now(), 'UTC') - interval '1 day', interval '1 day', 4);
+SELECT ensure_time_partitions('metric_rollup_1m', date_trunc('day', now(), 'UTC') - interval '1 day', interval '1 day', 4);
+SELECT ensure_time_partitions('metric_rollup_1h', date_trunc('month', now(), 'UTC'), interval '1 month', 2);
 
 -- Триггер на updated_at для users/opcua_sources
 CREATE OR REPLACE FUNCTION set_updated_at() RETURNS trigger AS $$
@@ -122,6 +257,44 @@ CREATE TRIGGER trg_opcua_sources_updated_at
 BEFORE UPDATE ON opcua_sources
 FOR EACH ROW EXECUTE FUNCTION set_updated_at();
 
+-- Рассылка отзыва токенов всем воркерам шлюза: payload "<token_key> <revoked_at epoch> <expires_at epoch>"
+CREATE OR REPLACE FUNCTION notify_token_revoked() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify(
+        'token_revoked',
+        NEW.token_key || ' ' || extract(epoch FROM NEW.revoked_at) || ' ' || extract(epoch FROM NEW.expires_at)
+    );
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_revoked_tokens_notify ON revoked_tokens;
+CREATE TRIGGER trg_revoked_tokens_notify
+AFTER INSERT ON revoked_tokens
+FOR EACH ROW EXECUTE FUNCTION notify_token_revoked();
+
+-- Инвалидация кэша пользователей в воркерах шлюза: payload — id пользователя. Обновление
+-- last_login_at/password_hash (каждый логин) уведомления не вызывает.
+CREATE OR REPLACE FUNCTION notify_user_changed() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('user_changed', OLD.id::text);
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_users_changed_notify ON users;
+CREATE TRIGGER trg_users_changed_notify
+AFTER UPDATE ON users
+FOR EACH ROW
+WHEN (OLD.role IS DISTINCT FROM NEW.role OR OLD.is_active IS DISTINCT FROM NEW.is_active
+      OR OLD.email IS DISTINCT FROM NEW.email OR OLD.username IS DISTINCT FROM NEW.username)
+EXECUTE FUNCTION notify_user_changed();
+
+DROP TRIGGER IF EXISTS trg_users_deleted_notify ON users;
+CREATE TRIGGER trg_users_deleted_notify
+AFTER DELETE ON users
+FOR EACH ROW EXECUTE FUNCTION notify_user_changed();
+
 -- Seed минимального admin пользователя (пароль нужно сменить после старта)
 -- Пароль-заглушка: CHANGE_ME (хэш должен быть заменён приложением/миграцией под выбранный алгоритм)
 INSERT INTO users (email, username, password_hash, display_name, role)